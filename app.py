@@ -5,6 +5,12 @@ import signal
 import sys
 import time
 
+if "--profile-startup" in sys.argv:
+    # 需要在导入其它模块之前开启
+    from common import import_profiler
+
+    import_profiler.enable()
+
 from channel import channel_factory
 from common import const
 from config import load_config
@@ -37,6 +43,11 @@ def start_channel(channel_name: str):
             threading.Thread(target=linkai_client.start, args=(channel,)).start()
         except Exception as e:
             pass
+    if "--profile-startup" in sys.argv:
+        from common import import_profiler
+
+        logger.info("[App] startup profile:\n" + import_profiler.report())
+        import_profiler.disable()
     channel.startup()
 
 
@@ -2,12 +2,18 @@
 Auto-replay chat robot abstract class
 """
 
+import asyncio
+import contextvars
 
 from bridge.context import Context
 from bridge.reply import Reply
+from common.worker_pool import get_worker_pool
 
 
 class Bot(object):
+    cancellable = False  # reply是否响应context中的cancel_token，被取消时立即结束请求并释放线程
+    async_cancellable = False  # reply_async是否响应取消，默认实现在线程池中运行reply，取消后线程仍会阻塞到请求返回
+
     def reply(self, query, context: Context = None) -> Reply:
         """
         bot auto-reply content
@@ -15,3 +21,14 @@ class Bot(object):
         :return: reply content
         """
         raise NotImplementedError
+
+    async def reply_async(self, query, context: Context = None) -> Reply:
+        """
+        async version of reply, used when async_mode is on.
+        by default the sync reply runs in the llm worker pool, bots with native async clients should override it
+        :param req: received message
+        :return: reply content
+        """
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()  # 线程池中保持重试截止时间等上下文
+        return await loop.run_in_executor(get_worker_pool("llm"), ctx.run, self.reply, query, context)
@@ -72,5 +72,9 @@ def create_bot(bot_type):
         from bot.modelscope.modelscope_bot import ModelScopeBot
         return ModelScopeBot()
 
+    elif bot_type == const.ROUTER:
+        from bot.router.router_bot import RouterBot
+        return RouterBot()
+
 
     raise RuntimeError
@@ -1,24 +1,26 @@
 # encoding:utf-8
 
-import time
-
+import asyncio
 import openai
 import openai.error
 import requests
-from common import const, utils
+from common import const, utils, http_client, retry
 from bot.bot import Bot
 from bot.chatgpt.chat_gpt_session import ChatGPTSession
 from bot.openai.open_ai_image import OpenAIImage
 from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common.cancellation import RequestCancelled, get_cancel_token, run_cancellable
 from common.log import logger
-from common.token_bucket import TokenBucket
-from config import conf, load_config
+from common.token_bucket import rate_limiter_from_conf
+from config import conf, conf_snapshot, load_config
 from bot.baidu.baidu_wenxin_session import BaiduWenxinSession
 
 # OpenAI对话模型API (可用)
 class ChatGPTBot(Bot, OpenAIImage):
+    async_cancellable = True  # 同步请求阻塞在openai接口中无法中途取消，只有异步请求能立即结束
+
     def __init__(self):
         super().__init__()
         # set the default api_key
@@ -28,10 +30,8 @@ class ChatGPTBot(Bot, OpenAIImage):
         proxy = conf().get("proxy")
         if proxy:
             openai.proxy = proxy
-        if conf().get("rate_limit_chatgpt"):
-            self.tb4chatgpt = TokenBucket(conf().get("rate_limit_chatgpt", 20))
         conf_model = conf().get("model") or "gpt-3.5-turbo"
-        self.sessions = SessionManager(ChatGPTSession, model=conf().get("model") or "gpt-3.5-turbo")
+        self.sessions = SessionManager(ChatGPTSession, namespace=type(self).__name__, model=conf().get("model") or "gpt-3.5-turbo")
         # o1相关模型不支持system prompt，暂时用文心模型的session
 
         self.args = {
@@ -50,7 +50,7 @@ class ChatGPTBot(Bot, OpenAIImage):
             for key in remove_keys:
                 self.args.pop(key, None)  # 如果键不存在，使用 None 来避免抛出错、
             if conf_model in [const.O1, const.O1_MINI]:  # o1系列模型不支持系统提示词，使用文心模型的session
-                self.sessions = SessionManager(BaiduWenxinSession, model=conf().get("model") or const.O1_MINI)
+                self.sessions = SessionManager(BaiduWenxinSession, namespace=type(self).__name__, model=conf().get("model") or const.O1_MINI)
 
     def reply(self, query, context=None):
         # acquire reply content
@@ -58,50 +58,23 @@ class ChatGPTBot(Bot, OpenAIImage):
             logger.info("[CHATGPT] query={}".format(query))
 
             session_id = context["session_id"]
-            reply = None
-            clear_memory_commands = conf().get("clear_memory_commands", ["#清除记忆"])
-            if query in clear_memory_commands:
-                self.sessions.clear_session(session_id)
-                reply = Reply(ReplyType.INFO, "记忆已清除")
-            elif query == "#清除所有":
-                self.sessions.clear_all_session()
-                reply = Reply(ReplyType.INFO, "所有人记忆已清除")
-            elif query == "#更新配置":
-                load_config()
-                reply = Reply(ReplyType.INFO, "配置已更新")
+            reply = self._reply_command(query, session_id)
             if reply:
                 return reply
-            session = self.sessions.session_query(query, session_id)
-            logger.debug("[CHATGPT] session query={}".format(session.messages))
-
-            api_key = context.get("openai_api_key")
-            model = context.get("gpt_model")
-            new_args = None
-            if model:
-                new_args = self.args.copy()
-                new_args["model"] = model
-            # if context.get('stream'):
-            #     # reply in stream
-            #     return self.reply_text_stream(query, new_query, session_id)
-
-            reply_content = self.reply_text(session, api_key, args=new_args)
-            logger.debug(
-                "[CHATGPT] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
-                    session.messages,
-                    session_id,
-                    reply_content["content"],
-                    reply_content["completion_tokens"],
-                )
-            )
-            if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
-                reply = Reply(ReplyType.ERROR, reply_content["content"])
-            elif reply_content["completion_tokens"] > 0:
-                self.sessions.session_reply(reply_content["content"], session_id, reply_content["total_tokens"])
-                reply = Reply(ReplyType.TEXT, reply_content["content"])
-            else:
-                reply = Reply(ReplyType.ERROR, reply_content["content"])
-                logger.debug("[CHATGPT] reply {} used 0 tokens.".format(reply_content))
-            return reply
+            session, api_key, new_args = self._prepare_query(query, context)
+            cancel_token = get_cancel_token(context)
+            try:
+                if context.get("stream"):
+                    # reply in stream
+                    return self.reply_text_stream(session, api_key, args=new_args, cancel_token=cancel_token)
+
+                reply_content = self.reply_text(session, api_key, args=new_args, cancel_token=cancel_token)
+                if cancel_token:  # 请求期间会话被重置或问题被取代，丢弃回复，不写入会话记录
+                    cancel_token.raise_if_cancelled()
+            except RequestCancelled:
+                self.sessions.session_discard_query(query, session_id)
+                raise
+            return self._build_reply(session_id, session, reply_content)
 
         elif context.type == ContextType.IMAGE_CREATE:
             ok, retstring = self.create_img(query, 0)
@@ -115,62 +88,206 @@ class ChatGPTBot(Bot, OpenAIImage):
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
-    def reply_text(self, session: ChatGPTSession, api_key=None, args=None, retry_count=0) -> dict:
+    async def reply_async(self, query, context=None):
+        if context.type != ContextType.TEXT or context.get("stream"):
+            return await super().reply_async(query, context)
+        logger.info("[CHATGPT] query={}".format(query))
+        session_id = context["session_id"]
+        reply = self._reply_command(query, session_id)
+        if reply:
+            return reply
+        session, api_key, new_args = self._prepare_query(query, context)
+        cancel_token = get_cancel_token(context)
+        try:
+            # 取消时中断正在进行的请求
+            reply_content = await run_cancellable(self.reply_text_async(session, api_key, args=new_args), cancel_token)
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+        except (RequestCancelled, asyncio.CancelledError):
+            self.sessions.session_discard_query(query, session_id)
+            raise
+        return self._build_reply(session_id, session, reply_content)
+
+    def _reply_command(self, query, session_id):
+        clear_memory_commands = conf_snapshot().get("clear_memory_commands", ["#清除记忆"])
+        if query in clear_memory_commands:
+            self.sessions.clear_session(session_id)
+            return Reply(ReplyType.INFO, "记忆已清除")
+        elif query == "#清除所有":
+            self.sessions.clear_all_session()
+            return Reply(ReplyType.INFO, "所有人记忆已清除")
+        elif query == "#更新配置":
+            load_config()
+            return Reply(ReplyType.INFO, "配置已更新")
+        return None
+
+    def _prepare_query(self, query, context):
+        session = self.sessions.session_query(query, context["session_id"])
+        logger.debug("[CHATGPT] session query={}".format(session.messages))
+
+        api_key = context.get("openai_api_key")
+        model = context.get("gpt_model")
+        new_args = None
+        if model:
+            new_args = self.args.copy()
+            new_args["model"] = model
+        return session, api_key, new_args
+
+    def _build_reply(self, session_id, session, reply_content):
+        logger.debug(
+            "[CHATGPT] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
+                session.messages,
+                session_id,
+                reply_content["content"],
+                reply_content["completion_tokens"],
+            )
+        )
+        if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
+            reply = Reply(ReplyType.ERROR, reply_content["content"])
+        elif reply_content["completion_tokens"] > 0:
+            self.sessions.session_reply(reply_content["content"], session_id, reply_content["total_tokens"])
+            reply = Reply(ReplyType.TEXT, reply_content["content"])
+        else:
+            reply = Reply(ReplyType.ERROR, reply_content["content"])
+            logger.debug("[CHATGPT] reply {} used 0 tokens.".format(reply_content))
+        return reply
+
+    def reply_text(self, session: ChatGPTSession, api_key=None, args=None, retry_count=0, cancel_token=None) -> dict:
         """
         call openai's ChatCompletion to get the answer
         :param session: a conversation session
         :param session_id: session id
         :param retry_count: retry count
+        :param cancel_token: stop waiting for rate limit or retry once cancelled
         :return: {}
         """
         try:
-            if conf().get("rate_limit_chatgpt") and not self.tb4chatgpt.get_token():
-                raise openai.error.RateLimitError("RateLimitError: rate limit exceeded")
+            self._acquire(api_key, cancel_token)
             # if api_key == None, the default openai.api_key will be used
             if args is None:
                 args = self.args
             response = openai.ChatCompletion.create(api_key=api_key, messages=session.messages, **args)
-            # logger.debug("[CHATGPT] response={}".format(response))
-            logger.info("[ChatGPT] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
-            return {
-                "total_tokens": response["usage"]["total_tokens"],
-                "completion_tokens": response["usage"]["completion_tokens"],
-                "content": response.choices[0]["message"]["content"],
-            }
+            return self._parse_response(response)
+        except RequestCancelled:
+            raise
         except Exception as e:
-            need_retry = retry_count < 2
-            result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
-            if isinstance(e, openai.error.RateLimitError):
-                logger.warn("[CHATGPT] RateLimitError: {}".format(e))
-                result["content"] = "提问太快啦，请休息一下再问我吧"
-                if need_retry:
-                    time.sleep(20)
-            elif isinstance(e, openai.error.Timeout):
-                logger.warn("[CHATGPT] Timeout: {}".format(e))
-                result["content"] = "我没有收到你的消息"
-                if need_retry:
-                    time.sleep(5)
-            elif isinstance(e, openai.error.APIError):
-                logger.warn("[CHATGPT] Bad Gateway: {}".format(e))
-                result["content"] = "请再问我一次"
-                if need_retry:
-                    time.sleep(10)
-            elif isinstance(e, openai.error.APIConnectionError):
-                logger.warn("[CHATGPT] APIConnectionError: {}".format(e))
-                result["content"] = "我连接不到你的网络"
-                if need_retry:
-                    time.sleep(5)
+            result, retry_delay = self._handle_error(e, session)
+            if retry_delay is not None and retry.wait(retry_count, retry_delay, e, cancel_token):
+                logger.warn("[CHATGPT] 第{}次重试".format(retry_count + 1))
+                return self.reply_text(session, api_key, args, retry_count + 1, cancel_token)
             else:
-                logger.exception("[CHATGPT] Exception: {}".format(e))
-                need_retry = False
-                self.sessions.clear_session(session.session_id)
+                return result
+
+    def _acquire(self, api_key, cancel_token=None):
+        limiter = rate_limiter_from_conf("chatgpt")  # 按 API key 限流，所有 ChatGPT 类 bot 共用额度
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
+        if limiter and not limiter.get_token(api_key, cancel_token=cancel_token):
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+            raise openai.error.RateLimitError("RateLimitError: rate limit exceeded")
+
+    def reply_text_stream(self, session: ChatGPTSession, api_key=None, args=None, cancel_token=None) -> Reply:
+        """
+        call openai's ChatCompletion with stream=True
+        :return: a TEXT_STREAM reply which yields content deltas, the full content is saved to the session when the stream ends
+        """
+        try:
+            self._acquire(api_key, cancel_token)
+            if args is None:
+                args = self.args
+            response = openai.ChatCompletion.create(api_key=api_key, messages=session.messages, stream=True, **args)
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            result, _ = self._handle_error(e, session)
+            return Reply(ReplyType.ERROR, result["content"])
+        query = session.messages[-1]["content"]  # session_query添加的提问，取消时从会话中移除
+        return Reply(ReplyType.TEXT_STREAM, self._iter_stream(session, response, cancel_token, query))
 
-            if need_retry:
+    def _iter_stream(self, session: ChatGPTSession, response, cancel_token=None, query=None):
+        content = ""
+        try:
+            for chunk in response:
+                if cancel_token and cancel_token.cancelled:
+                    # 关闭连接停止生成，已生成的部分不写入会话
+                    logger.info("[ChatGPT] stream cancelled")
+                    getattr(response, "close", lambda: None)()
+                    if query is not None:
+                        self.sessions.session_discard_query(query, session.session_id)
+                    return
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].get("delta", {}).get("content")
+                if delta:
+                    content += delta
+                    yield delta
+        except Exception as e:
+            result, _ = self._handle_error(e, session)
+            if not content:
+                yield result["content"]
+            return
+        logger.info("[ChatGPT] stream reply={}".format(content))
+        self.sessions.session_reply(content, session.session_id)
+
+    async def reply_text_async(self, session: ChatGPTSession, api_key=None, args=None, retry_count=0) -> dict:
+        """
+        async version of reply_text, waits on the event loop instead of holding a thread
+        """
+        try:
+            limiter = rate_limiter_from_conf("chatgpt")  # 按 API key 限流，所有 ChatGPT 类 bot 共用额度
+            if limiter and not await limiter.get_token_async(api_key):
+                raise openai.error.RateLimitError("RateLimitError: rate limit exceeded")
+            if args is None:
+                args = self.args
+            response = await openai.ChatCompletion.acreate(api_key=api_key, messages=session.messages, **args)
+            return self._parse_response(response)
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            result, retry_delay = self._handle_error(e, session)
+            if retry_delay is not None and await retry.wait_async(retry_count, retry_delay, e):
                 logger.warn("[CHATGPT] 第{}次重试".format(retry_count + 1))
-                return self.reply_text(session, api_key, args, retry_count + 1)
+                return await self.reply_text_async(session, api_key, args, retry_count + 1)
             else:
                 return result
 
+    def _parse_response(self, response) -> dict:
+        # logger.debug("[CHATGPT] response={}".format(response))
+        logger.info("[ChatGPT] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
+        return {
+            "total_tokens": response["usage"]["total_tokens"],
+            "completion_tokens": response["usage"]["completion_tokens"],
+            "content": response.choices[0]["message"]["content"],
+        }
+
+    def _handle_error(self, e, session: ChatGPTSession):
+        """
+        :return: (失败时的结果, 重试的基础等待秒数，不需要重试时为None)
+        """
+        result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
+        retry_delay = None
+        if isinstance(e, openai.error.RateLimitError):
+            logger.warn("[CHATGPT] RateLimitError: {}".format(e))
+            result["content"] = "提问太快啦，请休息一下再问我吧"
+            retry_delay = 20
+        elif isinstance(e, openai.error.Timeout):
+            logger.warn("[CHATGPT] Timeout: {}".format(e))
+            result["content"] = "我没有收到你的消息"
+            retry_delay = 5
+        elif isinstance(e, openai.error.APIError):
+            logger.warn("[CHATGPT] Bad Gateway: {}".format(e))
+            result["content"] = "请再问我一次"
+            retry_delay = 10
+        elif isinstance(e, openai.error.APIConnectionError):
+            logger.warn("[CHATGPT] APIConnectionError: {}".format(e))
+            result["content"] = "我连接不到你的网络"
+            retry_delay = 5
+        else:
+            logger.exception("[CHATGPT] Exception: {}".format(e))
+            self.sessions.clear_session(session.session_id)
+        return result, retry_delay
+
 
 class AzureChatGPTBot(ChatGPTBot):
     def __init__(self):
@@ -193,13 +310,13 @@ class AzureChatGPTBot(ChatGPTBot):
             headers = {"api-key": api_key, "Content-Type": "application/json"}
             try:
                 body = {"prompt": clean_query, "size": conf().get("image_create_size", "256x256"), "n": image_n}
-                submission = requests.post(url, headers=headers, json=body)
+                submission = http_client.post(url, headers=headers, json=body)
                 operation_location = submission.headers['operation-location']
                 status = ""
                 while (status != "succeeded"):
                     if retry_count > 3:
                         return False, "图片生成失败"
-                    response = requests.get(operation_location, headers=headers)
+                    response = http_client.get(operation_location, headers=headers)
                     status = response.json()['status']
                     retry_count += 1
                 image_url = response.json()['result']['data'][0]['url']
@@ -218,7 +335,7 @@ class AzureChatGPTBot(ChatGPTBot):
             headers = {"api-key": api_key, "Content-Type": "application/json"}
             try:
                 body = {"prompt": clean_query, "size": conf().get("image_create_size", "1024x1024"), "quality": conf().get("dalle3_image_quality", "standard")}
-                response = requests.post(url, headers=headers, json=body)
+                response = http_client.post(url, headers=headers, json=body)
                 response.raise_for_status()  # 检查请求是否成功
                 data = response.json()
 
@@ -1,6 +1,9 @@
+import functools
+
 from bot.session_manager import Session
 from common.log import logger
 from common import const
+from common.token_cache import get_token_cache
 
 """
     e.g.  [
@@ -18,6 +21,12 @@ class ChatGPTSession(Session):
         self.model = model
         self.reset()
 
+    def reset(self):
+        super().reset()
+        # 每条消息的token数缓存，与self.messages一一对应，元素为(message, tokens)
+        self._message_tokens = []
+        self._total_tokens = 0
+
     def discard_exceeding(self, max_tokens, cur_tokens=None):
         precise = True
         try:
@@ -29,9 +38,9 @@ class ChatGPTSession(Session):
             logger.debug("Exception when counting tokens precisely for query: {}".format(e))
         while cur_tokens > max_tokens:
             if len(self.messages) > 2:
-                self.messages.pop(1)
+                self._pop_message(1)
             elif len(self.messages) == 2 and self.messages[1]["role"] == "assistant":
-                self.messages.pop(1)
+                self._pop_message(1)
                 if precise:
                     cur_tokens = self.calc_tokens()
                 else:
@@ -50,49 +59,104 @@ class ChatGPTSession(Session):
         return cur_tokens
 
     def calc_tokens(self):
-        return num_tokens_from_messages(self.messages, self.model)
+        self._sync_message_tokens()
+        return self._total_tokens + reply_priming_tokens(self.model)
 
+    def _sync_message_tokens(self):
+        """
+        增量更新每条消息的token数，只对新增或被替换的消息重新编码
+        """
+        cache = self._message_tokens
+        n = len(cache)
+        if n == len(self.messages) and (n == 0 or cache[-1][0] is self.messages[-1]):
+            return
+        if n <= len(self.messages) and (n == 0 or cache[-1][0] is self.messages[n - 1]):
+            start = n  # 常见情况：只在末尾追加了消息
+        else:
+            start = 0
+            limit = min(n, len(self.messages))
+            while start < limit and cache[start][0] is self.messages[start]:
+                start += 1
+            for _, tokens in cache[start:]:
+                self._total_tokens -= tokens
+            del cache[start:]
+        for message in self.messages[start:]:
+            tokens = num_tokens_from_message(message, self.model)
+            cache.append((message, tokens))
+            self._total_tokens += tokens
 
-# refer to https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
-def num_tokens_from_messages(messages, model):
-    """Returns the number of tokens used by a list of messages."""
+    def _pop_message(self, index):
+        message = self.messages.pop(index)
+        cache = self._message_tokens
+        if index < len(cache) and cache[index][0] is message:
+            self._total_tokens -= cache.pop(index)[1]
+        return message
+
+
+def _count_by_character(model):
+    return model in ["wenxin", "xunfei"] or model.startswith(const.GEMINI)
 
-    if model in ["wenxin", "xunfei"] or model.startswith(const.GEMINI):
-        return num_tokens_by_character(messages)
 
+@functools.lru_cache(maxsize=None)
+def _base_model(model):
+    """将模型名归一到计数规则一致的 gpt-3.5-turbo 或 gpt-4"""
+    if model in ["gpt-4", "gpt-4-0314", "gpt-4-0613", "gpt-4-32k", "gpt-4-32k-0613", "gpt-3.5-turbo-0613",
+                 "gpt-3.5-turbo-16k", "gpt-3.5-turbo-16k-0613", "gpt-35-turbo-16k", "gpt-4-turbo-preview",
+                 "gpt-4-1106-preview", const.GPT4_TURBO_PREVIEW, const.GPT4_VISION_PREVIEW, const.GPT4_TURBO_01_25,
+                 const.GPT_4o, const.GPT_4O_0806, const.GPT_4o_MINI, const.LINKAI_4o, const.LINKAI_4_TURBO, const.GPT_5, const.GPT_5_MINI, const.GPT_5_NANO]:
+        return "gpt-4"
+    if model not in ["gpt-3.5-turbo", "gpt-3.5-turbo-0301", "gpt-35-turbo", "gpt-3.5-turbo-1106", "moonshot", const.LINKAI_35] \
+            and not model.startswith("claude-3"):
+        logger.debug(f"num_tokens_from_messages() is not implemented for model {model}. Returning num tokens assuming gpt-3.5-turbo.")
+    return "gpt-3.5-turbo"
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model):
+    """按模型缓存tiktoken编码对象，避免每次计数都重新解析"""
     import tiktoken
 
-    if model in ["gpt-3.5-turbo-0301", "gpt-35-turbo", "gpt-3.5-turbo-1106", "moonshot", const.LINKAI_35]:
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
-    elif model in ["gpt-4-0314", "gpt-4-0613", "gpt-4-32k", "gpt-4-32k-0613", "gpt-3.5-turbo-0613",
-                   "gpt-3.5-turbo-16k", "gpt-3.5-turbo-16k-0613", "gpt-35-turbo-16k", "gpt-4-turbo-preview",
-                   "gpt-4-1106-preview", const.GPT4_TURBO_PREVIEW, const.GPT4_VISION_PREVIEW, const.GPT4_TURBO_01_25,
-                   const.GPT_4o, const.GPT_4O_0806, const.GPT_4o_MINI, const.LINKAI_4o, const.LINKAI_4_TURBO, const.GPT_5, const.GPT_5_MINI, const.GPT_5_NANO]:
-        return num_tokens_from_messages(messages, model="gpt-4")
-    elif model.startswith("claude-3"):
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_for_model(model)
     except KeyError:
         logger.debug("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def reply_priming_tokens(model):
+    if _count_by_character(model):
+        return 0
+    return 3  # every reply is primed with <|start|>assistant<|message|>
+
+
+# refer to https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+def num_tokens_from_messages(messages, model):
+    """Returns the number of tokens used by a list of messages."""
+    num_tokens = 0
+    for message in messages:
+        num_tokens += num_tokens_from_message(message, model)
+    return num_tokens + reply_priming_tokens(model)
+
+
+def num_tokens_from_message(message, model):
+    """Returns the number of tokens used by a single message, excluding reply priming."""
+    if _count_by_character(model):
+        return len(message["content"])
+
+    model = _base_model(model)
+    encoding = get_encoding(model)
+    token_cache = get_token_cache()
     if model == "gpt-3.5-turbo":
         tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
         tokens_per_name = -1  # if there's a name, the role is omitted
-    elif model == "gpt-4":
+    else:
         tokens_per_message = 3
         tokens_per_name = 1
-    else:
-        logger.debug(f"num_tokens_from_messages() is not implemented for model {model}. Returning num tokens assuming gpt-3.5-turbo.")
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
-    num_tokens = 0
-    for message in messages:
-        num_tokens += tokens_per_message
-        for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
-            if key == "name":
-                num_tokens += tokens_per_name
-    num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
+    num_tokens = tokens_per_message
+    for key, value in message.items():
+        num_tokens += token_cache.count(encoding, value)
+        if key == "name":
+            num_tokens += tokens_per_name
     return num_tokens
 
 
@@ -1,5 +1,4 @@
 import re
-import time
 import json
 import uuid
 from curl_cffi import requests
@@ -9,6 +8,7 @@ from bot.openai.open_ai_image import OpenAIImage
 from bot.session_manager import SessionManager
 from bridge.context import Context, ContextType
 from bridge.reply import Reply, ReplyType
+from common import retry
 from common.log import logger
 from config import conf
 
@@ -16,7 +16,7 @@ from config import conf
 class ClaudeAIBot(Bot, OpenAIImage):
     def __init__(self):
         super().__init__()
-        self.sessions = SessionManager(ClaudeAiSession, model=conf().get("model") or "gpt-3.5-turbo")
+        self.sessions = SessionManager(ClaudeAiSession, namespace=type(self).__name__, model=conf().get("model") or "gpt-3.5-turbo")
         self.claude_api_cookie = conf().get("claude_api_cookie")
         self.proxy = conf().get("proxy")
         self.con_uuid_dic = {}
@@ -126,11 +126,6 @@ class ClaudeAIBot(Bot, OpenAIImage):
         :param retry_count: 当前递归重试次数
         :return: 回复
         """
-        if retry_count >= 2:
-            # exit from retry 2 times
-            logger.warn("[CLAUDEAI] failed after maximum number of retry times")
-            return Reply(ReplyType.ERROR, "请再问我一次吧")
-
         try:
             session_id = context["session_id"]
             if self.org_uuid is None:
@@ -207,16 +202,16 @@ class ClaudeAIBot(Bot, OpenAIImage):
                 logger.error(f"[CLAUDE] chat failed, status_code={res.status_code}, "
                              f"msg={error.get('message')}, type={error.get('type')}, detail: {res.text}, uuid: {con_uuid}")
 
-                if res.status_code >= 500:
+                if res.status_code >= 500 and retry.wait(retry_count, 2, res):
                     # server error, need retry
-                    time.sleep(2)
                     logger.warn(f"[CLAUDE] do retry, times={retry_count}")
                     return self._chat(query, context, retry_count + 1)
                 return Reply(ReplyType.ERROR, "提问太快啦，请休息一下再问我吧")
 
         except Exception as e:
             logger.exception(e)
-            # retry
-            time.sleep(2)
-            logger.warn(f"[CLAUDE] do retry, times={retry_count}")
-            return self._chat(query, context, retry_count + 1)
+            if retry.wait(retry_count, 2, e):
+                logger.warn(f"[CLAUDE] do retry, times={retry_count}")
+                return self._chat(query, context, retry_count + 1)
+            logger.warn("[CLAUDEAI] failed after maximum number of retry times")
+            return Reply(ReplyType.ERROR, "请再问我一次吧")
@@ -4,6 +4,7 @@ from bot.bot import Bot
 from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common import retry
 from common.log import logger
 from config import conf, load_config
 from .dashscope_session import DashscopeSession
@@ -23,7 +24,7 @@ dashscope_models = {
 class DashscopeBot(Bot):
     def __init__(self):
         super().__init__()
-        self.sessions = SessionManager(DashscopeSession, model=conf().get("model") or "qwen-plus")
+        self.sessions = SessionManager(DashscopeSession, namespace=type(self).__name__, model=conf().get("model") or "qwen-plus")
         self.model_name = conf().get("model") or "qwen-plus"
         self.api_key = conf().get("dashscope_api_key")
         os.environ["DASHSCOPE_API_KEY"] = self.api_key
@@ -101,17 +102,17 @@ class DashscopeBot(Bot):
                     response.code, response.message
                 ))
                 result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
-                need_retry = retry_count < 2
+                need_retry = True
                 result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
-                if need_retry:
+                if need_retry and retry.wait(retry_count, 1):
                     return self.reply_text(session, retry_count + 1)
                 else:
                     return result
         except Exception as e:
             logger.exception(e)
-            need_retry = retry_count < 2
+            need_retry = True
             result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
-            if need_retry:
+            if need_retry and retry.wait(retry_count, 1, e):
                 return self.reply_text(session, retry_count + 1)
             else:
                 return result
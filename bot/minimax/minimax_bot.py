@@ -1,7 +1,5 @@
 # encoding:utf-8
 
-import time
-
 import openai
 import openai.error
 from bot.bot import Bot
@@ -12,7 +10,7 @@ from bridge.reply import Reply, ReplyType
 from common.log import logger
 from config import conf, load_config
 from bot.chatgpt.chat_gpt_session import ChatGPTSession
-import requests
+from common import http_client, retry
 from common import const
 
 
@@ -41,7 +39,7 @@ class MinimaxBot(Bot):
                 }
             ],
         }
-        self.sessions = SessionManager(MinimaxSession, model=const.MiniMax)
+        self.sessions = SessionManager(MinimaxSession, namespace=type(self).__name__, model=const.MiniMax)
 
     def reply(self, query, context: Context = None) -> Reply:
         # acquire reply content
@@ -107,7 +105,7 @@ class MinimaxBot(Bot):
             self.request_body["messages"].extend(session.messages)
             logger.info("[Minimax_AI] request_body={}".format(self.request_body))
             # logger.info("[Minimax_AI] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
-            res = requests.post(self.base_url, headers=headers, json=self.request_body)
+            res = http_client.post(self.base_url, headers=headers, json=self.request_body)
 
             # self.request_body["messages"].extend(response.json()["choices"][0]["messages"])
             if res.status_code == 200:
@@ -127,25 +125,24 @@ class MinimaxBot(Bot):
                 if res.status_code >= 500:
                     # server error, need retry
                     logger.warn(f"[Minimax_AI] do retry, times={retry_count}")
-                    need_retry = retry_count < 2
+                    need_retry = True
                 elif res.status_code == 401:
                     result["content"] = "授权失败，请检查API Key是否正确"
                 elif res.status_code == 429:
                     result["content"] = "请求过于频繁，请稍后再试"
-                    need_retry = retry_count < 2
+                    need_retry = True
                 else:
                     need_retry = False
 
-                if need_retry:
-                    time.sleep(3)
+                if need_retry and retry.wait(retry_count, 3, res):
                     return self.reply_text(session, args, retry_count + 1)
                 else:
                     return result
         except Exception as e:
             logger.exception(e)
-            need_retry = retry_count < 2
+            need_retry = True
             result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
-            if need_retry:
+            if need_retry and retry.wait(retry_count, 1, e):
                 return self.reply_text(session, args, retry_count + 1)
             else:
                 return result
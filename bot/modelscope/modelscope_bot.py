@@ -1,6 +1,5 @@
 # encoding:utf-8
 
-import time
 import json
 import openai
 import openai.error
@@ -12,14 +11,14 @@ from common.log import logger
 from common import utils
 from config import conf, load_config
 from .modelscope_session import ModelScopeSession
-import requests
+from common import http_client, retry
 
 
 # ModelScope对话模型API
 class ModelScopeBot(Bot):
     def __init__(self):
         super().__init__()
-        self.sessions = SessionManager(ModelScopeSession, model=conf().get("model") or "Qwen/Qwen2.5-7B-Instruct")
+        self.sessions = SessionManager(ModelScopeSession, namespace=type(self).__name__, model=conf().get("model") or "Qwen/Qwen2.5-7B-Instruct")
         model = conf().get("model") or "Qwen/Qwen2.5-7B-Instruct"
         if model == "modelscope":
             model = "Qwen/Qwen2.5-7B-Instruct"
@@ -62,6 +61,11 @@ class ModelScopeBot(Bot):
             if model:
                 new_args["model"] = model
 
+            if context.get("stream"):
+                reply = self.reply_stream(session, args=new_args)
+                if reply:
+                    return reply
+
             if new_args["model"] == "Qwen/QwQ-32B":
                 reply_content = self.reply_text_stream(session, args=new_args)
             else:
@@ -116,7 +120,7 @@ class ModelScopeBot(Bot):
             
             body = args
             body["messages"] = session.messages
-            res = requests.post(
+            res = http_client.post(
                 self.base_url,
                 headers=headers,
                 data=json.dumps(body)
@@ -145,25 +149,24 @@ class ModelScopeBot(Bot):
                 if res.status_code >= 500:
                     # server error, need retry
                     logger.warn(f"[MODELSCOPE_AI] do retry, times={retry_count}")
-                    need_retry = retry_count < 2
+                    need_retry = True
                 elif res.status_code == 401:
                     result["content"] = "授权失败，请检查API Key是否正确"
                 elif res.status_code == 429:
                     result["content"] = "请求过于频繁，请稍后再试"
-                    need_retry = retry_count < 2
+                    need_retry = True
                 else:
                     need_retry = False
 
-                if need_retry:
-                    time.sleep(3)
+                if need_retry and retry.wait(retry_count, 3, res):
                     return self.reply_text(session, args, retry_count + 1)
                 else:
                     return result
         except Exception as e:
             logger.exception(e)
-            need_retry = retry_count < 2
+            need_retry = True
             result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
-            if need_retry:
+            if need_retry and retry.wait(retry_count, 1, e):
                 return self.reply_text(session, args, retry_count + 1)
             else:
                 return result
@@ -186,25 +189,14 @@ class ModelScopeBot(Bot):
             body["messages"] = session.messages
             body["stream"] = True  # 启用流式响应
 
-            res = requests.post(
+            res = http_client.post(
                 self.base_url,
                 headers=headers,
                 data=json.dumps(body),
                 stream=True
             )
             if res.status_code == 200:
-                content = ""
-                for line in res.iter_lines():
-                    if line:
-                        decoded_line = line.decode('utf-8')
-                        if decoded_line.startswith("data: "):
-                            try:
-                                json_data = json.loads(decoded_line[6:])
-                                delta_content = json_data.get("choices", [{}])[0].get("delta", {}).get("content", "")
-                                if delta_content:
-                                    content += delta_content
-                            except json.JSONDecodeError as e:
-                                pass
+                content = "".join(self._iter_stream_content(res))
                 return {
                     "total_tokens": 1,  # 流式响应通常不返回token使用情况
                     "completion_tokens": 1,
@@ -226,28 +218,70 @@ class ModelScopeBot(Bot):
                 if res.status_code >= 500:
                     # server error, need retry
                     logger.warn(f"[MODELSCOPE_AI] do retry, times={retry_count}")
-                    need_retry = retry_count < 2
+                    need_retry = True
                 elif res.status_code == 401:
                     result["content"] = "授权失败，请检查API Key是否正确"
                 elif res.status_code == 429:
                     result["content"] = "请求过于频繁，请稍后再试"
-                    need_retry = retry_count < 2
+                    need_retry = True
                 else:
                     need_retry = False
 
-                if need_retry:
-                    time.sleep(3)
+                if need_retry and retry.wait(retry_count, 3, res):
                     return self.reply_text_stream(session, args, retry_count + 1)
                 else:
                     return result
         except Exception as e:
             logger.exception(e)
-            need_retry = retry_count < 2
+            need_retry = True
             result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
-            if need_retry:
+            if need_retry and retry.wait(retry_count, 1, e):
                 return self.reply_text_stream(session, args, retry_count + 1)
             else:
                 return result
+    def reply_stream(self, session: ModelScopeSession, args=None):
+        """
+        call ModelScope's ChatCompletion with stream response and return the chunks as they arrive
+        :return: a TEXT_STREAM reply, or None if the request failed and should fall back to the non-stream path
+        """
+        try:
+            headers = {
+                "Content-Type": "application/json",
+                "Authorization": "Bearer " + self.api_key
+            }
+            body = dict(args)
+            body["messages"] = session.messages
+            body["stream"] = True
+            res = http_client.post(self.base_url, headers=headers, data=json.dumps(body), stream=True)
+            if res.status_code != 200:
+                logger.warn(f"[MODELSCOPE_AI] stream request failed, status_code={res.status_code}")
+                return None
+        except Exception as e:
+            logger.exception(e)
+            return None
+
+        def stream():
+            content = ""
+            for delta_content in self._iter_stream_content(res):
+                content += delta_content
+                yield delta_content
+            self.sessions.session_reply(content, session.session_id)
+
+        return Reply(ReplyType.TEXT_STREAM, stream())
+
+    def _iter_stream_content(self, res):
+        for line in res.iter_lines():
+            if line:
+                decoded_line = line.decode('utf-8')
+                if decoded_line.startswith("data: "):
+                    try:
+                        json_data = json.loads(decoded_line[6:])
+                        delta_content = json_data.get("choices", [{}])[0].get("delta", {}).get("content", "")
+                        if delta_content:
+                            yield delta_content
+                    except json.JSONDecodeError as e:
+                        pass
+
     def create_img(self, query, retry_count=0):
         try:
             image_n, clean_query = utils.parse_image_n_from_prompt(query, default_n=1, min_n=1, max_n=4)
@@ -267,7 +301,7 @@ class ModelScopeBot(Bot):
             json_payload = json.dumps(payload, ensure_ascii=False).encode('utf-8')
             
             # 使用 data 参数发送原始字符串（requests 会自动处理编码）
-            res = requests.post(url, headers=headers, data=json_payload)
+            res = http_client.post(url, headers=headers, data=json_payload)
             
             response_data = res.json()
             image_url = response_data['images'][0]['url']
@@ -1,7 +1,5 @@
 # encoding:utf-8
 
-import time
-
 import openai
 import openai.error
 from bot.bot import Bot
@@ -11,14 +9,14 @@ from bridge.reply import Reply, ReplyType
 from common.log import logger
 from config import conf, load_config
 from .moonshot_session import MoonshotSession
-import requests
+from common import http_client, retry
 
 
 # ZhipuAI对话模型API
 class MoonshotBot(Bot):
     def __init__(self):
         super().__init__()
-        self.sessions = SessionManager(MoonshotSession, model=conf().get("model") or "moonshot-v1-128k")
+        self.sessions = SessionManager(MoonshotSession, namespace=type(self).__name__, model=conf().get("model") or "moonshot-v1-128k")
         model = conf().get("model") or "moonshot-v1-128k"
         if model == "moonshot":
             model = "moonshot-v1-32k"
@@ -99,7 +97,7 @@ class MoonshotBot(Bot):
             body["messages"] = session.messages
             # logger.debug("[MOONSHOT_AI] response={}".format(response))
             # logger.info("[MOONSHOT_AI] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
-            res = requests.post(
+            res = http_client.post(
                 self.base_url,
                 headers=headers,
                 json=body
@@ -122,25 +120,24 @@ class MoonshotBot(Bot):
                 if res.status_code >= 500:
                     # server error, need retry
                     logger.warn(f"[MOONSHOT_AI] do retry, times={retry_count}")
-                    need_retry = retry_count < 2
+                    need_retry = True
                 elif res.status_code == 401:
                     result["content"] = "授权失败，请检查API Key是否正确"
                 elif res.status_code == 429:
                     result["content"] = "请求过于频繁，请稍后再试"
-                    need_retry = retry_count < 2
+                    need_retry = True
                 else:
                     need_retry = False
 
-                if need_retry:
-                    time.sleep(3)
+                if need_retry and retry.wait(retry_count, 3, res):
                     return self.reply_text(session, args, retry_count + 1)
                 else:
                     return result
         except Exception as e:
             logger.exception(e)
-            need_retry = retry_count < 2
+            need_retry = True
             result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
-            if need_retry:
+            if need_retry and retry.wait(retry_count, 1, e):
                 return self.reply_text(session, args, retry_count + 1)
             else:
                 return result
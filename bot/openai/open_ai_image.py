@@ -1,11 +1,9 @@
-import time
-
 import openai
 import openai.error
 
 from common.log import logger
-from common.token_bucket import TokenBucket
-from common import utils
+from common.token_bucket import rate_limiter_from_conf
+from common import retry, utils
 from config import conf
 
 
@@ -13,12 +11,11 @@ from config import conf
 class OpenAIImage(object):
     def __init__(self):
         openai.api_key = conf().get("open_ai_api_key")
-        if conf().get("rate_limit_dalle"):
-            self.tb4dalle = TokenBucket(conf().get("rate_limit_dalle", 50))
 
     def create_img(self, query, retry_count=0, api_key=None, api_base=None):
         try:
-            if conf().get("rate_limit_dalle") and not self.tb4dalle.get_token():
+            limiter = rate_limiter_from_conf("dalle")
+            if limiter and not limiter.get_token(api_key):
                 return False, "请求太快了，请休息一下再问我吧"
             if conf().get("image_create_use_chat_model"):
                 return self._create_img_by_chat_model(query=query, api_key=api_key, api_base=api_base)
@@ -41,8 +38,7 @@ class OpenAIImage(object):
             return True, image_sources
         except openai.error.RateLimitError as e:
             logger.warn(e)
-            if retry_count < 1:
-                time.sleep(5)
+            if retry.wait(retry_count, 5, e):
                 logger.warn("[OPEN_AI] ImgCreate RateLimit exceed, 第{}次重试".format(retry_count + 1))
                 return self.create_img(query, retry_count + 1)
             else:
@@ -0,0 +1,344 @@
+# encoding:utf-8
+
+"""
+多模型路由
+
+bot_type 配置为 router 时，按 router_bots 中配置的多个 bot 类型(与 bot_type 可选值相同)路由对话请求：
+    健康度: 记录每个 bot 的成功率(指数滑动平均)和最近请求的耗时，按配置顺序优先，成功率低于一半的排到后面；
+          成功率在空闲时逐渐恢复，降级的 bot 之后还会重新成为首选
+    熔断: 连续失败 router_breaker_failures 次后熔断 router_breaker_cooldown 秒，期间不再请求，
+          冷却后放行一个探测请求，成功则恢复，失败则继续熔断
+    故障转移: 请求异常或返回 ERROR 回复时立即改用下一个 bot
+    对冲请求: 文本问答超过当前 bot 最近请求耗时的 p95 仍未返回时，同时请求下一个 bot，先成功的回复生效，其余请求被取消；
+          只在双方都能响应取消(Bot.cancellable，async_mode下为Bot.async_cancellable)时对冲，否则落选的请求会一直占用线程，并在该 bot 的会话中留下没有回复的提问
+每个 bot 各自保存会话记录，切换 bot 后上下文以该 bot 的会话记录为准
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from bot.bot import Bot
+from bot.bot_factory import create_bot
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
+from common.cancellation import CancelToken, RequestCancelled, get_cancel_token
+from common.log import logger
+from common.worker_pool import get_worker_pool
+from config import conf, conf_snapshot
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ProviderHealth(object):
+    """单个 bot 的健康度和熔断状态，由 RouterBot 加锁访问"""
+
+    def __init__(self, bot_type, index):
+        self.bot_type = bot_type
+        self.index = index  # 在 router_bots 中的顺序
+        self.success_rate = 1.0  # 成功率的指数滑动平均
+        self.updated_at = time.monotonic()
+        self.latencies = deque(maxlen=100)  # 最近成功请求的耗时
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False  # 半开状态下是否已有探测请求
+        self.requests = 0
+        self.failures = 0
+        self.hedged = 0  # 作为对冲请求发出的次数
+        self.wins = 0  # 回复被采用的次数
+
+    def recover(self, now, half_life):
+        """距上次请求每过 half_life 秒，失败率减半"""
+        if self.success_rate < 1.0 and half_life:
+            self.success_rate = 1.0 - (1.0 - self.success_rate) * 0.5 ** ((now - self.updated_at) / half_life)
+        self.updated_at = now
+
+    def available(self, now, cooldown) -> bool:
+        if self.state == OPEN and now - self.opened_at >= cooldown:
+            self.state = HALF_OPEN
+            self.probing = False
+        if self.state == HALF_OPEN:
+            return not self.probing
+        return self.state == CLOSED
+
+    def p95(self):
+        if len(self.latencies) < 20:  # 样本太少时不估计
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def on_success(self, latency):
+        self.success_rate = 0.9 * self.success_rate + 0.1
+        self.latencies.append(latency)
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.probing = False
+
+    def on_failure(self, now, threshold):
+        self.failures += 1
+        self.success_rate = 0.9 * self.success_rate
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= threshold:
+            if self.state != OPEN:
+                logger.warning("[Router] circuit open for {}, consecutive_failures={}".format(self.bot_type, self.consecutive_failures))
+            self.state = OPEN
+            self.opened_at = now
+            self.probing = False
+
+    def to_dict(self):
+        latencies = list(self.latencies)
+        return {
+            "state": self.state,
+            "success_rate": round(self.success_rate, 3),
+            "avg_latency": round(sum(latencies) / len(latencies), 3) if latencies else 0,
+            "p95_latency": self.p95(),
+            "requests": self.requests,
+            "failures": self.failures,
+            "hedged": self.hedged,
+            "wins": self.wins,
+        }
+
+
+class _SessionsFanout(object):
+    """让 godcmd 等按 bot.sessions 清除会话的代码同时清除所有 bot 的会话"""
+
+    def __init__(self, router):
+        self._router = router
+
+    def clear_session(self, session_id):
+        for bot in self._router.bots.values():
+            if hasattr(bot, "sessions"):
+                bot.sessions.clear_session(session_id)
+
+    def clear_all_session(self):
+        for bot in self._router.bots.values():
+            if hasattr(bot, "sessions"):
+                bot.sessions.clear_all_session()
+
+
+class RouterBot(Bot):
+    def __init__(self):
+        super().__init__()
+        bot_types = conf().get("router_bots") or []
+        if not bot_types:
+            raise RuntimeError("router_bots is empty")
+        self.bots = {}
+        self.health = {}
+        for index, bot_type in enumerate(bot_types):
+            self.bots[bot_type] = create_bot(bot_type)
+            self.health[bot_type] = ProviderHealth(bot_type, index)
+        self.sessions = _SessionsFanout(self)
+        self._lock = threading.Lock()
+        logger.info("[Router] providers: {}".format(", ".join(bot_types)))
+
+    def _ranked(self):
+        """可用的 bot 按配置顺序排序，成功率低于一半的排在后面；全部熔断时选择最早熔断的一个，不直接拒绝请求"""
+        snapshot = conf_snapshot()
+        cooldown = snapshot.get("router_breaker_cooldown", 30)
+        now = time.monotonic()
+        with self._lock:
+            for health in self.health.values():
+                health.recover(now, cooldown)
+            available = [h for h in self.health.values() if h.available(now, cooldown)]
+            if not available:
+                available = [min(self.health.values(), key=lambda h: h.opened_at)]
+            available.sort(key=lambda h: (h.success_rate < 0.5, h.index))
+            return [h.bot_type for h in available]
+
+    def _hedge_delay(self, bot_type):
+        """超过该秒数仍未返回时发出对冲请求，按该 bot 最近请求耗时的 p95 估计，样本不足时使用 router_hedge_delay"""
+        snapshot = conf_snapshot()
+        with self._lock:
+            p95 = self.health[bot_type].p95()
+        delay = p95 if p95 is not None else snapshot.get("router_hedge_delay", 10)
+        return max(float(delay), 1.0)
+
+    def _start(self, bot_type, hedged):
+        with self._lock:
+            health = self.health[bot_type]
+            health.requests += 1
+            if hedged:
+                health.hedged += 1
+            if health.state == HALF_OPEN:
+                health.probing = True
+        return time.monotonic()
+
+    def _finish(self, bot_type, started_at, ok, won=False):
+        snapshot = conf_snapshot()
+        now = time.monotonic()
+        with self._lock:
+            health = self.health[bot_type]
+            if ok:
+                health.on_success(now - started_at)
+                if won:
+                    health.wins += 1
+            else:
+                health.on_failure(now, snapshot.get("router_breaker_failures", 5))
+
+    def _abandon(self, bot_type):
+        """请求被取消，不计入成功或失败，半开状态下允许重新探测"""
+        with self._lock:
+            self.health[bot_type].probing = False
+
+    @staticmethod
+    def _is_success(reply):
+        return reply is not None and reply.type != ReplyType.ERROR
+
+    @staticmethod
+    def _attempt_context(context: Context):
+        """每个请求使用独立的 context 和取消令牌，原 context 被取消时一并取消"""
+        token = CancelToken()
+        kwargs = dict(context.kwargs)
+        kwargs["cancel_token"] = token
+        parent = get_cancel_token(context)
+        if parent is not None:
+            parent.add_callback(token.cancel)
+        return Context(context.type, context.content, kwargs), token
+
+    @staticmethod
+    def _can_hedge(context: Context):
+        # 只对普通文本问答对冲，画图等有副作用或流式回复不重复请求
+        hedge = conf_snapshot().get("router_hedge", True)
+        return hedge and context.type == ContextType.TEXT and not context.get("stream") and not context.content.startswith("#")
+
+    def _hedge_timeout(self, can_hedge, current, providers, pending, is_async=False):
+        """距发出对冲请求的秒数，不对冲时返回 None；进行中的请求和下一个 bot 都能响应取消时才对冲"""
+        if not can_hedge or not providers:
+            return None
+        attr = "async_cancellable" if is_async else "cancellable"
+        if not getattr(self.bots[providers[0]], attr) or not all(getattr(self.bots[bot_type], attr) for bot_type, _, _ in pending.values()):
+            return None
+        return self._hedge_delay(current)
+
+    @staticmethod
+    def _is_session_command(context: Context):
+        """清除记忆的命令需要发给所有 bot，其它 # 开头的消息按普通请求路由"""
+        if context.type != ContextType.TEXT:
+            return False
+        clear_memory_commands = conf_snapshot().get("clear_memory_commands", ["#清除记忆"])
+        return context.content in clear_memory_commands or context.content == "#清除所有"
+
+    def reply(self, query, context: Context = None) -> Reply:
+        if self._is_session_command(context):
+            return self._broadcast(query, context)
+        providers = self._ranked()
+        can_hedge = self._can_hedge(context)
+        pool = get_worker_pool("router")
+        pending = {}  # future -> (bot_type, started_at, token)
+        last_reply = None
+
+        def launch(hedged):
+            bot_type = providers.pop(0)
+            attempt, token = self._attempt_context(context)
+            started_at = self._start(bot_type, hedged)
+            # 复制上下文，保持Bridge设置的重试截止时间
+            pending[pool.submit(contextvars.copy_context().run, self.bots[bot_type].reply, query, attempt)] = (bot_type, started_at, token)
+            return bot_type
+
+        current = launch(False)
+        try:
+            while pending:
+                timeout = self._hedge_timeout(can_hedge, current, providers, pending)
+                done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+                parent = get_cancel_token(context)
+                if parent is not None:
+                    parent.raise_if_cancelled()
+                if not done:  # 超过p95仍未返回，对冲请求下一个bot
+                    logger.info("[Router] {} slow, hedge with {}".format(current, providers[0]))
+                    current = launch(True)
+                    continue
+                for future in done:
+                    bot_type, started_at, _ = pending.pop(future)
+                    try:
+                        reply = future.result()
+                    except RequestCancelled:
+                        self._abandon(bot_type)
+                        continue
+                    except Exception as e:
+                        logger.warning("[Router] {} failed: {}".format(bot_type, e))
+                        reply = None
+                    if self._is_success(reply):
+                        self._finish(bot_type, started_at, True, won=True)
+                        return reply
+                    self._finish(bot_type, started_at, False)
+                    last_reply = reply or last_reply
+                    if providers:
+                        logger.warning("[Router] {} failed, failover to {}".format(bot_type, providers[0]))
+                        current = launch(False)
+        finally:
+            for bot_type, _, token in pending.values():  # 取消未完成的请求，其回复不再使用
+                token.cancel("hedge lost")
+                self._abandon(bot_type)
+        return last_reply or Reply(ReplyType.ERROR, "我现在有点累了，等会再来吧")
+
+    async def reply_async(self, query, context: Context = None) -> Reply:
+        if self._is_session_command(context):
+            return await super().reply_async(query, context)
+        providers = self._ranked()
+        can_hedge = self._can_hedge(context)
+        pending = {}  # task -> (bot_type, started_at, token)
+        last_reply = None
+
+        def launch(hedged):
+            bot_type = providers.pop(0)
+            attempt, token = self._attempt_context(context)
+            started_at = self._start(bot_type, hedged)
+            pending[asyncio.ensure_future(self.bots[bot_type].reply_async(query, attempt))] = (bot_type, started_at, token)
+            return bot_type
+
+        current = launch(False)
+        try:
+            while pending:
+                timeout = self._hedge_timeout(can_hedge, current, providers, pending, is_async=True)
+                done, _ = await asyncio.wait(list(pending), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logger.info("[Router] {} slow, hedge with {}".format(current, providers[0]))
+                    current = launch(True)
+                    continue
+                for task in done:
+                    bot_type, started_at, _ = pending.pop(task)
+                    try:
+                        reply = task.result()
+                    except (RequestCancelled, asyncio.CancelledError):
+                        self._abandon(bot_type)
+                        continue
+                    except Exception as e:
+                        logger.warning("[Router] {} failed: {}".format(bot_type, e))
+                        reply = None
+                    if self._is_success(reply):
+                        self._finish(bot_type, started_at, True, won=True)
+                        return reply
+                    self._finish(bot_type, started_at, False)
+                    last_reply = reply or last_reply
+                    if providers:
+                        logger.warning("[Router] {} failed, failover to {}".format(bot_type, providers[0]))
+                        current = launch(False)
+        finally:
+            for task, (bot_type, _, token) in pending.items():
+                token.cancel("hedge lost")
+                task.cancel()
+                self._abandon(bot_type)
+        return last_reply or Reply(ReplyType.ERROR, "我现在有点累了，等会再来吧")
+
+    def _broadcast(self, query, context: Context) -> Reply:
+        """清除记忆的命令发给所有 bot，保证各自的会话状态一致，返回第一个 bot 的回复"""
+        first = None
+        for bot_type, bot in self.bots.items():
+            try:
+                reply = bot.reply(query, context)
+            except Exception as e:
+                logger.warning("[Router] {} command failed: {}".format(bot_type, e))
+                reply = None
+            if first is None:
+                first = reply
+        return first
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {bot_type: health.to_dict() for bot_type, health in self.health.items()}
@@ -1,6 +1,6 @@
-from common.expired_dict import ExpiredDict
+from bot.session_store import create_session_store
 from common.log import logger
-from config import conf
+from config import conf, conf_snapshot
 
 
 class Session(object):
@@ -37,14 +37,14 @@ class Session(object):
 
 
 class SessionManager(object):
-    def __init__(self, sessioncls, **session_args):
-        if conf().get("expires_in_seconds"):
-            sessions = ExpiredDict(conf().get("expires_in_seconds"))
-        else:
-            sessions = dict()
-        self.sessions = sessions
+    def __init__(self, sessioncls, namespace=None, **session_args):
+        """
+        namespace: 持久化存储中区分不同bot会话的名称，多个bot共用同一种session类(如ChatGPT、LinkAI、Azure)时需要不同的名称，默认使用session类名
+        """
         self.sessioncls = sessioncls
         self.session_args = session_args
+        self.sessions = create_session_store(namespace or sessioncls.__name__)
+        self.sessions.session_factory = lambda session_id, system_prompt: self.sessioncls(session_id, system_prompt, **self.session_args)
 
     def build_session(self, session_id, system_prompt=None):
         """
@@ -54,33 +54,54 @@ class SessionManager(object):
         if session_id is None:
             return self.sessioncls(session_id, system_prompt, **self.session_args)
 
-        if session_id not in self.sessions:
-            self.sessions[session_id] = self.sessioncls(session_id, system_prompt, **self.session_args)
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessioncls(session_id, system_prompt, **self.session_args)
+            self.sessions[session_id] = session
         elif system_prompt is not None:  # 如果有新的system_prompt，更新并重置session
-            self.sessions[session_id].set_system_prompt(system_prompt)
-        session = self.sessions[session_id]
+            session.set_system_prompt(system_prompt)
+            self.sessions.save(session_id)
         return session
 
     def session_query(self, query, session_id):
         session = self.build_session(session_id)
         session.add_query(query)
         try:
-            max_tokens = conf().get("conversation_max_tokens", 1000)
+            max_tokens = conf_snapshot().get("conversation_max_tokens", 1000)
             total_tokens = session.discard_exceeding(max_tokens, None)
             logger.debug("prompt tokens used={}".format(total_tokens))
         except Exception as e:
             logger.warning("Exception when counting tokens precisely for prompt: {}".format(str(e)))
+        self.sessions.save(session_id)
         return session
 
+    def session_discard_query(self, query, session_id):
+        """
+        请求被取消时移除session_query添加的提问，避免会话中留下没有回复的提问
+        从后往前查找内容相同且还没有回复的提问，会话已被重置时不做处理
+        """
+        session = self.sessions.get(session_id)
+        if session is None:
+            return
+        messages = session.messages
+        for i in range(len(messages) - 1, 0, -1):
+            if messages[i]["role"] == "user" and messages[i]["content"] == query:
+                if i + 1 < len(messages) and messages[i + 1]["role"] == "assistant":
+                    return
+                del messages[i]
+                self.sessions.save(session_id)
+                return
+
     def session_reply(self, reply, session_id, total_tokens=None):
         session = self.build_session(session_id)
         session.add_reply(reply)
         try:
-            max_tokens = conf().get("conversation_max_tokens", 1000)
+            max_tokens = conf_snapshot().get("conversation_max_tokens", 1000)
             tokens_cnt = session.discard_exceeding(max_tokens, total_tokens)
             logger.debug("raw total_tokens={}, savesession tokens={}".format(total_tokens, tokens_cnt))
         except Exception as e:
             logger.warning("Exception when counting tokens precisely for session: {}".format(str(e)))
+        self.sessions.save(session_id)
         return session
 
     def clear_session(self, session_id):
@@ -0,0 +1,304 @@
+"""
+会话存储
+
+SessionManager 通过 SessionStore 读写会话，内置三种后端：
+    memory: 进程内 LRU + TTL，数量有上限
+    sqlite: 本地 SQLite 文件，重启或多进程共享时可以恢复对话
+    redis:  Redis 兼容服务，可传入任意实现了 get/set/delete/pipeline/scan_iter 的客户端
+
+持久化后端前面有一层内存LRU缓存保存活跃会话对象，修改会先标记为脏，由后台线程批量写入
+"""
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from common.expired_dict import ExpiredDict
+from common.log import logger
+from config import conf, get_appdata_dir
+
+_COMPRESS_THRESHOLD = 512  # 序列化后超过该字节数才压缩
+_RAW = b"j"
+_ZLIB = b"z"
+
+
+def dump_session(session) -> bytes:
+    """紧凑序列化会话，只保存人设和消息列表"""
+    data = json.dumps({"s": session.system_prompt, "m": session.messages}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if len(data) > _COMPRESS_THRESHOLD:
+        return _ZLIB + zlib.compress(data)
+    return _RAW + data
+
+
+def load_session(data: bytes):
+    """返回 (system_prompt, messages)"""
+    if data[:1] == _ZLIB:
+        payload = zlib.decompress(data[1:])
+    else:
+        payload = data[1:]
+    obj = json.loads(payload.decode("utf-8"))
+    return obj["s"], obj["m"]
+
+
+class SessionStore(object):
+    """
+    会话存储基类，同时提供 dict 风格的接口供 SessionManager 使用
+    修改了取出的会话对象后需要调用 save 通知存储
+    """
+
+    session_factory = None  # (session_id, system_prompt) -> Session，由SessionManager设置
+
+    def get(self, session_id):
+        raise NotImplementedError
+
+    def set(self, session_id, session):
+        raise NotImplementedError
+
+    def save(self, session_id):
+        """会话对象被原地修改后调用，内存后端无需处理"""
+        pass
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    def __getitem__(self, session_id):
+        session = self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        return session
+
+    def __setitem__(self, session_id, session):
+        self.set(session_id, session)
+
+    def __delitem__(self, session_id):
+        self.delete(session_id)
+
+
+class MemorySessionStore(SessionStore):
+    """
+    LRU + TTL 的内存存储，超过 max_size 时淘汰最久未使用的会话
+    """
+
+    def __init__(self, max_size=None, ttl=None):
+        self._data = ExpiredDict(ttl, max_size)
+
+    def get(self, session_id):
+        return self._data.get(session_id)
+
+    def set(self, session_id, session):
+        self._data[session_id] = session
+
+    def delete(self, session_id):
+        self._data.pop(session_id, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class PersistentSessionStore(SessionStore):
+    """
+    持久化存储基类：内存缓存活跃会话，脏会话由后台线程按 flush_interval 或 batch_size 批量写入
+    子类实现 _read/_write_batch/_delete/_clear
+    """
+
+    def __init__(self, namespace, max_size=None, ttl=None, flush_interval=1, batch_size=100):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._cache = MemorySessionStore(max_size, ttl)
+        self._dirty = OrderedDict()  # session_id -> session，写入前仍可被读取
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        thread = threading.Thread(target=self._flush_loop, name="session_store_flush", daemon=True)
+        thread.start()
+        atexit.register(self.flush)
+
+    def get(self, session_id):
+        session = self._cache.get(session_id)
+        if session is not None:
+            return session
+        with self._lock:
+            session = self._dirty.get(session_id)
+        if session is None:
+            session = self._load(session_id)
+        if session is not None:
+            self._cache.set(session_id, session)
+        return session
+
+    def _load(self, session_id):
+        try:
+            data = self._read(session_id)
+        except Exception as e:
+            logger.warning("[SessionStore] read session {} failed: {}".format(session_id, e))
+            return None
+        if data is None or self.session_factory is None:
+            return None
+        system_prompt, messages = load_session(data)
+        session = self.session_factory(session_id, system_prompt)
+        session.messages = messages
+        return session
+
+    def set(self, session_id, session):
+        self._cache.set(session_id, session)
+        self._mark_dirty(session_id, session)
+
+    def save(self, session_id):
+        session = self._cache.get(session_id)
+        if session is not None:
+            self._mark_dirty(session_id, session)
+
+    def _mark_dirty(self, session_id, session):
+        with self._lock:
+            self._dirty[session_id] = session
+            if len(self._dirty) >= self.batch_size:
+                self._wakeup.set()
+
+    def delete(self, session_id):
+        self._cache.delete(session_id)
+        with self._lock:
+            self._dirty.pop(session_id, None)
+        with self._flush_lock:
+            self._delete(session_id)
+
+    def clear(self):
+        self._cache.clear()
+        with self._lock:
+            self._dirty.clear()
+        with self._flush_lock:
+            self._clear()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, OrderedDict()
+            if not dirty:
+                return
+            try:
+                self._write_batch({session_id: dump_session(session) for session_id, session in dirty.items()})
+            except Exception as e:
+                logger.warning("[SessionStore] write {} sessions failed: {}".format(len(dirty), e))
+                with self._lock:  # 写入失败则放回，下次重试，期间新的修改优先
+                    for session_id, session in dirty.items():
+                        self._dirty.setdefault(session_id, session)
+
+    def _flush_loop(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _read(self, session_id):
+        raise NotImplementedError
+
+    def _write_batch(self, items: dict):
+        raise NotImplementedError
+
+    def _delete(self, session_id):
+        raise NotImplementedError
+
+    def _clear(self):
+        raise NotImplementedError
+
+
+class SqliteSessionStore(PersistentSessionStore):
+    def __init__(self, namespace, path, **kwargs):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")  # 允许其它进程同时读取
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sessions (namespace TEXT, session_id TEXT, data BLOB, updated_at REAL, PRIMARY KEY (namespace, session_id))")
+        self._db_lock = threading.Lock()
+        super().__init__(namespace, **kwargs)
+
+    def _read(self, session_id):
+        with self._db_lock:
+            row = self._conn.execute("SELECT data, updated_at FROM sessions WHERE namespace=? AND session_id=?", (self.namespace, session_id)).fetchone()
+        if row is None:
+            return None
+        if self.ttl and row[1] < time.time() - self.ttl:
+            return None
+        return row[0]
+
+    def _write_batch(self, items: dict):
+        now = time.time()
+        rows = [(self.namespace, session_id, data, now) for session_id, data in items.items()]
+        with self._db_lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany("INSERT OR REPLACE INTO sessions (namespace, session_id, data, updated_at) VALUES (?, ?, ?, ?)", rows)
+                if self.ttl:
+                    self._conn.execute("DELETE FROM sessions WHERE namespace=? AND updated_at<?", (self.namespace, now - self.ttl))
+
+    def _delete(self, session_id):
+        with self._db_lock:
+            self._conn.execute("DELETE FROM sessions WHERE namespace=? AND session_id=?", (self.namespace, session_id))
+
+    def _clear(self):
+        with self._db_lock:
+            self._conn.execute("DELETE FROM sessions WHERE namespace=?", (self.namespace,))
+
+
+class RedisSessionStore(PersistentSessionStore):
+    def __init__(self, namespace, client=None, url=None, **kwargs):
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = "cow:session:{}:".format(namespace)
+        super().__init__(namespace, **kwargs)
+
+    def _read(self, session_id):
+        return self.client.get(self.prefix + session_id)
+
+    def _write_batch(self, items: dict):
+        pipe = self.client.pipeline()
+        for session_id, data in items.items():
+            pipe.set(self.prefix + session_id, data, ex=int(self.ttl) if self.ttl else None)
+        pipe.execute()
+
+    def _delete(self, session_id):
+        self.client.delete(self.prefix + session_id)
+
+    def _clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+
+def create_session_store(namespace) -> SessionStore:
+    """
+    按配置创建会话存储，namespace 用于区分不同bot的会话
+    """
+    backend = conf().get("session_store", "memory")
+    max_size = conf().get("session_max_count", 10000)
+    ttl = conf().get("expires_in_seconds")
+    if backend == "sqlite":
+        path = conf().get("session_store_path") or os.path.join(get_appdata_dir(), "sessions.db")
+        store = SqliteSessionStore(namespace, path, max_size=max_size, ttl=ttl, flush_interval=conf().get("session_store_flush_interval", 1))
+    elif backend == "redis":
+        store = RedisSessionStore(namespace, url=conf().get("session_store_redis_url"), max_size=max_size, ttl=ttl,
+                                  flush_interval=conf().get("session_store_flush_interval", 1))
+    else:
+        if backend != "memory":
+            logger.warning("[SessionStore] unknown session_store {}, fallback to memory".format(backend))
+        return MemorySessionStore(max_size, ttl)
+    logger.info("[SessionStore] use {} session store, namespace={}".format(backend, namespace))
+    return store
@@ -53,7 +53,7 @@ class XunFeiBot(Bot):
         self.host = urlparse(self.spark_url).netloc
         self.path = urlparse(self.spark_url).path
         # 和wenxin使用相同的session机制
-        self.sessions = SessionManager(ChatGPTSession, model=const.XUNFEI)
+        self.sessions = SessionManager(ChatGPTSession, namespace=type(self).__name__, model=const.XUNFEI)
 
     def reply(self, query, context: Context = None) -> Reply:
         if context.type == ContextType.TEXT:
@@ -1,5 +1,6 @@
 from common.log import logger
 from common import utils
+from common.token_bucket import rate_limiter_from_conf
 from config import conf
 
 
@@ -12,7 +13,8 @@ class ZhipuAIImage(object):
 
     def create_img(self, query, retry_count=0, api_key=None, api_base=None):
         try:
-            if conf().get("rate_limit_dalle"):
+            limiter = rate_limiter_from_conf("dalle")
+            if limiter and not limiter.get_token(api_key):
                 return False, "请求太快了，请休息一下再问我吧"
             image_n, clean_query = utils.parse_image_n_from_prompt(query, default_n=1, min_n=1, max_n=4)
             logger.info("[ZHIPU_AI] image_query={}".format(query))
@@ -1,9 +1,11 @@
 from bot.bot_factory import create_bot
+from bridge import reply_cache
 from bridge.context import Context
-from bridge.reply import Reply
-from common import const
+from bridge.reply import Reply, ReplyType
+from common import const, retry
 from common.log import logger
 from common.singleton import singleton
+from common.token_bucket import rate_limiter_from_conf
 from config import conf
 from translate.factory import create_translator
 from voice.factory import create_voice
@@ -83,12 +85,60 @@ class Bridge(object):
         return self.btype[typename]
 
     def fetch_reply_content(self, query, context: Context) -> Reply:
-        return self.get_bot("chat").reply(query, context)
+        bot = self.get_bot("chat")
+        key, reply = self._lookup_reply_cache(bot, query, context)
+        if reply is None:
+            with retry.deadline_scope(conf().get("request_timeout")):  # bot失败重试的总时长不超过request_timeout
+                reply = bot.reply(query, context)
+            self._store_reply_cache(key, reply)
+        return reply
+
+    async def fetch_reply_content_async(self, query, context: Context) -> Reply:
+        bot = self.get_bot("chat")
+        key, reply = self._lookup_reply_cache(bot, query, context)
+        if reply is None:
+            with retry.deadline_scope(conf().get("request_timeout")):
+                reply = await bot.reply_async(query, context)
+            self._store_reply_cache(key, reply)
+        return reply
+
+    def _lookup_reply_cache(self, bot, query, context: Context):
+        """
+        查询问答缓存，返回 (缓存键, 命中时的回复)，未开启缓存时缓存键为 None
+        """
+        try:
+            key = reply_cache.cache_key(bot, self.btype["chat"], query, context)
+            if key is None:
+                return None, None
+            hit = reply_cache.get_reply_cache().get(*key)
+            if hit is None:
+                return key, None
+            content, tier = hit
+            logger.info("[Bridge] reply cache {} hit, query={}".format(tier, query))
+            reply_cache.record_hit(bot, query, context, content)
+            return key, Reply(ReplyType.TEXT, content)
+        except Exception as e:
+            logger.warning("[Bridge] reply cache lookup failed: {}".format(e))
+            return None, None
+
+    @staticmethod
+    def _store_reply_cache(key, reply: Reply):
+        # 只缓存正常的文本回答，错误提示和流式回复不缓存
+        if key is not None and reply and reply.type == ReplyType.TEXT and reply.content:
+            reply_cache.get_reply_cache().put(key[0], key[1], reply.content)
+
+    def _check_voice_rate_limit(self, typename):
+        limiter = rate_limiter_from_conf("voice")
+        return limiter is None or limiter.get_token(self.btype[typename], timeout=30)  # 按语音服务分别限流，最多排队30秒
 
     def fetch_voice_to_text(self, voiceFile) -> Reply:
+        if not self._check_voice_rate_limit("voice_to_text"):
+            return Reply(ReplyType.ERROR, "语音识别请求太快了，请稍后再试")
         return self.get_bot("voice_to_text").voiceToText(voiceFile)
 
     def fetch_text_to_voice(self, text) -> Reply:
+        if not self._check_voice_rate_limit("text_to_voice"):
+            return Reply(ReplyType.ERROR, "语音合成请求太快了，请稍后再试")
         return self.get_bot("text_to_voice").textToVoice(text)
 
     def fetch_translate(self, text, from_lang="", to_lang="en") -> Reply:
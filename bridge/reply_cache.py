@@ -0,0 +1,248 @@
+"""
+问答缓存
+
+大群里经常有人重复问同样的问题，命中缓存时直接返回之前的回答，不再请求大模型。
+缓存键为 (bot类型, 模型, 系统提示词摘要, 最近N轮对话摘要) 组成的分区加上规范化后的问题：
+    精确匹配: 同一分区内规范化后的问题完全相同
+    相似匹配: 可选，同一分区内按字符 n-gram 的 Jaccard 相似度查找最接近的问题，本地计算，不需要联网
+条目写入后 reply_cache_ttl 秒过期，超过 reply_cache_size 时淘汰最久未命中的条目
+"""
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from bridge.context import Context, ContextType
+from common.log import logger
+from config import conf_snapshot
+
+# 只去掉空白和断句用的标点，运算符和代码符号会改变问题的含义(1+1 与 1-1、c++ 与 c)，需要保留；
+# 紧跟字母数字的点号属于小数或代码(1.5、a.b)，也保留
+_IGNORED_CHARS = re.compile(r"[\s。，、？！?!,…~～]+|\.(?!\w)")
+
+
+def normalize_query(query: str) -> str:
+    """全角转半角、转小写并去掉空白和句读标点，"你好 ？" 与 "你好?" 视为同一个问题"""
+    return _IGNORED_CHARS.sub("", unicodedata.normalize("NFKC", query).lower())
+
+
+def ngrams(text: str, n=2) -> frozenset:
+    if len(text) <= n:
+        return frozenset([text])
+    return frozenset(text[i : i + n] for i in range(len(text) - n + 1))
+
+
+def _digest(text) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+class _Entry(object):
+    __slots__ = ("partition", "query", "grams", "content", "expire_at", "hits")
+
+    def __init__(self, partition, query, grams, content, expire_at):
+        self.partition = partition
+        self.query = query
+        self.grams = grams
+        self.content = content
+        self.expire_at = expire_at
+        self.hits = 0
+
+
+class ReplyCache(object):
+    """
+    ttl: 条目有效期(秒)，从写入时开始计算，命中不会延长
+    max_size: 最多缓存的问答数
+    similarity: 相似匹配的 Jaccard 阈值，0 表示只做精确匹配
+    min_similar_len: 规范化后短于该长度的问题不做相似匹配，短问题相似度不可靠
+    """
+
+    def __init__(self, ttl=3600, max_size=1000, similarity=0, ngram=2, min_similar_len=4):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.similarity = similarity
+        self.ngram = ngram
+        self.min_similar_len = min_similar_len
+        self._entries = OrderedDict()  # (partition, query) -> _Entry，按最近命中排序
+        self._index = {}  # partition -> {n-gram: set((partition, query))}，相似匹配用的倒排索引
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def get(self, partition, query):
+        """返回 (回答, 命中方式)，命中方式为 "exact" 或 "similar"，未命中返回 None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live(self._entries.get((partition, query)), now)
+            tier = "exact"
+            if entry is None and self.similarity and len(query) >= self.min_similar_len:
+                entry = self._find_similar(partition, query, now)
+                tier = "similar"
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((entry.partition, entry.query))
+            entry.hits += 1
+            if tier == "exact":
+                self.exact_hits += 1
+            else:
+                self.similar_hits += 1
+            return entry.content, tier
+
+    def put(self, partition, query, content):
+        now = time.monotonic()
+        key = (partition, query)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            grams = ngrams(query, self.ngram) if self.similarity else None
+            self._entries[key] = _Entry(partition, query, grams, content, now + self.ttl if self.ttl else None)
+            if grams:
+                index = self._index.setdefault(partition, {})
+                for gram in grams:
+                    index.setdefault(gram, set()).add(key)
+            self.stores += 1
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _live(self, entry, now):
+        """过期的条目在读取时删除，调用方需持有锁"""
+        if entry is not None and entry.expire_at is not None and entry.expire_at <= now:
+            self._remove((entry.partition, entry.query))
+            self.evictions += 1
+            return None
+        return entry
+
+    def _find_similar(self, partition, query, now):
+        index = self._index.get(partition)
+        if not index:
+            return None
+        grams = ngrams(query, self.ngram)
+        overlaps = {}
+        for gram in grams:
+            for key in index.get(gram, ()):
+                overlaps[key] = overlaps.get(key, 0) + 1
+        best, best_score = None, self.similarity
+        for key, overlap in overlaps.items():
+            entry = self._entries[key]
+            score = overlap / float(len(grams) + len(entry.grams) - overlap)
+            if score >= best_score:
+                best, best_score = entry, score
+        if best is not None:
+            return self._live(best, now)
+        return None
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        if entry.grams:
+            index = self._index.get(entry.partition, {})
+            for gram in entry.grams:
+                keys = index.get(gram)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del index[gram]
+            if not index:
+                self._index.pop(entry.partition, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.exact_hits + self.similar_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.similar_hits) / lookups, 3) if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+        }
+
+
+_cache = None
+_cache_params = None
+_cache_lock = threading.Lock()
+
+
+def get_reply_cache() -> ReplyCache:
+    """按当前配置获取进程内共享的缓存，容量、有效期等参数修改后重新创建"""
+    global _cache, _cache_params
+    snapshot = conf_snapshot()
+    params = (
+        snapshot.get("reply_cache_ttl", 3600),
+        snapshot.get("reply_cache_size", 1000),
+        snapshot.get("reply_cache_similarity", 0),
+    )
+    with _cache_lock:
+        if _cache is None or _cache_params != params:
+            _cache, _cache_params = ReplyCache(*params), params
+        return _cache
+
+
+def reply_cache_stats() -> dict:
+    return get_reply_cache().stats()
+
+
+def _cache_enabled(context: Context) -> bool:
+    """只缓存开启了缓存的群或私聊中的普通文本提问，管理命令不缓存"""
+    if context is None or context.type != ContextType.TEXT or context.content.startswith("#"):
+        return False
+    snapshot = conf_snapshot()
+    if context.get("isgroup", False):
+        groups = snapshot.get("reply_cache_groups") or []
+        msg = context.get("msg")
+        return "ALL_GROUP" in groups or (msg is not None and msg.other_user_nickname in groups)
+    return bool(snapshot.get("reply_cache_single_chat"))
+
+
+def cache_key(bot, bot_type, query, context: Context):
+    """
+    生成缓存键 (分区, 规范化后的问题)，不需要缓存时返回 None
+    需要在 bot 处理之前生成，bot 处理后会话中会多出本轮问答
+    """
+    if not _cache_enabled(context):
+        return None
+    normalized = normalize_query(query)
+    if not normalized:
+        return None
+    snapshot = conf_snapshot()
+    sessions = getattr(bot, "sessions", None)
+    session = None
+    if sessions is not None and hasattr(sessions, "sessions"):
+        try:
+            session = sessions.sessions.get(context["session_id"])
+        except Exception as e:
+            logger.debug("[ReplyCache] load session failed: {}".format(e))
+    system_prompt = getattr(session, "system_prompt", None)
+    if system_prompt is None:
+        system_prompt = snapshot.get("character_desc", "")
+    history = ""
+    turns = int(snapshot.get("reply_cache_history_turns") or 0)
+    if turns > 0 and session is not None:
+        messages = [m for m in getattr(session, "messages", []) if m.get("role") != "system"]
+        history = _digest(repr(messages[-2 * turns :]))
+    model = context.get("gpt_model") or snapshot.get("model") or ""
+    return (bot_type, model, _digest(system_prompt or ""), history), normalized
+
+
+def record_hit(bot, query, context: Context, content):
+    """命中缓存时把本轮问答写入 bot 的会话，保持多轮对话的上下文连贯"""
+    from bot.session_manager import SessionManager
+
+    sessions = getattr(bot, "sessions", None)
+    if isinstance(sessions, SessionManager):
+        session_id = context["session_id"]
+        sessions.session_query(query, session_id)
+        sessions.session_reply(content, session_id)
@@ -2,9 +2,12 @@
 Message sending channel abstract class
 """
 
+import asyncio
+
 from bridge.bridge import Bridge
 from bridge.context import Context
 from bridge.reply import *
+from common.worker_pool import get_worker_pool
 
 
 class Channel(object):
@@ -34,9 +37,35 @@ class Channel(object):
         """
         raise NotImplementedError
 
+    def support_stream(self, context: Context) -> bool:
+        """
+        whether replies to this context can be sent incrementally through send_stream
+        """
+        return False
+
+    def send_stream(self, context: Context, delta: str, content: str, finished: bool):
+        """
+        send a streaming text reply incrementally, called once per segment and once more when the stream ends
+        :param delta: text added since the last call
+        :param content: full text sent so far
+        :param finished: whether the stream has ended
+        """
+        raise NotImplementedError
+
+    async def send_async(self, reply: Reply, context: Context):
+        """
+        async version of send, used when async_mode is on.
+        by default the sync send runs in the send worker pool, channels with native async clients can override it
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_worker_pool("send"), self.send, reply, context)
+
     def build_reply_content(self, query, context: Context = None) -> Reply:
         return Bridge().fetch_reply_content(query, context)
 
+    async def build_reply_content_async(self, query, context: Context = None) -> Reply:
+        return await Bridge().fetch_reply_content_async(query, context)
+
     def build_voice_to_text(self, voice_file) -> Reply:
         return Bridge().fetch_voice_to_text(voice_file)
 
@@ -2,36 +2,47 @@ import os
 import re
 import io
 import base64
+import asyncio
 import threading
 import time
 from asyncio import CancelledError
-from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import Future, InvalidStateError
 
 from bridge.context import *
 from bridge.reply import *
 from channel.channel import Channel
+from common.cancellation import CancelToken, RequestCancelled, is_cancelled
 from common.dequeue import Dequeue
+from common.fair_scheduler import DeficitRoundRobin, SchedulerStats
+from common.token_bucket import get_rate_limiter
 from common import memory
 from common import utils
+from common.worker_pool import get_worker_pool
+from common.trigger_matcher import get_mention_stripper
+from config import conf, conf_snapshot
 from plugins import *
 
-try:
-    from voice.audio_convert import any_to_wav
-except Exception as e:
-    pass
-
-handler_pool = ThreadPoolExecutor(max_workers=8)  # 处理消息的线程池
-
 
 # 抽象类, 它包含了与消息通道无关的通用处理逻辑
 class ChatChannel(Channel):
     name = None  # 登录的用户名
     user_id = None  # 登录的用户id
-    futures = {}  # 记录每个session_id提交到线程池的future对象, 用于重置会话时把没执行的future取消掉，正在执行的不会被取消
-    sessions = {}  # 用于控制并发，每个session_id同时只能有一个context在处理
+    futures = {}  # 记录每个session_id提交到线程池的future对象
+    cancel_tokens = {}  # session_id -> {CancelToken: context}，已调度消息的取消令牌，重置会话时用于取消未执行和正在执行的处理
+    sessions = {}  # 用于控制并发，session_id -> [消息队列, 信号量, flow, 权重]，每个session_id同时只能有一个context在处理
     lock = threading.Lock()  # 用于控制对sessions的访问
+    ready_cond = threading.Condition(lock)  # 有session可调度时唤醒消费线程
+    ready_sessions = DeficitRoundRobin()  # 待调度的session_id，按flow(群或私聊用户)公平轮转，由produce和任务完成回调投递
+    dispatch_stats = SchedulerStats()  # 调度统计
+    debounced = {}  # session_id -> 防抖等待到期的时间，到期后重新投递到ready_sessions
+    loop = None  # async_mode下运行消息处理协程的事件循环
 
     def __init__(self):
+        if conf().get("async_mode", False) and ChatChannel.loop is None:
+            ChatChannel.loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=ChatChannel.loop.run_forever)
+            _loop_thread.setDaemon(True)
+            _loop_thread.start()
         _thread = threading.Thread(target=self.consume)
         _thread.setDaemon(True)
         _thread.start()
@@ -47,9 +58,10 @@ class ChatChannel(Channel):
             context["origin_ctype"] = ctype
         # context首次传入时，receiver是None，根据类型设置receiver
         first_in = "receiver" not in context
+        config = conf_snapshot()
+        triggers = config.triggers
         # 群名匹配过程，设置session_id和receiver
         if first_in:  # context首次传入时，receiver是None，根据类型设置receiver
-            config = conf()
             cmsg = context["msg"]
             user_data = conf().get_user_data(cmsg.from_user_id)
             context["openai_api_key"] = user_data.get("openai_api_key")
@@ -58,23 +70,9 @@ class ChatChannel(Channel):
                 group_name = cmsg.other_user_nickname
                 group_id = cmsg.other_user_id
 
-                group_name_white_list = config.get("group_name_white_list", [])
-                group_name_keyword_white_list = config.get("group_name_keyword_white_list", [])
-                if any(
-                    [
-                        group_name in group_name_white_list,
-                        "ALL_GROUP" in group_name_white_list,
-                        check_contain(group_name, group_name_keyword_white_list),
-                    ]
-                ):
-                    group_chat_in_one_session = conf().get("group_chat_in_one_session", [])
+                if triggers.is_group_white(group_name):
                     session_id = cmsg.actual_user_id
-                    if any(
-                        [
-                            group_name in group_chat_in_one_session,
-                            "ALL_GROUP" in group_chat_in_one_session,
-                        ]
-                    ):
+                    if triggers.is_group_in_one_session(group_name):
                         session_id = group_id
                 else:
                     logger.debug(f"No need reply, groupName not in whitelist, group_name={group_name}")
@@ -99,11 +97,10 @@ class ChatChannel(Channel):
                 logger.debug("[chat_channel]reference query skipped")
                 return None
 
-            nick_name_black_list = conf().get("nick_name_black_list", [])
             if context.get("isgroup", False):  # 群聊
                 # 校验关键字
-                match_prefix = check_prefix(content, conf().get("group_chat_prefix"))
-                match_contain = check_contain(content, conf().get("group_chat_keyword"))
+                match_prefix = triggers.group_chat_prefix.match(content)
+                match_contain = triggers.group_chat_keyword.contains(content)
                 flag = False
                 if context["msg"].to_user_id != context["msg"].actual_user_id:
                     if match_prefix is not None or match_contain is not None:
@@ -112,38 +109,29 @@ class ChatChannel(Channel):
                             content = content.replace(match_prefix, "", 1).strip()
                     if context["msg"].is_at:
                         nick_name = context["msg"].actual_user_nickname
-                        if nick_name and nick_name in nick_name_black_list:
+                        if triggers.is_nick_name_black(nick_name):
                             # 黑名单过滤
                             logger.warning(f"[chat_channel] Nickname {nick_name} in In BlackList, ignore")
                             return None
 
                         logger.info("[chat_channel]receive group at")
-                        if not conf().get("group_at_off", False):
+                        if not config.get("group_at_off", False):
                             flag = True
                         self.name = self.name if self.name is not None else ""  # 部分渠道self.name可能没有赋值
-                        pattern = f"@{re.escape(self.name)}(\u2005|\u0020)"
-                        subtract_res = re.sub(pattern, r"", content)
-                        if isinstance(context["msg"].at_list, list):
-                            for at in context["msg"].at_list:
-                                pattern = f"@{re.escape(at)}(\u2005|\u0020)"
-                                subtract_res = re.sub(pattern, r"", subtract_res)
-                        if subtract_res == content and context["msg"].self_display_name:
-                            # 前缀移除后没有变化，使用群昵称再次移除
-                            pattern = f"@{re.escape(context['msg'].self_display_name)}(\u2005|\u0020)"
-                            subtract_res = re.sub(pattern, r"", content)
-                        content = subtract_res
+                        stripper = get_mention_stripper(self.name, context["msg"].self_display_name)
+                        content = stripper.strip(content, context["msg"].at_list)
                 if not flag:
                     if context["origin_ctype"] == ContextType.VOICE:
                         logger.info("[chat_channel]receive group voice, but checkprefix didn't match")
                     return None
             else:  # 单聊
                 nick_name = context["msg"].from_user_nickname
-                if nick_name and nick_name in nick_name_black_list:
+                if triggers.is_nick_name_black(nick_name):
                     # 黑名单过滤
                     logger.warning(f"[chat_channel] Nickname '{nick_name}' in In BlackList, ignore")
                     return None
 
-                match_prefix = check_prefix(content, conf().get("single_chat_prefix", [""]))
+                match_prefix = triggers.single_chat_prefix.match(content)
                 if match_prefix is not None:  # 判断如果匹配到自定义前缀，则返回过滤掉前缀+空格后的内容
                     content = content.replace(match_prefix, "", 1).strip()
                 elif context["origin_ctype"] == ContextType.VOICE:  # 如果源消息是私聊的语音消息，允许不匹配前缀，放宽条件
@@ -152,7 +140,7 @@ class ChatChannel(Channel):
                     logger.info("[chat_channel]receive single chat msg, but checkprefix didn't match")
                     return None
             content = content.strip()
-            voice_match_prefix = check_prefix(content, conf().get("voice_reply_prefix", ["vo"]))
+            voice_match_prefix = triggers.voice_reply_prefix.match(content)
             if voice_match_prefix:
                 # 文本触发语音回复：用于“猫娘JSON”多段回复（动作 -> 语音 -> 心情/好感度）
                 context["catgirl_voice_mode"] = True
@@ -160,17 +148,17 @@ class ChatChannel(Channel):
                 if "desire_rtype" not in context:
                     context["desire_rtype"] = ReplyType.TEXT
                 content = content.replace(voice_match_prefix, "", 1).strip()
-            img_match_prefix = check_prefix(content, conf().get("image_create_prefix",[""]))
+            img_match_prefix = triggers.image_create_prefix.match(content)
             if img_match_prefix:
                 content = content.replace(img_match_prefix, "", 1)
                 context.type = ContextType.IMAGE_CREATE
             else:
                 context.type = ContextType.TEXT
             context.content = content.strip()
-            if "desire_rtype" not in context and conf().get("always_reply_voice") and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
+            if "desire_rtype" not in context and config.always_reply_voice and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                 context["desire_rtype"] = ReplyType.VOICE
         elif context.type == ContextType.VOICE:
-            if "desire_rtype" not in context and conf().get("voice_reply_voice") and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
+            if "desire_rtype" not in context and config.voice_reply_voice and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                 context["desire_rtype"] = ReplyType.VOICE
         return context
 
@@ -183,6 +171,12 @@ class ChatChannel(Channel):
 
         logger.debug("[chat_channel] ready to decorate reply: {}".format(reply))
 
+        self._decorate_and_send(context, reply)
+
+    def _decorate_and_send(self, context: Context, reply: Reply):
+        if is_cancelled(context):
+            logger.info("[chat_channel] context cancelled, drop reply, session_id={}".format(context.get("session_id")))
+            return
         # reply的包装步骤
         if reply and reply.content:
             reply = self._decorate_reply(context, reply)
@@ -202,48 +196,212 @@ class ChatChannel(Channel):
             logger.debug("[chat_channel] ready to handle context: type={}, content={}".format(context.type, context.content))
             if context.type == ContextType.TEXT or context.type == ContextType.IMAGE_CREATE:  # 文字和图片消息
                 context["channel"] = e_context["channel"]
+                self._enable_stream(context)
                 reply = super().build_reply_content(context.content, context)
             elif context.type == ContextType.VOICE:  # 语音消息
-                cmsg = context["msg"]
-                cmsg.prepare()
-                file_path = context.content
-                wav_path = os.path.splitext(file_path)[0] + ".wav"
-                try:
-                    any_to_wav(file_path, wav_path)
-                except Exception as e:  # 转换失败，直接使用mp3，对于某些api，mp3也可以识别
-                    logger.warning("[chat_channel]any to wav error, use raw path. " + str(e))
-                    wav_path = file_path
-                # 语音识别
-                reply = super().build_voice_to_text(wav_path)
-                # 删除临时文件
-                try:
-                    os.remove(file_path)
-                    if wav_path != file_path:
-                        os.remove(wav_path)
-                except Exception as e:
-                    pass
-                    # logger.warning("[chat_channel]delete temp file error: " + str(e))
-
+                reply = self._voice_to_text(context)
                 if reply.type == ReplyType.TEXT:
                     new_context = self._compose_context(ContextType.TEXT, reply.content, **context.kwargs)
                     if new_context:
                         reply = self._generate_reply(new_context)
                     else:
                         return
-            elif context.type == ContextType.IMAGE:  # 图片消息，当前仅做下载保存到本地的逻辑
-                memory.USER_IMAGE_CACHE[context["session_id"]] = {
-                    "path": context.content,
-                    "msg": context.get("msg")
-                }
-            elif context.type == ContextType.SHARING:  # 分享信息，当前无默认逻辑
-                pass
-            elif context.type == ContextType.FUNCTION or context.type == ContextType.FILE:  # 文件消息及函数调用等，当前无默认逻辑
-                pass
             else:
-                logger.warning("[chat_channel] unknown context type: {}".format(context.type))
+                return self._handle_other_context(context, reply)
+        return reply
+
+    def _voice_to_text(self, context: Context) -> Reply:
+        cmsg = context["msg"]
+        cmsg.prepare()
+        file_path = context.content
+        wav_path = os.path.splitext(file_path)[0] + ".wav"
+        try:
+            from voice.audio_convert import any_to_wav  # pydub 导入较慢，收到语音时才导入
+
+            any_to_wav(file_path, wav_path)
+        except Exception as e:  # 转换失败，直接使用mp3，对于某些api，mp3也可以识别
+            logger.warning("[chat_channel]any to wav error, use raw path. " + str(e))
+            wav_path = file_path
+        # 语音识别
+        reply = super().build_voice_to_text(wav_path)
+        # 删除临时文件
+        try:
+            os.remove(file_path)
+            if wav_path != file_path:
+                os.remove(wav_path)
+        except Exception as e:
+            pass
+            # logger.warning("[chat_channel]delete temp file error: " + str(e))
+        return reply
+
+    def _handle_other_context(self, context: Context, reply: Reply) -> Reply:
+        if context.type == ContextType.IMAGE:  # 图片消息，当前仅做下载保存到本地的逻辑
+            memory.USER_IMAGE_CACHE[context["session_id"]] = {
+                "path": context.content,
+                "msg": context.get("msg")
+            }
+        elif context.type == ContextType.SHARING:  # 分享信息，当前无默认逻辑
+            pass
+        elif context.type == ContextType.FUNCTION or context.type == ContextType.FILE:  # 文件消息及函数调用等，当前无默认逻辑
+            pass
+        else:
+            logger.warning("[chat_channel] unknown context type: {}".format(context.type))
+            return
+        return reply
+
+    # 以下为分阶段处理流程，与_handle的逻辑一致，但大模型调用、语音处理和发送分别在各自的线程池中执行，
+    # 慢的大模型请求不会占满处理插件回复(如关键词回复)的线程
+    def _submit_handle(self, context: Context) -> Future:
+        """
+        提交context的处理，返回在整条处理链结束时完成的Future
+        """
+        if type(self)._handle is not ChatChannel._handle:  # 子类自定义了_handle，无法拆分阶段，整体在llm线程池中执行
+            return get_worker_pool("llm").submit(self._handle, context)
+        if self.loop is not None:  # async_mode，整条处理链以协程的方式运行在事件循环上
+            return asyncio.run_coroutine_threadsafe(self._handle_async(context), self.loop)
+        done = _HandleFuture()
+        self._submit_stage("send", done, self._handle_stage, context, context)
+        return done
+
+    def _submit_stage(self, pool_name, done: Future, stage, *args):
+        def run():
+            if done.done() or (not done.running() and not done.set_running_or_notify_cancel()):
+                return  # 处理链已被取消
+            if not done.enter_stage():
                 return
+            try:
+                stage(done, *args)
+            except BaseException as e:
+                if not done.done():
+                    done.set_exception(e)
+            finally:
+                done.exit_stage()
+
+        get_worker_pool(pool_name).submit(run)
+
+    def _handle_stage(self, done: Future, context: Context, origin_context: Context):
+        if context is None or not context.content:
+            return done.set_result(None)
+        logger.debug("[chat_channel] ready to handle context: {}".format(context))
+        e_context = PluginManager().emit_event(
+            EventContext(
+                Event.ON_HANDLE_CONTEXT,
+                {"channel": self, "context": context, "reply": Reply()},
+            )
+        )
+        reply = e_context["reply"]
+        if not e_context.is_pass():
+            logger.debug("[chat_channel] ready to handle context: type={}, content={}".format(context.type, context.content))
+            if context.type == ContextType.TEXT or context.type == ContextType.IMAGE_CREATE:
+                context["channel"] = e_context["channel"]
+                self._enable_stream(context)
+                return self._submit_stage("llm", done, self._llm_stage, context, origin_context)
+            elif context.type == ContextType.VOICE:
+                return self._submit_stage("media", done, self._voice_stage, context, origin_context)
+            reply = self._handle_other_context(context, reply)
+        self._send_stage(done, origin_context, reply)
+
+    def _llm_stage(self, done: Future, context: Context, origin_context: Context):
+        reply = super().build_reply_content(context.content, context)
+        self._submit_stage("send", done, self._send_stage, origin_context, reply)
+
+    def _voice_stage(self, done: Future, context: Context, origin_context: Context):
+        reply = self._voice_to_text(context)
+        if reply.type == ReplyType.TEXT:
+            new_context = self._compose_context(ContextType.TEXT, reply.content, **context.kwargs)
+            if not new_context:
+                return done.set_result(None)
+            return self._submit_stage("send", done, self._handle_stage, new_context, origin_context)
+        self._submit_stage("send", done, self._send_stage, origin_context, reply)
+
+    def _send_stage(self, done: Future, context: Context, reply: Reply):
+        logger.debug("[chat_channel] ready to decorate reply: {}".format(reply))
+        self._decorate_and_send(context, reply)
+        done.set_result(None)
+
+    # 以下为async_mode下的协程版本处理流程，大模型调用使用bot的reply_async，插件和其它同步逻辑放到线程池执行，避免阻塞事件循环
+    async def _handle_async(self, context: Context):
+        if context is None or not context.content:
+            return
+        logger.debug("[chat_channel] ready to handle context: {}".format(context))
+        reply = await self._generate_reply_async(context)
+
+        logger.debug("[chat_channel] ready to decorate reply: {}".format(reply))
+        if reply and reply.content:
+            reply = await self._run_in_pool("send", self._decorate_reply, context, reply)
+            await self._send_reply_async(context, reply)
+
+    async def _run_in_pool(self, pool_name, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(get_worker_pool(pool_name), fn, *args)
+
+    async def _generate_reply_async(self, context: Context) -> Reply:
+        e_context = await self._run_in_pool(
+            "send",
+            PluginManager().emit_event,
+            EventContext(
+                Event.ON_HANDLE_CONTEXT,
+                {"channel": self, "context": context, "reply": Reply()},
+            ),
+        )
+        reply = e_context["reply"]
+        if not e_context.is_pass():
+            logger.debug("[chat_channel] ready to handle context: type={}, content={}".format(context.type, context.content))
+            if context.type == ContextType.TEXT or context.type == ContextType.IMAGE_CREATE:
+                context["channel"] = e_context["channel"]
+                self._enable_stream(context)
+                if is_cancelled(context):  # 排队期间已被取消，不再请求模型
+                    return
+                reply = await self.build_reply_content_async(context.content, context)
+            elif context.type == ContextType.VOICE:
+                reply = await self._run_in_pool("media", self._voice_to_text, context)
+                if reply.type == ReplyType.TEXT:
+                    new_context = self._compose_context(ContextType.TEXT, reply.content, **context.kwargs)
+                    if new_context:
+                        reply = await self._generate_reply_async(new_context)
+                    else:
+                        return
+            else:
+                return self._handle_other_context(context, reply)
         return reply
 
+    async def _send_reply_async(self, context: Context, reply: Reply):
+        if is_cancelled(context):
+            logger.info("[chat_channel] context cancelled, drop reply, session_id={}".format(context.get("session_id")))
+            return
+        if reply and reply.type:
+            expanded_image_replies = self._expand_image_replies(reply)
+            if expanded_image_replies is not None:
+                for image_reply in expanded_image_replies:
+                    await self._send_reply_async(context, image_reply)
+                return
+
+            e_context = await self._run_in_pool(
+                "send",
+                PluginManager().emit_event,
+                EventContext(
+                    Event.ON_SEND_REPLY,
+                    {"channel": self, "context": context, "reply": reply},
+                ),
+            )
+            reply = e_context["reply"]
+            if not e_context.is_pass() and reply and reply.type:
+                logger.debug("[chat_channel] ready to send reply: {}, context: {}".format(reply, context))
+                await self._send_async(reply, context)
+
+    async def _send_async(self, reply: Reply, context: Context, retry_cnt=0):
+        if reply.type == ReplyType.TEXT_STREAM:
+            return await self._run_in_pool("send", self._send_stream_reply, context, reply)
+        try:
+            await self.send_async(reply, context)
+        except Exception as e:
+            logger.error("[chat_channel] sendMsg error: {}".format(str(e)))
+            if isinstance(e, NotImplementedError):
+                return
+            logger.exception(e)
+            if retry_cnt < 2:
+                await asyncio.sleep(3 + 3 * retry_cnt)
+                await self._send_async(reply, context, retry_cnt + 1)
+
     def _decorate_reply(self, context: Context, reply: Reply) -> Reply:
         if reply and reply.type:
             e_context = PluginManager().emit_event(
@@ -265,16 +423,13 @@ class ChatChannel(Channel):
                     if desire_rtype == ReplyType.VOICE and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                         reply = super().build_text_to_voice(reply.content)
                         return self._decorate_reply(context, reply)
-                    if context.get("isgroup", False):
-                        if not context.get("no_need_at", False):
-                            reply_text = "@" + context["msg"].actual_user_nickname + "\n" + reply_text.strip()
-                        reply_text = conf().get("group_chat_reply_prefix", "") + reply_text + conf().get("group_chat_reply_suffix", "")
-                    else:
-                        reply_text = conf().get("single_chat_reply_prefix", "") + reply_text + conf().get("single_chat_reply_suffix", "")
-                    reply.content = reply_text
+                    if context.get("isgroup", False) and not context.get("no_need_at", False):
+                        reply_text = reply_text.strip()
+                    prefix, suffix = self._reply_affixes(context)
+                    reply.content = prefix + reply_text + suffix
                 elif reply.type == ReplyType.ERROR or reply.type == ReplyType.INFO:
                     reply.content = "[" + str(reply.type) + "]\n" + reply.content
-                elif reply.type == ReplyType.IMAGE_URL or reply.type == ReplyType.VOICE or reply.type == ReplyType.IMAGE or reply.type == ReplyType.FILE or reply.type == ReplyType.VIDEO or reply.type == ReplyType.VIDEO_URL:
+                elif reply.type == ReplyType.IMAGE_URL or reply.type == ReplyType.VOICE or reply.type == ReplyType.IMAGE or reply.type == ReplyType.FILE or reply.type == ReplyType.VIDEO or reply.type == ReplyType.VIDEO_URL or reply.type == ReplyType.TEXT_STREAM:
                     pass
                 else:
                     logger.error("[chat_channel] unknown reply type: {}".format(reply.type))
@@ -283,6 +438,93 @@ class ChatChannel(Channel):
                 logger.warning("[chat_channel] desire_rtype: {}, but reply type: {}".format(context.get("desire_rtype"), reply.type))
             return reply
 
+    def _reply_affixes(self, context: Context):
+        """
+        文本回复的前缀和后缀，群聊时前缀中包含@提问者
+        """
+        config = conf_snapshot()
+        if context.get("isgroup", False):
+            prefix = config.get("group_chat_reply_prefix", "")
+            if not context.get("no_need_at", False):
+                prefix += "@" + context["msg"].actual_user_nickname + "\n"
+            return prefix, config.get("group_chat_reply_suffix", "")
+        return config.get("single_chat_reply_prefix", ""), config.get("single_chat_reply_suffix", "")
+
+    def _enable_stream(self, context: Context):
+        # 开启stream_reply且channel支持增量发送时，让bot返回流式回复；需要语音等其它回复形式时不使用流式
+        if context.type == ContextType.TEXT and "desire_rtype" not in context and conf_snapshot().stream_reply and self.support_stream(context):
+            context["stream"] = True
+
+    def _send_stream_reply(self, context: Context, reply: Reply):
+        """
+        消费流式回复：把bot产出的文本片段按句子合并成段，每段经过ON_STREAM_CHUNK插件事件后交给channel的send_stream增量发送。
+        首段在出现第一个句子时立即发送，之后的段至少间隔stream_reply_interval秒，避免触发各平台的频率限制
+        """
+        interval = conf_snapshot().get("stream_reply_interval", 1)
+        prefix, suffix = self._reply_affixes(context)
+        buffer = prefix
+        content = ""
+        last_flush = 0
+        try:
+            for chunk in reply.content:
+                if is_cancelled(context):  # 已缓冲的文本不再发送
+                    logger.info("[chat_channel] context cancelled, stop stream reply")
+                    self._close_stream(reply)
+                    return
+                if not chunk:
+                    continue
+                buffer += chunk
+                if content and time.time() - last_flush < interval:
+                    continue
+                cut = _sentence_cut_index(buffer)
+                if not content and cut <= len(prefix):  # 首段至少包含一个完整的句子
+                    cut = 0
+                if cut == 0 and len(buffer) >= STREAM_MAX_SEGMENT_LEN:  # 长时间没有句子结束符时整段发送
+                    cut = len(buffer)
+                if cut > 0:
+                    content = self._send_stream_segment(context, buffer[:cut], content, False)
+                    if content is None:  # 插件结束了流式回复
+                        self._close_stream(reply)
+                        return
+                    buffer = buffer[cut:]
+                    last_flush = time.time()
+        except Exception as e:
+            logger.exception("[chat_channel] stream reply error: {}".format(e))
+        self._send_stream_segment(context, buffer + suffix, content, True)
+
+    @staticmethod
+    def _close_stream(reply: Reply):
+        """停止读取时关闭生成器，bot随之关闭流式请求，不依赖垃圾回收"""
+        close = getattr(reply.content, "close", None)
+        if close is not None:
+            close()
+
+    def _send_stream_segment(self, context: Context, segment: str, content: str, finished: bool):
+        """
+        发送一段文本，返回已发送的全部文本；插件把reply置为None时结束本次流式回复，返回None
+        """
+        e_context = PluginManager().emit_event(
+            EventContext(
+                Event.ON_STREAM_CHUNK,
+                {"channel": self, "context": context, "reply": Reply(ReplyType.TEXT, segment), "content": content},
+            )
+        )
+        chunk_reply = e_context["reply"]
+        stopped = chunk_reply is None
+        delta = ""
+        if not e_context.is_pass() and chunk_reply and chunk_reply.content:
+            delta = chunk_reply.content
+        content += delta
+        if delta or finished or stopped:
+            try:
+                self.send_stream(context, delta, content, finished or stopped)
+            except Exception as e:
+                logger.exception("[chat_channel] send stream error: {}".format(e))
+        if stopped:
+            logger.info("[chat_channel] stream reply stopped by plugin")
+            return None
+        return content
+
     def _send_reply(self, context: Context, reply: Reply):
         if reply and reply.type:
             expanded_image_replies = self._expand_image_replies(reply)
@@ -367,6 +609,8 @@ class ChatChannel(Channel):
         return Reply(ReplyType.IMAGE_URL, f"data:{mime_type};base64,{b64_str}")
 
     def _send(self, reply: Reply, context: Context, retry_cnt=0):
+        if reply.type == ReplyType.TEXT_STREAM:  # 流式回复只能消费一次，不重试
+            return self._send_stream_reply(context, reply)
         try:
             self.send(reply, context)
         except Exception as e:
@@ -388,7 +632,9 @@ class ChatChannel(Channel):
         def func(worker: Future):
             try:
                 worker_exception = worker.exception()
-                if worker_exception:
+                if isinstance(worker_exception, RequestCancelled):
+                    logger.info("Worker cancelled, session_id = {}".format(session_id))
+                elif worker_exception:
                     self._fail_callback(session_id, exception=worker_exception, **kwargs)
                 else:
                     self._success_callback(session_id, **kwargs)
@@ -397,70 +643,356 @@ class ChatChannel(Channel):
             except Exception as e:
                 logger.exception("Worker raise exception: {}".format(e))
             with self.lock:
+                tokens = self.cancel_tokens.get(session_id)
+                if tokens is not None:
+                    tokens.pop(kwargs["context"].get("cancel_token"), None)
+                    if not tokens:
+                        del self.cancel_tokens[session_id]
+                self.dispatch_stats.inflight -= 1
                 self.sessions[session_id][1].release()
+                self._mark_ready(session_id)  # 释放了信号量，session可能可以继续调度或回收
 
         return func
 
+    # 需在持有self.lock时调用
+    def _mark_ready(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is not None:
+            self.ready_sessions.push(session[2], session_id, session[3])
+            self.ready_cond.notify()
+
+    @staticmethod
+    def _flow_of(context: Context):
+        """调度时的公平单位：群聊为群，私聊为用户，返回 (flow, 权重)"""
+        snapshot = conf_snapshot()
+        if context.get("isgroup", False):
+            return "group:{}".format(context["receiver"]), snapshot.get("fair_group_weight") or 1
+        return "user:{}".format(context["receiver"]), snapshot.get("fair_single_weight") or 1
+
+    @staticmethod
+    def _is_command(context: Context):
+        return context.type == ContextType.TEXT and context.content.startswith("#")
+
+    def _check_quota(self, context: Context, flow):
+        """按配置的每分钟消息数限制单个会话和单个群，管理命令不受限制"""
+        snapshot = conf_snapshot()
+        user_limit = snapshot.get("session_rate_limit")
+        if user_limit and not get_rate_limiter("session", user_limit).try_acquire(context["session_id"]):
+            return False
+        group_limit = snapshot.get("group_rate_limit")
+        if group_limit and context.get("isgroup", False) and not get_rate_limiter("group", group_limit).try_acquire(flow):
+            return False
+        return True
+
+    @staticmethod
+    def _same_sender(a: Context, b: Context):
+        if b.get("isgroup", False):  # 群聊会话可能由多人共用，比较实际发送人
+            a_msg, b_msg = a.get("msg"), b.get("msg")
+            return a_msg is not None and b_msg is not None and a_msg.actual_user_id == b_msg.actual_user_id
+        return True
+
+    @classmethod
+    def _can_merge(cls, queued: Context, context: Context):
+        if queued.type != ContextType.TEXT or context.type != ContextType.TEXT:
+            return False
+        if queued.content.startswith("#") or context.content.startswith("#"):
+            return False
+        return cls._same_sender(queued, context)  # 群聊只合并同一个人连续发送的消息
+
+    # 需在持有self.lock时调用，队列达到上限时按session_queue_overflow处理，返回False表示新消息不再入队(已被合并、丢弃或拒绝)
+    def _apply_backpressure(self, context_queue: Dequeue, context: Context, flow):
+        snapshot = conf_snapshot()
+        maxsize = snapshot.get("session_queue_threshold")
+        if not maxsize or context_queue.qsize() < maxsize:
+            return True
+        session_id = context["session_id"]
+        policy = snapshot.get("session_queue_overflow", "drop")
+        queued = context_queue.queue
+        if policy == "merge" and self._can_merge(queued[-1], context):
+            # 合并到最后一条排队的消息，一次回复
+            queued[-1].content = queued[-1].content + "\n" + context.content
+            self.dispatch_stats.record(flow, "merged")
+            return False
+        if policy == "drop_newest":
+            logger.info("[chat_channel] session {} queue overflow, drop newest message".format(session_id))
+            self.dispatch_stats.record(flow, "dropped")
+            return False
+        if policy == "reject":
+            logger.info("[chat_channel] session {} queue overflow, reject message".format(session_id))
+            self.dispatch_stats.record(flow, "rejected")
+            if get_rate_limiter("queue_reject_notice", 1).try_acquire(session_id):  # 每个会话每分钟最多提示一次，避免刷屏时反复提示
+                reply = Reply(ReplyType.INFO, snapshot.get("session_queue_reject_reply") or "消息太多啦，请稍后再发")
+                get_worker_pool("send").submit(self._decorate_and_send, context, reply)
+            return False
+        for i, item in enumerate(queued):  # drop，以及merge无法合并时，丢弃最早的一条非管理命令消息
+            if not self._is_command(item):
+                del queued[i]
+                logger.info("[chat_channel] session {} queue overflow, drop oldest message".format(session_id))
+                self.dispatch_stats.record(flow, "dropped")
+                return True
+        return True
+
+    # 需在持有self.lock时调用，取出下一条排队未超时的消息并记录排队时长，没有时返回None
+    def _next_context(self, context_queue: Dequeue, flow):
+        max_wait = conf_snapshot().get("session_queue_max_wait")
+        now = time.monotonic()
+        while not context_queue.empty():
+            context = context_queue.get()
+            waited = now - context.get("queue_time", now)
+            if max_wait and waited > max_wait and not self._is_command(context):
+                logger.info("[chat_channel] session {} message waited {:.1f}s, drop expired message".format(context["session_id"], waited))
+                self.dispatch_stats.record(flow, "expired")
+                continue
+            self.dispatch_stats.record_wait(waited)
+            return context
+        return None
+
     def produce(self, context: Context):
         session_id = context["session_id"]
+        flow, weight = self._flow_of(context)
+        is_command = self._is_command(context)
         with self.lock:
+            if not is_command and not self._check_quota(context, flow):
+                logger.info("[chat_channel] session {} exceed rate limit, ignore message".format(session_id))
+                self.dispatch_stats.record(flow, "rate_limited")
+                return
             if session_id not in self.sessions:
                 self.sessions[session_id] = [
                     Dequeue(),
                     threading.BoundedSemaphore(conf().get("concurrency_in_session", 4)),
+                    flow,
+                    weight,
                 ]
-            if context.type == ContextType.TEXT and context.content.startswith("#"):
-                self.sessions[session_id][0].putleft(context)  # 优先处理管理命令
-            else:
-                self.sessions[session_id][0].put(context)
+            context_queue = self.sessions[session_id][0]
+            context["queue_time"] = time.monotonic()
+            if is_command:
+                context_queue.putleft(context)  # 优先处理管理命令
+            elif self._apply_backpressure(context_queue, context, flow):
+                context_queue.put(context)
+            self._mark_ready(session_id)
+            superseded = self._superseded_tokens(context) if not is_command else []
+        for token in superseded:  # 在锁外取消，取消回调会再次获取锁
+            token.cancel("superseded")
+
+    # 需在持有self.lock时调用，开启cancel_superseded_reply时，同一个人的新问题取代正在处理的旧问题
+    def _superseded_tokens(self, context: Context):
+        if context.type != ContextType.TEXT or not conf_snapshot().get("cancel_superseded_reply"):
+            return []
+        tokens = self.cancel_tokens.get(context["session_id"], {})
+        return [token for token, running in tokens.items() if running.type == ContextType.TEXT and self._same_sender(running, context)]
+
+    # 需在持有self.lock时调用，把防抖到期的session重新投递，返回距下一个到期的秒数，没有等待中的session时返回None
+    def _release_debounced(self):
+        if not self.debounced:
+            return None
+        now = time.monotonic()
+        for session_id, due in list(self.debounced.items()):
+            if due <= now:
+                del self.debounced[session_id]
+                self._mark_ready(session_id)
+        return min(self.debounced.values()) - now if self.debounced else None
+
+    @staticmethod
+    def _debounce_conf():
+        snapshot = conf_snapshot()
+        return snapshot.get("debounce_window"), max(int(snapshot.get("debounce_max_merge", 5) or 1), 1)
+
+    # 需在持有self.lock时调用，开启debounce_window时，队首的文本消息在同一个人最后一条消息之后静默window秒再调度，返回需要等待到的时间
+    # 已攒够debounce_max_merge条或后面是其它人的消息时不再等待
+    def _debounce_due(self, context_queue: Dequeue):
+        window, max_merge = self._debounce_conf()
+        if not window or max_merge < 2:
+            return None
+        queued = context_queue.queue
+        head = last = queued[0]
+        if head.type != ContextType.TEXT or self._is_command(head):
+            return None
+        for count, item in enumerate(queued):
+            if count >= max_merge - 1 or (item is not head and not self._can_merge(head, item)):
+                return None
+            last = item
+        due = last.get("queue_time", 0) + window
+        return due if due > time.monotonic() else None
+
+    # 需在持有self.lock时调用，把队列中紧随其后的同一个人的文本消息合并到context，一次请求回复
+    def _coalesce(self, context: Context, context_queue: Dequeue, flow):
+        window, max_merge = self._debounce_conf()
+        if not window:
+            return context
+        queued = context_queue.queue
+        merged = 1
+        while queued and merged < max_merge and self._can_merge(context, queued[0]):
+            context.content = context.content + "\n" + context_queue.get().content
+            merged += 1
+            self.dispatch_stats.record(flow, "merged")
+        if merged > 1:
+            logger.debug("[chat_channel] coalesce {} messages in session {}".format(merged, context["session_id"]))
+        return context
 
-    # 消费者函数，单独线程，用于从消息队列中取出消息并处理
+    @classmethod
+    def _max_inflight(cls):
+        snapshot = conf_snapshot()
+        if snapshot.get("max_inflight_contexts"):
+            return snapshot.get("max_inflight_contexts")
+        if cls.loop is not None:  # async_mode下等待大模型回复的协程不占用线程，上限只用于防止同时发起过多请求
+            return ASYNC_MAX_INFLIGHT
+        return 2 * int(snapshot.get("llm_pool_size") or 8)
+
+    def scheduler_stats(self) -> dict:
+        """调度统计：处理中的消息数、排队的会话数、排队时长分布、各flow的调度/丢弃/合并/拒绝数"""
+        with self.lock:
+            stats = self.dispatch_stats.snapshot()
+            stats["ready_sessions"] = len(self.ready_sessions)
+            stats["ready_flows"] = self.ready_sessions.flow_count()
+            stats["queued_messages"] = sum(session[0].qsize() for session in self.sessions.values())
+        return stats
+
+    # 消费者函数，单独线程，只在produce投递消息或任务完成释放信号量时被唤醒，从消息队列中取出消息并处理
+    # 处理中的消息数达到上限后不再提交，空出名额时按flow公平轮转选出下一个会话，避免线程池排队时先到先得
     def consume(self):
         while True:
-            with self.lock:
-                session_ids = list(self.sessions.keys())
-            for session_id in session_ids:
-                with self.lock:
-                    context_queue, semaphore = self.sessions[session_id]
-                if semaphore.acquire(blocking=False):  # 等线程处理完毕才能删除
-                    if not context_queue.empty():
-                        context = context_queue.get()
-                        logger.debug("[chat_channel] consume context: {}".format(context))
-                        future: Future = handler_pool.submit(self._handle, context)
-                        future.add_done_callback(self._thread_pool_callback(session_id, context=context))
-                        with self.lock:
-                            if session_id not in self.futures:
-                                self.futures[session_id] = []
-                            self.futures[session_id].append(future)
-                    elif semaphore._initial_value == semaphore._value + 1:  # 除了当前，没有任务再申请到信号量，说明所有任务都处理完毕
-                        with self.lock:
-                            self.futures[session_id] = [t for t in self.futures[session_id] if not t.done()]
-                            assert len(self.futures[session_id]) == 0, "thread pool error"
-                            del self.sessions[session_id]
+            with self.ready_cond:
+                while True:
+                    timeout = self._release_debounced()
+                    if self.ready_sessions and self.dispatch_stats.inflight < self._max_inflight():
+                        break
+                    self.ready_cond.wait(timeout)
+                flow, session_id = self.ready_sessions.pop()
+                if session_id not in self.sessions:
+                    continue
+                context_queue, semaphore = self.sessions[session_id][:2]
+                if not semaphore.acquire(blocking=False):  # 并发已满，等任务完成回调再次投递
+                    continue
+                if context_queue.empty():
+                    if semaphore._initial_value == semaphore._value + 1:  # 除了当前，没有任务再申请到信号量，说明所有任务都处理完毕
+                        futures = [t for t in self.futures.pop(session_id, []) if not t.done()]
+                        assert len(futures) == 0, "thread pool error"
+                        del self.sessions[session_id]
                     else:
                         semaphore.release()
-            time.sleep(0.2)
+                    continue
+                due = self._debounce_due(context_queue)
+                if due is not None:  # 还在防抖窗口内，等待同一个人的后续消息
+                    semaphore.release()
+                    self.debounced[session_id] = due
+                    continue
+                context = self._next_context(context_queue, flow)
+                if context is None:  # 排队的消息都已超时，释放信号量后重新投递，由下次调度回收session
+                    semaphore.release()
+                    self._mark_ready(session_id)
+                    continue
+                context = self._coalesce(context, context_queue, flow)
+                if not context_queue.empty():  # 还有排队的消息，尝试用剩余的信号量继续调度
+                    self._mark_ready(session_id)
+                self.dispatch_stats.record(flow, "dispatched")
+                self.dispatch_stats.inflight += 1
+                self.dispatch_stats.max_inflight = max(self.dispatch_stats.max_inflight, self.dispatch_stats.inflight)
+                token = None
+                if not self._is_command(context):  # 管理命令(如#reset)本身不随会话一起取消
+                    token = context["cancel_token"] = CancelToken()
+                    self.cancel_tokens.setdefault(session_id, {})[token] = context
+            logger.debug("[chat_channel] consume context: {}".format(context))
+            future: Future = self._submit_handle(context)
+            future.add_done_callback(self._thread_pool_callback(session_id, context=context))
+            with self.lock:
+                if session_id not in self.futures:
+                    self.futures[session_id] = []
+                self.futures[session_id].append(future)
+            if token is not None:
+                token.add_callback(lambda future=future: self._abort(future))
 
-    # 取消session_id对应的所有任务，只能取消排队的消息和已提交线程池但未执行的任务
+    def _abort(self, future: Future):
+        """
+        结束处理链：未开始的直接取消；正在执行的阶段返回后才标记完成并释放会话的并发名额，后续阶段不再执行。
+        bot响应取消时阶段会立即返回，否则名额一直占用到请求结束，避免处理中的消息数超过上限
+        """
+        if isinstance(future, _HandleFuture):
+            if not future.cancel():
+                future.abort()
+        elif self.loop is None or type(self)._handle is not ChatChannel._handle:
+            future.cancel()  # 线程池中正在执行的任务无法提前结束，回复在发送前丢弃
+        # async_mode下不取消协程，bot的请求可能仍在线程池中执行，由bot通过取消令牌中断请求
+
+    # 取消session_id对应的所有任务：丢弃排队的消息，取消未执行的任务，通过取消令牌中断正在执行的处理并丢弃其回复
     def cancel_session(self, session_id):
         with self.lock:
-            if session_id in self.sessions:
-                for future in self.futures[session_id]:
-                    future.cancel()
-                cnt = self.sessions[session_id][0].qsize()
-                if cnt > 0:
-                    logger.info("Cancel {} messages in session {}".format(cnt, session_id))
-                self.sessions[session_id][0] = Dequeue()
+            tokens = self._drop_session(session_id)
+        self._cancel(tokens)
 
     def cancel_all_session(self):
         with self.lock:
+            tokens = []
             for session_id in self.sessions:
-                for future in self.futures[session_id]:
-                    future.cancel()
-                cnt = self.sessions[session_id][0].qsize()
-                if cnt > 0:
-                    logger.info("Cancel {} messages in session {}".format(cnt, session_id))
-                self.sessions[session_id][0] = Dequeue()
+                tokens.extend(self._drop_session(session_id))
+        self._cancel(tokens)
+
+    # 需在持有self.lock时调用，返回需要取消的令牌
+    def _drop_session(self, session_id):
+        if session_id not in self.sessions:
+            return []
+        cnt = self.sessions[session_id][0].qsize()
+        if cnt > 0:
+            logger.info("Cancel {} messages in session {}".format(cnt, session_id))
+        self.sessions[session_id][0] = Dequeue()
+        return list(self.cancel_tokens.get(session_id, {}))
+
+    # 在锁外调用，取消时的完成回调会获取self.lock
+    @staticmethod
+    def _cancel(tokens):
+        for token in tokens:
+            token.cancel("session reset")
+
+
+class _HandleFuture(Future):
+    """分阶段处理链的Future，各阶段在不同线程池中执行，取消后在没有阶段正在执行时标记完成"""
+
+    def __init__(self):
+        super().__init__()
+        self._stage_lock = threading.Lock()
+        self._running_stages = 0  # 下一阶段可能在上一阶段返回前开始执行，因此计数
+        self._aborted = False
+
+    def enter_stage(self):
+        """阶段开始执行前调用，处理链已取消时返回False，该阶段不再执行"""
+        with self._stage_lock:
+            if self._aborted:
+                return False
+            self._running_stages += 1
+            return True
+
+    def exit_stage(self):
+        with self._stage_lock:
+            self._running_stages -= 1
+            finish = self._aborted and self._running_stages == 0
+        if finish:
+            self._finish()
+
+    def abort(self):
+        with self._stage_lock:
+            self._aborted = True
+            finish = self._running_stages == 0
+        if finish:  # 下一阶段还在线程池中排队，没有占用线程
+            self._finish()
+
+    def _finish(self):
+        try:
+            self.set_result(None)
+        except InvalidStateError:  # 恰好已经完成
+            pass
+
+
+ASYNC_MAX_INFLIGHT = 1000  # async_mode下未配置max_inflight_contexts时同时处理中的消息数上限
+
+STREAM_SENTENCE_ENDINGS = "。！？；!?;\n"
+STREAM_MAX_SEGMENT_LEN = 200
+
+
+def _sentence_cut_index(text):
+    """返回text中最后一个句子结束符之后的位置，没有则返回0"""
+    for i in range(len(text) - 1, -1, -1):
+        if text[i] in STREAM_SENTENCE_ENDINGS:
+            return i + 1
+    return 0
 
 
 def check_prefix(content, prefix_list):
@@ -200,6 +200,23 @@ class DingTalkChanel(ChatChannel, dingtalk_stream.ChatbotHandler):
             self.reply_text(reply.content, incoming_message)
 
 
+    def support_stream(self, context: Context) -> bool:
+        return conf().get("dingtalk_card_enabled", False)
+
+    def send_stream(self, context: Context, delta: str, content: str, finished: bool):
+        # 使用AI卡片流式更新markdown内容
+        incoming_message = context.kwargs['msg'].incoming_message
+        card_instance = context.get("dingtalk_stream_card")
+        if card_instance is None:
+            card_instance = self.ai_markdown_card_start(incoming_message, recipients=[incoming_message.sender_staff_id])
+            context["dingtalk_stream_card"] = card_instance
+        if finished:
+            card_instance.ai_finish(markdown=content)
+            if context.kwargs['msg'].is_group:
+                self.reply_text("📢 您有一条新的消息，请查看。", incoming_message)
+        else:
+            card_instance.ai_streaming(markdown=content, append=False)
+
     def generate_button_markdown_content(self, context, reply):
         image_url = context.kwargs.get("image_url")
         promptEn = context.kwargs.get("promptEn")
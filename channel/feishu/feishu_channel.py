@@ -10,7 +10,7 @@ import uuid
 import io
 import imghdr
 
-import requests
+from common import http_client
 import web
 from channel.feishu.feishu_message import FeishuMessage
 from bridge.context import Context
@@ -55,7 +55,6 @@ class FeiShuChanel(ChatChannel):
 
     def send(self, reply: Reply, context: Context):
         msg = context.get("msg")
-        is_group = context["isgroup"]
         if msg:
             access_token = msg.access_token
         else:
@@ -89,28 +88,58 @@ class FeiShuChanel(ChatChannel):
                 return
             msg_type = "image"
             content_key = "image_key"
-        if is_group:
+        self._post_message(context, headers, msg_type, json.dumps({content_key: reply_content}))
+
+    def _post_message(self, context: Context, headers: dict, msg_type: str, content: str) -> dict:
+        msg = context.get("msg")
+        if context["isgroup"]:
             # 群聊中直接回复
             url = f"https://open.feishu.cn/open-apis/im/v1/messages/{msg.msg_id}/reply"
             data = {
                 "msg_type": msg_type,
-                "content": json.dumps({content_key: reply_content})
+                "content": content
             }
-            res = requests.post(url=url, headers=headers, json=data, timeout=(5, 10))
+            res = http_client.post(url=url, headers=headers, json=data, timeout=(5, 10))
         else:
             url = "https://open.feishu.cn/open-apis/im/v1/messages"
             params = {"receive_id_type": context.get("receive_id_type") or "open_id"}
             data = {
                 "receive_id": context.get("receiver"),
                 "msg_type": msg_type,
-                "content": json.dumps({content_key: reply_content})
+                "content": content
             }
-            res = requests.post(url=url, headers=headers, params=params, json=data, timeout=(5, 10))
+            res = http_client.post(url=url, headers=headers, params=params, json=data, timeout=(5, 10))
         res = res.json()
         if res.get("code") == 0:
             logger.info(f"[FeiShu] send message success")
         else:
             logger.error(f"[FeiShu] send message failed, code={res.get('code')}, msg={res.get('msg')}")
+        return res
+
+    def support_stream(self, context: Context) -> bool:
+        return True
+
+    def send_stream(self, context: Context, delta: str, content: str, finished: bool):
+        # 流式回复先发送一张消息卡片，之后通过更新卡片内容实现打字机效果
+        msg = context.get("msg")
+        access_token = msg.access_token if msg else self.fetch_access_token()
+        headers = {
+            "Authorization": "Bearer " + access_token,
+            "Content-Type": "application/json",
+        }
+        card = json.dumps({
+            "config": {"wide_screen_mode": True, "update_multi": True},
+            "elements": [{"tag": "markdown", "content": content if finished else content + " ..."}],
+        })
+        message_id = context.get("feishu_stream_message_id")
+        if not message_id:
+            res = self._post_message(context, headers, "interactive", card)
+            context["feishu_stream_message_id"] = res.get("data", {}).get("message_id")
+            return
+        url = f"https://open.feishu.cn/open-apis/im/v1/messages/{message_id}"
+        res = http_client.patch(url=url, headers=headers, json={"content": card}, timeout=(5, 10)).json()
+        if res.get("code") != 0:
+            logger.error(f"[FeiShu] update stream card failed, code={res.get('code')}, msg={res.get('msg')}")
 
 
     def fetch_access_token(self) -> str:
@@ -123,7 +152,7 @@ class FeiShuChanel(ChatChannel):
             "app_secret": self.feishu_app_secret
         }
         data = bytes(json.dumps(req_body), encoding='utf8')
-        response = requests.post(url=url, data=data, headers=headers)
+        response = http_client.post(url=url, data=data, headers=headers)
         if response.status_code == 200:
             res = response.json()
             if res.get("code") != 0:
@@ -137,7 +166,7 @@ class FeiShuChanel(ChatChannel):
 
     def _upload_image_url(self, img_url, access_token):
         logger.debug(f"[WX] start download image, img_url={img_url}")
-        response = requests.get(img_url)
+        response = http_client.get(img_url)
         if response.status_code != 200:
             return None
         suffix = utils.get_path_suffix(img_url) or "png"
@@ -161,7 +190,7 @@ class FeiShuChanel(ChatChannel):
         filename = f"{uuid.uuid4()}.{suffix}"
         content_type = f"image/{'jpeg' if suffix in ['jpg', 'jpeg'] else suffix}"
         file_obj = io.BytesIO(image_bytes)
-        upload_response = requests.post(
+        upload_response = http_client.post(
             upload_url,
             files={"image": (filename, file_obj, content_type)},
             data=data,
@@ -116,6 +116,25 @@ class WebChannel(ChatChannel):
         except Exception as e:
             logger.error(f"Error in send method: {e}")
 
+    def support_stream(self, context: Context) -> bool:
+        return True
+
+    def send_stream(self, context: Context, delta: str, content: str, finished: bool):
+        request_id = context.get("request_id", None)
+        session_id = self.request_to_session.get(request_id)
+        if session_id not in self.session_queues:
+            logger.warning(f"No response queue found for session {session_id}, stream response dropped")
+            return
+        # 流式回复每次放入目前为止的完整内容，前端按request_id原地更新同一条消息
+        self.session_queues[session_id].put({
+            "type": str(ReplyType.TEXT_STREAM),
+            "content": content,
+            "timestamp": time.time(),
+            "request_id": request_id,
+            "stream": True,
+            "finished": finished,
+        })
+
     def post_message(self):
         """
         Handle incoming messages from users via POST request.
@@ -179,6 +198,8 @@ class WebChannel(ChatChannel):
             try:
                 # 使用peek而不是get，这样如果前端没有成功处理，下次还能获取到
                 response = self.session_queues[session_id].get(block=False)
+                if response.get("stream") and not response.get("finished"):
+                    response = self._latest_stream_response(self.session_queues[session_id], response)
                 
                 # 返回响应，包含请求ID以区分不同请求
                 return json.dumps({
@@ -186,7 +207,9 @@ class WebChannel(ChatChannel):
                     "has_content": True,
                     "content": response["content"],
                     "request_id": response["request_id"],
-                    "timestamp": response["timestamp"]
+                    "timestamp": response["timestamp"],
+                    "stream": response.get("stream", False),
+                    "finished": response.get("finished", True)
                 })
                 
             except Empty:
@@ -197,6 +220,17 @@ class WebChannel(ChatChannel):
             logger.error(f"Error polling response: {e}")
             return json.dumps({"status": "error", "message": str(e)})
 
+    def _latest_stream_response(self, queue: Queue, response: dict) -> dict:
+        """
+        队列中同一请求的连续流式更新只需返回最新的一条
+        """
+        with queue.mutex:
+            while queue.queue and queue.queue[0].get("stream") and queue.queue[0]["request_id"] == response["request_id"]:
+                response = queue.queue.popleft()
+                if response.get("finished"):
+                    break
+        return response
+
     def chat_page(self):
         """Serve the chat HTML page."""
         file_path = os.path.join(os.path.dirname(__file__), 'chat.html')  # 使用绝对路径
@@ -10,15 +10,12 @@ import os
 import re
 import threading
 import time
-import requests
-import openai
-import openai.error
+from common import http_client
 
 from bridge.context import *
 from bridge.reply import *
 from bridge.bridge import Bridge
 from channel.chat_channel import ChatChannel
-from channel import chat_channel
 from channel.wechat.wechat_message import *
 from common import const, utils
 from common.expired_dict import ExpiredDict
@@ -26,6 +23,7 @@ from common.log import logger
 from common.singleton import singleton
 from common.time_check import time_checker
 from common.utils import convert_webp_to_png, remove_markdown_symbol
+from common.worker_pool import all_worker_pools, get_worker_pool
 from config import conf, get_appdata_dir
 from lib import itchat
 from lib.itchat.content import *
@@ -205,7 +203,8 @@ class WechatChannel(ChatChannel):
                 time.sleep(2)
                 self.auto_login_times += 1
                 if self.auto_login_times < 100:
-                    chat_channel.handler_pool._shutdown = False
+                    for pool in all_worker_pools().values():
+                        pool._shutdown = False
                     self.startup()
         except Exception as e:
             pass
@@ -269,17 +268,14 @@ class WechatChannel(ChatChannel):
         if context:
             self.produce(context)
 
-    def _handle(self, context: Context):
-        if context is None or not context.content:
-            return
-        if context.type == ContextType.IMAGE_CREATE:
-            self._handle_image_create_with_nsfw(context)
-            return
-        return super()._handle(context)
+    def _submit_handle(self, context: Context):
+        if context is not None and context.content and context.type == ContextType.IMAGE_CREATE:
+            return get_worker_pool("llm").submit(self._handle_image_create_with_nsfw, context)
+        return super()._submit_handle(context)
 
     def _handle_image_create_with_nsfw(self, context: Context):
         logger.debug("[WX] start image_create with nsfw check, prompt={}".format(context.content))
-        detect_future = chat_channel.handler_pool.submit(
+        detect_future = get_worker_pool("llm").submit(
             self._detect_nsfw_for_image_prompt_with_retry, context.content, context
         )
 
@@ -416,6 +412,11 @@ class WechatChannel(ChatChannel):
             {"role": "system", "content": self.NSFW_SYSTEM_PROMPT},
             {"role": "user", "content": clean_prompt},
         ]
+        try:
+            import openai
+        except ImportError as e:
+            logger.warning("[WX] nsfw openai check skipped: {}".format(e))
+            return ""
         old_api_key = getattr(openai, "api_key", None)
         old_api_base = getattr(openai, "api_base", None)
         old_api_type = getattr(openai, "api_type", None)
@@ -573,7 +574,7 @@ class WechatChannel(ChatChannel):
                 self._record_wx_sent_msg(context, receiver, reply.type, send_result)
                 return send_result
             logger.debug(f"[WX] start download image, img_url={img_url}")
-            pic_res = requests.get(img_url, stream=True)
+            pic_res = http_client.get(img_url, stream=True)
             image_storage = io.BytesIO()
             size = 0
             for block in pic_res.iter_content(1024):
@@ -605,7 +606,7 @@ class WechatChannel(ChatChannel):
         elif reply.type == ReplyType.VIDEO_URL:  # 新增视频URL回复类型
             video_url = reply.content
             logger.debug(f"[WX] start download video, video_url={video_url}")
-            video_res = requests.get(video_url, stream=True)
+            video_res = http_client.get(video_url, stream=True)
             video_storage = io.BytesIO()
             size = 0
             for block in video_res.iter_content(1024):
@@ -3,7 +3,7 @@ import io
 import os
 import time
 
-import requests
+from common import http_client
 import web
 from wechatpy.enterprise import create_reply, parse_message
 from wechatpy.enterprise.crypto import WeChatCrypto
@@ -19,7 +19,6 @@ from common.log import logger
 from common.singleton import singleton
 from common.utils import compress_imgfile, fsize, split_string_by_utf8_length, convert_webp_to_png, remove_markdown_symbol
 from config import conf, subscribe_msg
-from voice.audio_convert import any_to_amr, split_audio
 
 MAX_UTF8_LEN = 2048
 
@@ -66,6 +65,8 @@ class WechatComAppChannel(ChatChannel):
                 media_ids = []
                 file_path = reply.content
                 amr_file = os.path.splitext(file_path)[0] + ".amr"
+                from voice.audio_convert import any_to_amr, split_audio
+
                 any_to_amr(file_path, amr_file)
                 duration, files = split_audio(amr_file, 60 * 1000)
                 if len(files) > 1:
@@ -89,7 +90,7 @@ class WechatComAppChannel(ChatChannel):
             logger.info("[wechatcom] sendVoice={}, receiver={}".format(reply.content, receiver))
         elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
             img_url = reply.content
-            pic_res = requests.get(img_url, stream=True)
+            pic_res = http_client.get(img_url, stream=True)
             image_storage = io.BytesIO()
             for block in pic_res.iter_content(1024):
                 image_storage.write(block)
@@ -131,6 +132,14 @@ class WechatComAppChannel(ChatChannel):
             self.client.message.send_image(self.agent_id, receiver, response["media_id"])
             logger.info("[wechatcom] sendImage, receiver={}".format(receiver))
 
+    def support_stream(self, context: Context) -> bool:
+        return True
+
+    def send_stream(self, context: Context, delta: str, content: str, finished: bool):
+        # 企业微信应用消息不支持修改，逐段发送新增的文本
+        if delta.strip():
+            self.send(Reply(ReplyType.TEXT, delta.strip()), context)
+
 
 class Query:
     def GET(self):
@@ -0,0 +1,111 @@
+"""
+协作式取消
+
+ChatChannel 调度消息时为每个 context 创建一个 CancelToken，放在 context["cancel_token"] 中传给插件和 bot。
+重置会话或新问题取代旧问题时取消 token：
+    channel 立即结束该消息的处理链，释放会话的并发名额，之后产生的回复直接丢弃
+    bot 在请求前、重试等待和流式读取时检查 token，async_mode 下正在进行的请求会被中断
+"""
+import asyncio
+import threading
+import time
+
+from common.log import logger
+
+
+class RequestCancelled(Exception):
+    """请求已被取消，bot 和插件可以直接抛出，由 channel 丢弃"""
+
+    pass
+
+
+class CancelToken(object):
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.reason = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason="cancelled"):
+        """取消并依次执行回调，重复取消无效果"""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning("[CancelToken] callback error: {}".format(e))
+        return True
+
+    def add_callback(self, callback):
+        """注册取消时执行的回调，已取消时立即执行；返回用于注销回调的函数"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove_callback(callback)
+        callback()
+        return lambda: None
+
+    def _remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise RequestCancelled(self.reason)
+
+    def wait(self, timeout=None) -> bool:
+        """等待最多 timeout 秒，用于可被取消的休眠，返回是否已被取消"""
+        return self._event.wait(timeout)
+
+
+def get_cancel_token(context):
+    """取出 context 中的 CancelToken，没有时返回 None"""
+    if context is None:
+        return None
+    return context.get("cancel_token")
+
+
+def is_cancelled(context) -> bool:
+    token = get_cancel_token(context)
+    return token is not None and token.cancelled
+
+
+def sleep(seconds, token: CancelToken = None):
+    """可被取消的 time.sleep，被取消时抛出 RequestCancelled"""
+    if token is None:
+        time.sleep(seconds)
+        return
+    if token.wait(seconds):
+        raise RequestCancelled(token.reason)
+
+
+async def run_cancellable(coro, token: CancelToken = None):
+    """
+    运行协程，token 被取消时取消该协程(如中断正在进行的 aiohttp 请求)并抛出 RequestCancelled
+    """
+    if token is None:
+        return await coro
+    if token.cancelled:
+        coro.close()
+        raise RequestCancelled(token.reason)
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future(coro)
+    remove = token.add_callback(lambda: loop.call_soon_threadsafe(task.cancel))
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if token.cancelled:
+            raise RequestCancelled(token.reason)
+        raise
+    finally:
+        remove()
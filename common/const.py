@@ -16,6 +16,7 @@ ZHIPU_AI = "glm-4"
 MOONSHOT = "moonshot"
 MiniMax = "minimax"
 MODELSCOPE = "modelscope"
+ROUTER = "router"  # 多模型路由，按 router_bots 故障转移和对冲请求
 
 # model
 CLAUDE3 = "claude-3-opus-20240229"
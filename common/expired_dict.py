@@ -1,42 +1,156 @@
-from datetime import datetime, timedelta
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from collections.abc import MutableMapping
 
+SWEEP_INTERVAL = 30  # 后台清理过期条目的间隔，单位秒
 
-class ExpiredDict(dict):
-    def __init__(self, expires_in_seconds):
-        super().__init__()
+
+class ExpiredDict(MutableMapping):
+    """
+    带过期时间的字典，可选最大容量
+
+    所有条目的有效期相同，因此按最后一次写入/访问排序的 OrderedDict 同时也是按过期时间排序的队列，
+    过期和LRU淘汰都只需从队首弹出，均摊O(1)。写入时和后台线程会顺带清理过期条目，
+    不再被读取的键也不会一直占用内存。
+
+    get/[] 会刷新过期时间(touch)，in、peek、keys、items 只读取不刷新(peek)
+    """
+
+    def __init__(self, expires_in_seconds, max_size=None, sweep=True):
         self.expires_in_seconds = expires_in_seconds
+        self.max_size = max_size
+        self._data = OrderedDict()  # key -> (value, expire_at)
+        self._lock = threading.RLock()
+        if sweep and expires_in_seconds:
+            _sweeper.register(self)
+
+    def _expire_at(self, now):
+        return now + self.expires_in_seconds if self.expires_in_seconds else None
+
+    def _expire(self, now):
+        """弹出队首已过期的条目，返回清理数量，调用方需持有锁"""
+        data = self._data
+        removed = 0
+        while data:
+            key, (_, expire_at) = next(iter(data.items()))
+            if expire_at is None or expire_at > now:
+                break
+            del data[key]
+            removed += 1
+        return removed
+
+    def _get_item(self, key, now):
+        """返回未过期的 (value, expire_at)，调用方需持有锁"""
+        item = self._data.get(key)
+        if item is not None and item[1] is not None and item[1] <= now:
+            del self._data[key]
+            return None
+        return item
 
     def __getitem__(self, key):
-        value, expiry_time = super().__getitem__(key)
-        if datetime.now() > expiry_time:
-            del self[key]
-            raise KeyError("expired {}".format(key))
-        self.__setitem__(key, value)
-        return value
+        return self.touch(key)
+
+    def touch(self, key):
+        """读取并刷新过期时间和LRU顺序"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._get_item(key, now)
+            if item is None:
+                raise KeyError("expired {}".format(key))
+            self._data[key] = (item[0], self._expire_at(now))
+            self._data.move_to_end(key)
+            return item[0]
+
+    def peek(self, key, default=None):
+        """只读取，不刷新过期时间"""
+        with self._lock:
+            item = self._get_item(key, time.monotonic())
+        return default if item is None else item[0]
 
     def __setitem__(self, key, value):
-        expiry_time = datetime.now() + timedelta(seconds=self.expires_in_seconds)
-        super().__setitem__(key, (value, expiry_time))
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (value, self._expire_at(now))
+            self._data.move_to_end(key)
+            self._expire(now)
+            if self.max_size:
+                while len(self._data) > self.max_size:
+                    self._data.popitem(last=False)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
 
     def get(self, key, default=None):
         try:
-            return self[key]
+            return self.touch(key)
         except KeyError:
             return default
 
     def __contains__(self, key):
-        try:
-            self[key]
-            return True
-        except KeyError:
-            return False
+        with self._lock:
+            return self._get_item(key, time.monotonic()) is not None
+
+    def expire(self):
+        """清理所有已过期条目"""
+        with self._lock:
+            removed = self._expire(time.monotonic())
+            if removed > 10000 and removed > len(self._data):
+                # 字典删除元素后不会缩容，大量过期后重建以归还哈希表占用的内存
+                self._data = OrderedDict(self._data)
 
     def keys(self):
-        keys = list(super().keys())
-        return [key for key in keys if key in self]
+        with self._lock:
+            self._expire(time.monotonic())
+            return list(self._data.keys())
 
     def items(self):
-        return [(key, self[key]) for key in self.keys()]
+        with self._lock:
+            self._expire(time.monotonic())
+            return [(key, value) for key, (value, _) in self._data.items()]
+
+    def values(self):
+        return [value for _, value in self.items()]
 
     def __iter__(self):
-        return self.keys().__iter__()
+        return iter(self.keys())
+
+    def __len__(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class _Sweeper(object):
+    """所有 ExpiredDict 共用的后台清理线程，按弱引用持有，字典被回收后自动移除"""
+
+    def __init__(self):
+        self._dicts = []  # ExpiredDict不可哈希，无法使用WeakSet
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, d):
+        with self._lock:
+            self._dicts.append(weakref.ref(d))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="expired_dict_sweeper", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(SWEEP_INTERVAL)
+            with self._lock:
+                self._dicts = [ref for ref in self._dicts if ref() is not None]
+                dicts = [ref() for ref in self._dicts]
+            for d in dicts:
+                if d is not None:
+                    d.expire()
+
+
+_sweeper = _Sweeper()
@@ -0,0 +1,155 @@
+"""
+消息调度的公平性控制
+
+ChatChannel 中待处理的会话按 flow 分组(群聊按群，私聊按用户)，用赤字轮转(Deficit Round Robin)在 flow 之间分配处理名额：
+每轮给 flow 增加与权重相等的额度，每调度一个会话消耗 1，同一个 flow 内的会话再按轮转顺序调度。
+消息再多的群每轮也只能占用与权重相当的名额，不会挤占其它群和私聊用户。
+"""
+import bisect
+from collections import OrderedDict
+
+
+class DeficitRoundRobin(object):
+    """
+    非线程安全，由调用方加锁
+    """
+
+    def __init__(self):
+        self._flows = OrderedDict()  # flow -> OrderedDict(item -> True)，只保存有待调度项的flow，顺序即轮转顺序
+        self._deficit = {}  # flow -> 当前额度
+        self._weights = {}  # flow -> 权重
+        self._size = 0
+
+    def push(self, flow, item, weight=1):
+        """加入待调度项，同一个 flow 中重复加入的项只保留一份"""
+        items = self._flows.get(flow)
+        if items is None:
+            items = self._flows[flow] = OrderedDict()
+            self._deficit[flow] = 0.0
+        self._weights[flow] = max(float(weight), 0.01)
+        if item not in items:
+            items[item] = True
+            self._size += 1
+
+    def pop(self):
+        """按赤字轮转取出下一项，返回 (flow, item)，没有待调度项时返回 None"""
+        flows, deficit = self._flows, self._deficit
+        while flows:
+            flow, items = next(iter(flows.items()))
+            if deficit[flow] < 1:
+                deficit[flow] += self._weights[flow]
+                if deficit[flow] < 1:  # 权重小于1的flow需要轮到多次才能调度一次
+                    flows.move_to_end(flow)
+                    continue
+            item, _ = items.popitem(last=False)
+            self._size -= 1
+            deficit[flow] -= 1
+            if not items:  # flow 已空，额度清零，避免空闲后积累额度
+                del flows[flow]
+                del deficit[flow]
+                del self._weights[flow]
+            elif deficit[flow] < 1:
+                flows.move_to_end(flow)
+            return flow, item
+        return None
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    def flow_count(self):
+        return len(self._flows)
+
+
+class WaitHistogram(object):
+    """
+    消息排队时长的直方图，按固定的桶边界(秒)计数，分位数按桶边界估算
+    """
+
+    BOUNDS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 300)
+
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # 最后一个桶记录超过最大边界的
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """返回第q分位所在桶的上界(不超过最大值)，落在最后一个桶时返回最大值"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self) -> dict:
+        buckets = OrderedDict()
+        for i, n in enumerate(self.counts):
+            buckets["<={}s".format(self.bounds[i]) if i < len(self.bounds) else ">{}s".format(self.bounds[-1])] = n
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": round(self.max, 3),
+            "buckets": buckets,
+        }
+
+
+EVENTS = ("dispatched", "dropped", "merged", "rejected", "expired", "rate_limited")
+
+
+class SchedulerStats(object):
+    """
+    调度统计，按 flow 记录调度、丢弃、合并和拒绝的消息数，用于发现刷屏的群；消息从入队到调度的等待时长记入直方图
+    """
+
+    def __init__(self, max_flows=1000):
+        self.max_flows = max_flows
+        for event in EVENTS:
+            setattr(self, event, 0)
+        self.inflight = 0  # 已提交处理尚未完成的消息数
+        self.max_inflight = 0
+        self.queue_wait = WaitHistogram()
+        self.flows = OrderedDict()  # flow -> {事件: 次数}，按最近活跃排序，超过上限淘汰最旧的
+
+    def _flow(self, flow):
+        stats = self.flows.get(flow)
+        if stats is None:
+            stats = self.flows[flow] = dict.fromkeys(EVENTS, 0)
+            if len(self.flows) > self.max_flows:
+                self.flows.popitem(last=False)
+        else:
+            self.flows.move_to_end(flow)
+        return stats
+
+    def record(self, flow, event):
+        setattr(self, event, getattr(self, event) + 1)
+        self._flow(flow)[event] += 1
+
+    def record_wait(self, seconds):
+        self.queue_wait.observe(seconds)
+
+    def snapshot(self, top=10) -> dict:
+        busiest = sorted(self.flows.items(), key=lambda item: sum(item[1].values()) - item[1]["rate_limited"], reverse=True)
+        stats = {event: getattr(self, event) for event in EVENTS}
+        stats.update(
+            inflight=self.inflight,
+            max_inflight=self.max_inflight,
+            queue_wait=self.queue_wait.snapshot(),
+            busiest_flows=[dict(flow=flow, **flow_stats) for flow, flow_stats in busiest[:top]],
+        )
+        return stats
@@ -0,0 +1,151 @@
+"""
+公共HTTP客户端
+
+所有bot、语音、渠道和插件的出站请求都通过这里发送，共用一个 requests.Session，
+同一host的连接会被保持并复用，避免每条消息都重新进行 TCP+TLS 握手。
+接口与 requests 保持一致：http_client.get/post/... 返回 requests.Response
+"""
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from common.log import logger
+from config import conf
+
+# 只对幂等请求在网关类错误时自动重试，POST等请求只在连接建立失败时重试
+IDEMPOTENT_METHODS = frozenset(["HEAD", "GET", "PUT", "DELETE", "OPTIONS", "TRACE"])
+RETRY_STATUS_CODES = frozenset([502, 503, 504])
+
+
+def _build_retry(max_retries):
+    kwargs = dict(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        status_forcelist=RETRY_STATUS_CODES,
+        backoff_factor=0.5,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    try:
+        return Retry(allowed_methods=IDEMPOTENT_METHODS, **kwargs)
+    except TypeError:  # urllib3 < 1.26
+        return Retry(method_whitelist=IDEMPOTENT_METHODS, **kwargs)
+
+
+class HostStats(object):
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0  # 网络异常或5xx响应
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def to_dict(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "avg_latency": self.total_latency / self.requests if self.requests else 0,
+            "max_latency": self.max_latency,
+        }
+
+
+class HttpClient(object):
+    """
+    带连接池、默认超时、重试策略和按host统计的HTTP客户端
+    """
+
+    def __init__(self, pool_size=None, connect_timeout=None, read_timeout=None, max_retries=None):
+        self.pool_size = int(pool_size or conf().get("http_pool_size", 10))
+        self.connect_timeout = connect_timeout or conf().get("http_connect_timeout", 5)
+        self.read_timeout = read_timeout or conf().get("request_timeout", 180)
+        max_retries = conf().get("http_max_retries", 2) if max_retries is None else max_retries
+        self.session = requests.Session()
+        # 共享session不保存cookie，保持与直接调用requests.get/post相同的无状态语义
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=_build_retry(max_retries))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = (self.connect_timeout, self.read_timeout)
+        host = urlparse(url).netloc
+        start = time.monotonic()
+        failed = True
+        try:
+            response = self.session.request(method, url, **kwargs)
+            failed = response.status_code >= 500
+            return response
+        except requests.RequestException as e:
+            logger.debug("[HttpClient] {} {} failed: {}".format(method, host, e))
+            raise
+        finally:
+            self._record(host, time.monotonic() - start, failed)
+
+    def _record(self, host, latency, failed):
+        with self._stats_lock:
+            stats = self._stats.get(host)
+            if stats is None:
+                stats = self._stats[host] = HostStats()
+            stats.requests += 1
+            stats.total_latency += latency
+            stats.max_latency = max(stats.max_latency, latency)
+            if failed:
+                stats.errors += 1
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {host: stats.to_dict() for host, stats in self._stats.items()}
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HttpClient()
+    return _client
+
+
+def request(method, url, **kwargs):
+    return get_client().request(method, url, **kwargs)
+
+
+def get(url, params=None, **kwargs):
+    return request("GET", url, params=params, **kwargs)
+
+
+def post(url, data=None, json=None, **kwargs):
+    return request("POST", url, data=data, json=json, **kwargs)
+
+
+def put(url, data=None, **kwargs):
+    return request("PUT", url, data=data, **kwargs)
+
+
+def patch(url, data=None, **kwargs):
+    return request("PATCH", url, data=data, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request("DELETE", url, **kwargs)
+
+
+def http_stats() -> dict:
+    """按host统计的请求数、错误数和延迟"""
+    return get_client().stats()
@@ -0,0 +1,114 @@
+"""
+启动耗时分析：记录每个模块的导入耗时
+
+用法: python app.py --profile-startup
+需要在其它模块导入之前调用 enable()，启动完成后调用 report() 输出耗时最多的模块
+    累计耗时: 导入该模块的总耗时，包含它导入的其它模块
+    自身耗时: 扣除子模块导入后，执行该模块自身代码的耗时
+"""
+import sys
+import threading
+import time
+from importlib.abc import MetaPathFinder
+
+_started_at = None
+_finder = None
+
+
+class _TimedLoader(object):
+    """包装原始 loader，统计 exec_module 的耗时，其余属性透传"""
+
+    def __init__(self, loader, finder):
+        self._loader = loader
+        self._finder = finder
+
+    def __getattr__(self, item):
+        return getattr(self._loader, item)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        finder = self._finder
+        stack = finder.stack
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            else:
+                finder.total += elapsed
+            finder.timings[module.__name__] = (elapsed, elapsed - children)
+            # 还原原始 loader，避免按 loader 类型判断的代码(如 pkg_resources)受影响
+            module.__loader__ = self._loader
+            if getattr(module, "__spec__", None) is not None:
+                module.__spec__.loader = self._loader
+
+
+class ImportProfiler(MetaPathFinder):
+    def __init__(self):
+        self.timings = {}  # 模块名 -> (累计耗时, 自身耗时)
+        self.total = 0.0  # 所有导入的总耗时，嵌套导入只计一次
+        self._local = threading.local()
+
+    @property
+    def stack(self):
+        """当前线程正在导入的模块，每项为其子模块已用去的耗时"""
+        local = self._local
+        if not hasattr(local, "stack"):
+            local.stack = []
+            local.finding = set()
+        return local.stack
+
+    def find_spec(self, fullname, path, target=None):
+        self.stack  # 初始化线程局部状态
+        finding = self._local.finding
+        if fullname in finding:
+            return None
+        finding.add(fullname)
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            finding.discard(fullname)
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(spec.loader, self)
+        return spec
+
+
+def enable():
+    global _started_at, _finder
+    if _finder is None:
+        _started_at = time.perf_counter()
+        _finder = ImportProfiler()
+        sys.meta_path.insert(0, _finder)
+
+
+def disable():
+    """停止记录，已记录的耗时仍可通过 report() 输出"""
+    if _finder is not None and _finder in sys.meta_path:
+        sys.meta_path.remove(_finder)
+
+
+def report(limit=30) -> str:
+    """返回按累计耗时排序的报告文本"""
+    if _finder is None:
+        return "import profiler not enabled"
+    timings = sorted(_finder.timings.items(), key=lambda item: item[1][0], reverse=True)
+    lines = [
+        "startup cost {:.3f}s, {} modules imported in {:.3f}s".format(time.perf_counter() - _started_at, len(timings), _finder.total),
+        "{:>10} {:>10}  module".format("cumul(ms)", "self(ms)"),
+    ]
+    for name, (cumulative, own) in timings[:limit]:
+        lines.append("{:>10.1f} {:>10.1f}  {}".format(cumulative * 1000, own * 1000, name))
+    return "\n".join(lines)
@@ -0,0 +1,129 @@
+"""
+bot 请求失败后的重试等待，所有 bot 共用
+
+    指数退避加随机抖动: 第n次重试前等待 base_delay * 2^n (不超过 retry_max_delay) 的 50%~100%，
+                        多个请求同时失败时不会在同一时刻一起重试
+    Retry-After: 错误响应中带有 Retry-After / retry-after-ms 头时按服务端要求的时间等待
+    截止时间: Bridge 处理一条消息时按 request_timeout 设置截止时间，等待后会超过截止时间时不再重试，直接返回失败提示
+    取消: 等待期间会话被重置时立即结束，抛出 RequestCancelled
+    async_mode: wait_async 在事件循环上等待，不占用线程
+
+用法:
+    except Exception as e:
+        if need_retry and retry.wait(retry_count, 5, e, cancel_token):
+            return self.reply_text(session, retry_count + 1)
+"""
+import asyncio
+import contextvars
+import email.utils
+import random
+import time
+from contextlib import contextmanager
+
+from common.cancellation import RequestCancelled
+from common.log import logger
+from config import conf_snapshot
+
+_deadline = contextvars.ContextVar("retry_deadline", default=None)  # time.monotonic() 截止时间
+
+
+@contextmanager
+def deadline_scope(seconds):
+    """在该范围内的重试等待不超过 seconds 秒后的截止时间，已有更早的截止时间时保持不变"""
+    deadline = time.monotonic() + seconds if seconds else None
+    current = _deadline.get()
+    if current is not None and (deadline is None or current < deadline):
+        deadline = current
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """距截止时间的秒数，没有截止时间时返回 None"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _get_headers(error):
+    for source in (error, getattr(error, "response", None)):
+        headers = getattr(source, "headers", None)
+        if headers:
+            return headers
+    return None
+
+
+def retry_after(error):
+    """解析错误响应中的 Retry-After(秒数或HTTP日期) 或 retry-after-ms 头，没有时返回 None"""
+    headers = _get_headers(error) if error is not None else None
+    if not headers:
+        return None
+    try:
+        value = headers.get("retry-after-ms") or headers.get("Retry-After-Ms")
+        if value:
+            return max(float(value) / 1000, 0.0)
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            date = email.utils.parsedate_to_datetime(value)
+            return max(date.timestamp() - time.time(), 0.0)
+    except Exception as e:
+        logger.debug("[Retry] parse Retry-After failed: {}".format(e))
+        return None
+
+
+def backoff_delay(retry_count, base_delay, error=None):
+    """第 retry_count 次重试前需要等待的秒数"""
+    server_delay = retry_after(error)
+    if server_delay is not None:
+        return server_delay
+    max_delay = conf_snapshot().get("retry_max_delay", 30)
+    delay = min(float(base_delay) * (2**retry_count), max_delay)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _plan(retry_count, base_delay, error, cancel_token):
+    """返回重试前需要等待的秒数，不应该重试时返回 None"""
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+    max_retries = conf_snapshot().get("request_max_retries", 2)
+    if retry_count >= max_retries:
+        return None
+    delay = backoff_delay(retry_count, base_delay, error)
+    left = remaining()
+    if left is not None and delay >= left:
+        logger.warning("[Retry] retry after {:.1f}s exceeds deadline ({:.1f}s left), give up".format(delay, max(left, 0)))
+        return None
+    logger.info("[Retry] retry {} after {:.1f}s".format(retry_count + 1, delay))
+    return delay
+
+
+def wait(retry_count, base_delay, error=None, cancel_token=None) -> bool:
+    """
+    第 retry_count 次重试前等待，返回是否应该重试
+    达到 request_max_retries 次或等待后会超过截止时间时不等待，返回 False
+    """
+    delay = _plan(retry_count, base_delay, error, cancel_token)
+    if delay is None:
+        return False
+    if cancel_token is None:
+        time.sleep(delay)
+    elif cancel_token.wait(delay):
+        raise RequestCancelled(cancel_token.reason)
+    return True
+
+
+async def wait_async(retry_count, base_delay, error=None, cancel_token=None) -> bool:
+    """wait 的协程版本，在事件循环上等待，不占用线程"""
+    delay = _plan(retry_count, base_delay, error, cancel_token)
+    if delay is None:
+        return False
+    await asyncio.sleep(delay)
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+    return True
@@ -1,7 +1,14 @@
-import heapq
+from bisect import bisect_left, insort
 
 
 class SortedDict(dict):
+    """
+    按 sort_func(key, value) 排序的字典，keys/items/迭代按排序结果返回
+
+    内部维护有序的 (priority, key) 列表，增删改通过二分查找定位，O(log n) 次比较；
+    排序后的键列表会被缓存，只在内容变化后重新生成
+    """
+
     def __init__(self, sort_func=lambda k, v: k, init_dict=None, reverse=False):
         if init_dict is None:
             init_dict = []
@@ -10,53 +17,51 @@ class SortedDict(dict):
         self.sort_func = sort_func
         self.sorted_keys = None
         self.reverse = reverse
-        self.heap = []
+        self._order = []  # 升序的 (priority, key)
+        self._priorities = {}  # key -> 当前在 _order 中的 priority
         for k, v in init_dict:
             self[k] = v
 
+    def _remove_order(self, key):
+        entry = (self._priorities.pop(key), key)
+        del self._order[bisect_left(self._order, entry)]
+
+    def _insert_order(self, key, priority):
+        self._priorities[key] = priority
+        insort(self._order, (priority, key))
+        self.sorted_keys = None
+
     def __setitem__(self, key, value):
-        if key in self:
-            super().__setitem__(key, value)
-            for i, (priority, k) in enumerate(self.heap):
-                if k == key:
-                    self.heap[i] = (self.sort_func(key, value), key)
-                    heapq.heapify(self.heap)
-                    break
-            self.sorted_keys = None
-        else:
-            super().__setitem__(key, value)
-            heapq.heappush(self.heap, (self.sort_func(key, value), key))
-            self.sorted_keys = None
+        super().__setitem__(key, value)
+        priority = self.sort_func(key, value)
+        if key in self._priorities:
+            if self._priorities[key] == priority:
+                return
+            self._remove_order(key)
+        self._insert_order(key, priority)
 
     def __delitem__(self, key):
         super().__delitem__(key)
-        for i, (priority, k) in enumerate(self.heap):
-            if k == key:
-                del self.heap[i]
-                heapq.heapify(self.heap)
-                break
+        self._remove_order(key)
         self.sorted_keys = None
 
     def keys(self):
         if self.sorted_keys is None:
-            self.sorted_keys = [k for _, k in sorted(self.heap, reverse=self.reverse)]
+            order = reversed(self._order) if self.reverse else self._order
+            self.sorted_keys = [k for _, k in order]
         return self.sorted_keys
 
     def items(self):
-        if self.sorted_keys is None:
-            self.sorted_keys = [k for _, k in sorted(self.heap, reverse=self.reverse)]
-        sorted_items = [(k, self[k]) for k in self.sorted_keys]
-        return sorted_items
+        return [(k, self[k]) for k in self.keys()]
+
+    def update_order(self, key):
+        """value 被原地修改后调用，按新的 priority 调整顺序"""
+        priority = self.sort_func(key, self[key])
+        if self._priorities[key] != priority:
+            self._remove_order(key)
+            self._insert_order(key, priority)
 
-    def _update_heap(self, key):
-        for i, (priority, k) in enumerate(self.heap):
-            if k == key:
-                new_priority = self.sort_func(key, self[key])
-                if new_priority != priority:
-                    self.heap[i] = (new_priority, key)
-                    heapq.heapify(self.heap)
-                    self.sorted_keys = None
-                break
+    _update_heap = update_order  # 兼容旧接口
 
     def __iter__(self):
         return iter(self.keys())
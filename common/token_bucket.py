@@ -1,39 +1,170 @@
+import asyncio
 import threading
 import time
 
+from common.expired_dict import ExpiredDict
+
 
 class TokenBucket:
-    def __init__(self, tpm, timeout=None):
-        self.capacity = int(tpm)  # 令牌桶容量
-        self.tokens = 0  # 初始令牌数为0
-        self.rate = int(tpm) / 60  # 令牌每秒生成速率
+    """
+    惰性补充的令牌桶：取令牌时按上次补充以来经过的单调时间计算新增的令牌，不需要后台线程
+
+    tpm: 每分钟生成的令牌数
+    burst: 桶容量，即空闲一段时间后允许的突发请求数，默认等于 tpm
+    initial: 初始令牌数，默认 1，与旧实现启动时的行为一致
+    timeout: get_token 默认的最长等待秒数，None 表示一直等待
+
+    等待令牌时先预约(令牌数可以为负)再按需要的时间休眠，先到先得，休眠期间不占用锁
+    """
+
+    def __init__(self, tpm, timeout=None, burst=None, initial=None):
+        self.rate = float(tpm) / 60  # 令牌每秒生成速率
+        self.capacity = float(burst or tpm)  # 令牌桶容量
+        self.tokens = min(float(1 if initial is None else initial), self.capacity)
         self.timeout = timeout  # 等待令牌超时时间
-        self.cond = threading.Condition()  # 条件变量
-        self.is_running = True
-        # 开启令牌生成线程
-        threading.Thread(target=self._generate_tokens).start()
-
-    def _generate_tokens(self):
-        """生成令牌"""
-        while self.is_running:
-            with self.cond:
-                if self.tokens < self.capacity:
-                    self.tokens += 1
-                self.cond.notify()  # 通知获取令牌的线程
-            time.sleep(1 / self.rate)
-
-    def get_token(self):
-        """获取令牌"""
-        with self.cond:
-            while self.tokens <= 0:
-                flag = self.cond.wait(self.timeout)
-                if not flag:  # 超时
-                    return False
-            self.tokens -= 1
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        """按经过的时间补充令牌，调用方需持有锁"""
+        elapsed = now - self._updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self._updated_at = now
+
+    def _reserve(self, n, timeout):
+        """
+        预约 n 个令牌，返回需要等待的秒数；等待时间超过 timeout 时不预约，返回 None
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= n:
+                self.tokens -= n
+                return 0.0
+            if self.rate <= 0:
+                return None
+            wait = (n - self.tokens) / self.rate
+            if timeout is not None and wait > timeout:
+                return None
+            self.tokens -= n
+            return wait
+
+    def try_acquire(self, n=1) -> bool:
+        """不等待，令牌不足时立即返回 False"""
+        return self._reserve(n, 0) is not None
+
+    def get_token(self, n=1, timeout=..., cancel_token=None) -> bool:
+        """
+        获取令牌，令牌不足时阻塞等待，超过 timeout 秒仍无法获得则返回 False
+        cancel_token: 等待期间被取消时归还预约的令牌并返回 False
+        """
+        wait = self._reserve(n, self.timeout if timeout is ... else timeout)
+        if wait is None:
+            return False
+        if wait > 0:
+            if cancel_token is None:
+                time.sleep(wait)
+            elif cancel_token.wait(wait):
+                self._release(n)
+                return False
+        return True
+
+    def _release(self, n):
+        """归还预约后未使用的令牌"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + n)
+
+    async def get_token_async(self, n=1, timeout=...) -> bool:
+        """get_token 的协程版本，等待期间不占用线程"""
+        wait = self._reserve(n, self.timeout if timeout is ... else timeout)
+        if wait is None:
+            return False
+        if wait > 0:
+            await asyncio.sleep(wait)
         return True
 
+    def available(self) -> float:
+        """当前可用令牌数，为负表示已被预约"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.tokens
+
     def close(self):
-        self.is_running = False
+        """兼容旧接口，不再有需要停止的线程"""
+        pass
+
+
+class KeyedTokenBucket:
+    """
+    按 key 独立限流(每个用户、群或 API key 一个令牌桶)，参数含义同 TokenBucket，
+    但 initial 默认等于桶容量：新出现的 key 与空闲了很久的 key 一样允许 burst 次突发请求
+
+    令牌桶空闲到补满所需的时间之后与新建的(满的)桶无异，因此按该时间过期回收，key 再多也不会一直占用内存
+    """
+
+    def __init__(self, tpm, timeout=None, burst=None, initial=None, max_keys=100000):
+        self.tpm = tpm
+        self.timeout = timeout
+        self.burst = burst
+        capacity = float(burst or tpm)
+        self.initial = capacity if initial is None else initial
+        idle = 2 * capacity / (float(tpm) / 60) if tpm else None  # 留出余量，保证预约的令牌还清后才回收
+        self._buckets = ExpiredDict(idle, max_keys)
+        self._lock = threading.Lock()
+
+    def bucket(self, key) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = TokenBucket(self.tpm, self.timeout, self.burst, self.initial)
+                    self._buckets[key] = bucket
+        return bucket
+
+    def try_acquire(self, key, n=1) -> bool:
+        return self.bucket(key).try_acquire(n)
+
+    def get_token(self, key, n=1, timeout=..., cancel_token=None) -> bool:
+        return self.bucket(key).get_token(n, timeout, cancel_token)
+
+    async def get_token_async(self, key, n=1, timeout=...) -> bool:
+        return await self.bucket(key).get_token_async(n, timeout)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name, tpm, timeout=None, burst=None) -> KeyedTokenBucket:
+    """
+    按名称获取进程内共享的限流器，多个 bot 实例使用同一个名称时共用额度
+    参数变化(如修改配置后重新加载)时重新创建
+    """
+    params = (tpm, timeout, burst)
+    with _limiters_lock:
+        item = _limiters.get(name)
+        if item is None or item[0] != params:
+            item = (params, KeyedTokenBucket(tpm, timeout=timeout, burst=burst))
+            _limiters[name] = item
+        return item[1]
+
+
+def rate_limiter_from_conf(name):
+    """
+    按配置项 rate_limit_<name>(每分钟次数) 和 rate_limit_<name>_burst 获取共享限流器，未配置或为0时返回 None
+    """
+    from config import conf_snapshot
+
+    snapshot = conf_snapshot()
+    tpm = snapshot.get("rate_limit_" + name)
+    if not tpm:
+        return None
+    return get_rate_limiter(name, tpm, burst=snapshot.get("rate_limit_{}_burst".format(name)))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,75 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from config import conf
+
+
+class TokenCountCache(object):
+    """
+    进程内共享的token计数LRU缓存，键为(编码名, 内容哈希)
+    群聊共用的人设、角色提示词等重复内容只需编码一次
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(encoding_name, text):
+        return encoding_name, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def count(self, encoding, text):
+        """返回text在encoding下的token数，未命中时调用encoding.encode并缓存结果"""
+        key = self.make_key(encoding.name, text)
+        with self._lock:
+            tokens = self._cache.get(key)
+            if tokens is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return tokens
+            self.misses += 1
+        tokens = len(encoding.encode(text))
+        with self._lock:
+            self._cache[key] = tokens
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._cache),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0,
+            }
+
+
+_token_cache = None
+_token_cache_lock = threading.Lock()
+
+
+def get_token_cache() -> TokenCountCache:
+    global _token_cache
+    if _token_cache is None:
+        with _token_cache_lock:
+            if _token_cache is None:
+                _token_cache = TokenCountCache(int(conf().get("token_cache_size", 10000)))
+    return _token_cache
+
+
+def token_cache_stats() -> dict:
+    return get_token_cache().stats()
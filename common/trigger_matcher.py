@@ -0,0 +1,195 @@
+"""
+消息触发条件匹配引擎
+
+按配置编译一次，之后每条消息直接查表：
+    PrefixMatcher:  前缀匹配，按前缀长度分桶的哈希表，每种长度只需一次切片和一次查表
+    KeywordMatcher: 关键词包含匹配，关键词较多时使用 Aho-Corasick 自动机，一次遍历文本即可判断
+    TriggerMatcher: 汇总群聊/私聊前缀、关键词、群名白名单和昵称黑名单，挂在配置快照上随配置一起更新
+"""
+import functools
+from collections import deque
+
+
+class PrefixMatcher(object):
+    """
+    与 check_prefix 语义一致：返回列表中第一个(按配置顺序)匹配的前缀，没有匹配返回 None
+    """
+
+    def __init__(self, prefixes):
+        self.prefixes = list(prefixes or [])
+        buckets = {}  # 前缀长度 -> {前缀: 在列表中的序号}
+        for index, prefix in enumerate(self.prefixes):
+            bucket = buckets.setdefault(len(prefix), {})
+            bucket.setdefault(prefix, index)
+        self._buckets = sorted(buckets.items())
+
+    def match(self, content):
+        best = None
+        for length, bucket in self._buckets:
+            if length > len(content):
+                break
+            index = bucket.get(content[:length])
+            if index is not None and (best is None or index < best):
+                best = index
+        return None if best is None else self.prefixes[best]
+
+    def __bool__(self):
+        return bool(self.prefixes)
+
+
+class KeywordMatcher(object):
+    """
+    与 check_contain 语义一致：文本包含任一关键词时返回 True，否则返回 None
+    关键词数量不超过 LINEAR_SCAN_LIMIT 时逐个 in 判断更快，超过后构建 Aho-Corasick 自动机
+    """
+
+    LINEAR_SCAN_LIMIT = 48
+
+    def __init__(self, keywords):
+        self.keywords = list(dict.fromkeys(keywords or []))
+        self._always = "" in self.keywords  # 空关键词总是匹配
+        self._goto = None
+        if not self._always and len(self.keywords) > self.LINEAR_SCAN_LIMIT:
+            self._build()
+
+    def _build(self):
+        # 节点用序号表示，goto[i] 为子节点表，fail[i] 为失败指针，out[i] 表示沿失败链可到达某个关键词结尾
+        goto = [{}]
+        out = [False]
+        for keyword in self.keywords:
+            node = 0
+            for ch in keyword:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    out.append(False)
+                node = nxt
+            out[node] = True
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                queue.append(child)
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[child] = goto[f].get(ch, 0)
+                out[child] = out[child] or out[fail[child]]
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+
+    def contains(self, text):
+        if not self.keywords or text is None:
+            return None
+        if self._always:
+            return True
+        if self._goto is None:
+            for keyword in self.keywords:
+                if keyword in text:
+                    return True
+            return None
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                return True
+        return None
+
+    def __bool__(self):
+        return bool(self.keywords)
+
+
+class TriggerMatcher(object):
+    """
+    根据一份配置编译出的全部触发条件，默认值与 chat_channel 中读取配置时的默认值保持一致
+    """
+
+    def __init__(self, config: dict):
+        self.group_chat_prefix = PrefixMatcher(config.get("group_chat_prefix"))
+        self.single_chat_prefix = PrefixMatcher(config.get("single_chat_prefix", [""]))
+        self.voice_reply_prefix = PrefixMatcher(config.get("voice_reply_prefix", ["vo"]))
+        self.image_create_prefix = PrefixMatcher(config.get("image_create_prefix", [""]))
+        self.group_chat_keyword = KeywordMatcher(config.get("group_chat_keyword"))
+        self.group_name_keyword = KeywordMatcher(config.get("group_name_keyword_white_list", []))
+        group_name_white_list = config.get("group_name_white_list") or []
+        self.group_name_white_set = frozenset(group_name_white_list)
+        self.all_group_white = "ALL_GROUP" in group_name_white_list
+        group_chat_in_one_session = config.get("group_chat_in_one_session") or []
+        self.group_chat_in_one_session_set = frozenset(group_chat_in_one_session)
+        self.all_group_in_one_session = "ALL_GROUP" in group_chat_in_one_session
+        self.nick_name_black_set = frozenset(config.get("nick_name_black_list") or [])
+
+    def is_group_white(self, group_name):
+        return self.all_group_white or group_name in self.group_name_white_set or bool(self.group_name_keyword.contains(group_name))
+
+    def is_group_in_one_session(self, group_name):
+        return self.all_group_in_one_session or group_name in self.group_chat_in_one_session_set
+
+    def is_nick_name_black(self, nick_name):
+        return bool(nick_name) and nick_name in self.nick_name_black_set
+
+
+MENTION_SEPARATORS = "\u2005\u0020"  # @昵称后的分隔符：微信的四分之一空格和普通空格
+
+
+def strip_mentions(content, names, max_name_len=None):
+    """
+    一次遍历移除 content 中所有 "@昵称+分隔符"，昵称需在 names 集合中
+    同一位置可匹配多个昵称时(如 "bot" 与 "bot helper")取最长的，整个昵称一起移除，不会留下 "helper"
+    """
+    if "@" not in content or not names:
+        return content
+    if max_name_len is None:
+        max_name_len = max(len(name) for name in names)
+    parts = []
+    start = 0
+    i = content.find("@")
+    while i != -1:
+        end = -1
+        limit = min(len(content), i + 2 + max_name_len)
+        for k in range(limit - 1, i, -1):  # 从最长的候选开始
+            if content[k] in MENTION_SEPARATORS and content[i + 1:k] in names:
+                end = k + 1
+                break
+        if end == -1:
+            i = content.find("@", i + 1)
+        else:
+            parts.append(content[start:i])
+            start = end
+            i = content.find("@", end)
+    if not parts:
+        return content
+    parts.append(content[start:])
+    return "".join(parts)
+
+
+class MentionStripper(object):
+    """
+    群聊@消息中移除@机器人和@其他人的部分，按 (机器人昵称, 群昵称) 缓存，见 get_mention_stripper
+    """
+
+    def __init__(self, name, display_name=None):
+        self.names = frozenset([name or ""])
+        self.display_names = frozenset([display_name]) if display_name else frozenset()
+
+    def strip(self, content, at_list=None):
+        names = self.names
+        if isinstance(at_list, list) and at_list:
+            names = names.union(at_list)
+        result = strip_mentions(content, names)
+        if result == content and self.display_names:
+            # 移除后没有变化，使用群昵称再次移除
+            result = strip_mentions(content, self.display_names)
+        return result
+
+
+@functools.lru_cache(maxsize=1024)
+def get_mention_stripper(name, display_name=None) -> MentionStripper:
+    return MentionStripper(name, display_name)
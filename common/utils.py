@@ -3,7 +3,6 @@ import os
 import re
 import base64
 from urllib.parse import urlparse
-from PIL import Image
 from common.log import logger
 
 def fsize(file):
@@ -24,6 +23,7 @@ def fsize(file):
 def compress_imgfile(file, max_size):
     if fsize(file) <= max_size:
         return file
+    from PIL import Image
     file.seek(0)
     img = Image.open(file)
     rgb_image = img.convert("RGB")
@@ -266,6 +266,7 @@ def _is_valid_image_bytes(image_bytes: bytes):
     if not image_bytes or len(image_bytes) < 16:
         return False
     try:
+        from PIL import Image
         image_buffer = io.BytesIO(image_bytes)
         with Image.open(image_buffer) as image:
             image.verify()
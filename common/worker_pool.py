@@ -0,0 +1,99 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from common.log import logger
+from config import conf
+
+# 各处理阶段线程池的默认大小，可通过配置项 {name}_pool_size 覆盖
+DEFAULT_POOL_SIZES = {
+    "llm": 8,  # 大模型调用
+    "media": 4,  # 语音转码、语音识别等媒体处理
+    "send": 8,  # 插件处理、回复装饰和发送
+    "router": 16,  # 多模型路由的并行请求(故障转移和对冲)
+}
+
+
+class WorkerPool(ThreadPoolExecutor):
+    """
+    带排队深度和饱和度统计的线程池，不同处理阶段使用各自的池，避免慢的上游阻塞其它阶段
+    """
+
+    def __init__(self, name, max_workers):
+        super().__init__(max_workers=max_workers, thread_name_prefix="{}_pool".format(name))
+        self.name = name
+        self.max_workers = max_workers
+        self.pending = 0  # 已提交但尚未开始执行的任务数
+        self.active = 0  # 正在执行的任务数
+        self.max_pending = 0  # 历史最大排队深度
+        self.submitted = 0
+        self.completed = 0
+        self._stats_lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._stats_lock:
+            self.pending += 1
+            self.submitted += 1
+            self.max_pending = max(self.max_pending, self.pending)
+            if self.active + self.pending > self.max_workers:
+                logger.debug("[WorkerPool] pool {} saturated, active={}, pending={}".format(self.name, self.active, self.pending))
+        future = super().submit(self._run, fn, *args, **kwargs)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _run(self, fn, *args, **kwargs):
+        with self._stats_lock:
+            self.pending -= 1
+            self.active += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._stats_lock:
+                self.active -= 1
+                self.completed += 1
+
+    def _on_done(self, future):
+        if future.cancelled():  # 排队中被取消的任务不会进入_run
+            with self._stats_lock:
+                self.pending -= 1
+
+    @property
+    def saturation(self) -> float:
+        """正在执行的任务占线程数的比例，1表示线程已全部占满"""
+        return self.active / self.max_workers
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "max_workers": self.max_workers,
+                "active": self.active,
+                "queue_depth": self.pending,
+                "max_queue_depth": self.max_pending,
+                "saturation": self.active / self.max_workers,
+                "submitted": self.submitted,
+                "completed": self.completed,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_worker_pool(name) -> WorkerPool:
+    """
+    获取指定阶段的线程池，首次使用时按配置创建
+    """
+    with _pools_lock:
+        if name not in _pools:
+            size = conf().get("{}_pool_size".format(name)) or DEFAULT_POOL_SIZES.get(name, 8)
+            _pools[name] = WorkerPool(name, int(size))
+            logger.info("[WorkerPool] create pool {}, max_workers={}".format(name, size))
+        return _pools[name]
+
+
+def all_worker_pools() -> dict:
+    with _pools_lock:
+        return dict(_pools)
+
+
+def worker_pool_stats() -> dict:
+    return {name: pool.stats() for name, pool in all_worker_pools().items()}
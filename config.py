@@ -7,6 +7,7 @@ import pickle
 import copy
 
 from common.log import logger
+from common.trigger_matcher import TriggerMatcher
 
 # 将所有可用的配置项写在字典里, 请使用小写字母
 # 此处的配置值无实际意义，程序不会读取此处的配置，仅用于提示格式，请将配置加入到config.json中
@@ -49,6 +50,39 @@ available_setting = {
     "image_proxy": True,  # 是否需要图片代理，国内访问LinkAI时需要
     "image_create_prefix": ["画", "看", "找"],  # 开启图片回复的前缀
     "concurrency_in_session": 1,  # 同一会话最多有多少条消息在处理中，大于1可能乱序
+    "max_inflight_contexts": 0,  # 同时处理中的消息数上限，超出后按群/私聊用户公平轮转调度，0表示llm_pool_size的2倍(async_mode下为1000)
+    "fair_group_weight": 1,  # 公平调度时每个群的权重
+    "fair_single_weight": 1,  # 公平调度时每个私聊用户的权重
+    "session_rate_limit": 0,  # 每个会话每分钟最多处理的消息数，超出的消息忽略，0表示不限制
+    "group_rate_limit": 0,  # 每个群每分钟最多处理的消息数，0表示不限制
+    "session_queue_threshold": 0,  # 单个会话排队的消息数上限，0表示不限制
+    "session_queue_overflow": "drop",  # 排队达到上限时的处理: drop丢弃最早的消息, drop_newest丢弃新消息, merge合并到上一条消息, reject拒绝新消息并提示
+    "session_queue_reject_reply": "消息太多啦，请稍后再发",  # reject时的提示，每个会话每分钟最多提示一次
+    "session_queue_max_wait": 0,  # 消息排队超过该秒数后不再处理，0表示不限制
+    "reply_cache_groups": [],  # 开启问答缓存的群名称列表，ALL_GROUP表示所有群，相同的问题直接返回缓存的回答
+    "reply_cache_single_chat": False,  # 私聊是否开启问答缓存
+    "reply_cache_ttl": 3600,  # 缓存的回答有效期(秒)
+    "reply_cache_size": 1000,  # 最多缓存的问答数
+    "reply_cache_similarity": 0,  # 相似问题匹配阈值(0~1，字符n-gram的Jaccard相似度)，0表示只缓存完全相同的问题
+    "reply_cache_history_turns": 0,  # 缓存键包含最近几轮对话，0表示与上下文无关，适合常见问题
+    "debounce_window": 0,  # 防抖窗口(秒)，同一个人连续发送的文本消息在最后一条之后静默该时间再合并为一条处理，0表示不合并
+    "debounce_max_merge": 5,  # 防抖时最多合并的消息数，攒够后立即处理
+    "cancel_superseded_reply": False,  # 同一个人发送新问题时取消正在处理的旧问题，旧问题的回复不再发送
+    "llm_pool_size": 8,  # 大模型调用线程池大小
+    "media_pool_size": 4,  # 语音转码、识别线程池大小
+    "send_pool_size": 8,  # 插件处理、回复装饰和发送线程池大小
+    "router_pool_size": 16,  # bot_type为router时并行请求多个模型的线程池大小
+    "router_bots": [],  # bot_type为router时依次使用的bot类型，如 ["chatGPT", "claudeAPI"]，前面的优先
+    "router_hedge": True,  # 请求超过p95耗时仍未返回时，同时请求下一个bot
+    "router_hedge_delay": 10,  # 请求耗时样本不足时，发出对冲请求前等待的秒数
+    "router_breaker_failures": 5,  # 连续失败多少次后熔断
+    "router_breaker_cooldown": 30,  # 熔断后多少秒内不再请求该bot
+    "async_mode": False,  # 是否使用asyncio事件循环处理消息，bot和channel提供reply_async/send_async时不再为每个请求占用线程
+    "stream_reply": False,  # 是否使用流式回复，支持的channel(web、企业微信应用、飞书、钉钉卡片)会边生成边发送
+    "stream_reply_interval": 1,  # 流式回复两次增量发送之间的最小间隔，单位秒
+    "http_pool_size": 10,  # 公共HTTP客户端每个host保持的最大连接数
+    "http_connect_timeout": 5,  # 公共HTTP客户端默认连接超时，单位秒，读超时默认使用request_timeout
+    "http_max_retries": 2,  # 连接失败或幂等请求遇到502/503/504时的最大重试次数
     "image_create_size": "256x256",  # 图片大小,可选有 256x256, 512x512, 1024x1024 (dall-e-3默认为1024x1024)
     "image_create_use_chat_model": False,  # 绘图是否改用对话模型请求（需要模型返回Markdown图片链接）
     "group_chat_exit_group": False,
@@ -57,14 +91,26 @@ available_setting = {
     # 人格描述
     "character_desc": "你是ChatGPT, 一个由OpenAI训练的大型语言模型, 你旨在回答并解决人们的任何问题，并且可以使用多种语言与人交流。",
     "conversation_max_tokens": 1000,  # 支持上下文记忆的最多字符数
+    "token_cache_size": 10000,  # token计数缓存的最大条目数，相同的人设、提示词只需编码一次
+    "session_store": "memory",  # 会话存储后端，可选 memory、sqlite、redis，sqlite和redis在重启后可恢复对话
+    "session_max_count": 10000,  # 内存中最多保留的会话数，超出后淘汰最久未使用的会话
+    "session_store_path": "",  # sqlite会话存储的文件路径，为空时使用数据目录下的sessions.db
+    "session_store_redis_url": "redis://localhost:6379/0",  # redis会话存储地址
+    "session_store_flush_interval": 1,  # 持久化会话批量写入的间隔，单位秒
     # chatgpt限流配置
-    "rate_limit_chatgpt": 20,  # chatgpt的调用频率限制
+    "rate_limit_chatgpt": 20,  # chatgpt的调用频率限制，每分钟次数，按 API key 分别计算
+    "rate_limit_chatgpt_burst": None,  # 空闲后允许的突发请求数，默认等于 rate_limit_chatgpt
     "rate_limit_dalle": 50,  # openai dalle的调用频率限制
+    "rate_limit_dalle_burst": None,
+    "rate_limit_voice": 0,  # 语音识别和语音合成的调用频率限制，0表示不限制
+    "rate_limit_voice_burst": None,
     # chatgpt api参数 参考https://platform.openai.com/docs/api-reference/chat/create
     "temperature": 0.9,
     "top_p": 1,
     "frequency_penalty": 0,
     "presence_penalty": 0,
+    "request_max_retries": 2,  # 对话请求失败后的最大重试次数，重试间隔按指数退避并加随机抖动，服务端返回Retry-After时按其等待
+    "retry_max_delay": 30,  # 单次重试最长等待秒数，所有重试的总时长不超过request_timeout
     "request_timeout": 180,  # chatgpt请求超时时间，openai接口默认设置为600，对于难问题一般需要较长时间
     "timeout": 120,  # chatgpt重试超时时间，在这个时间内，将会自动重试
     # Baidu 文心一言参数
@@ -169,6 +215,8 @@ available_setting = {
     "appdata_dir": "",  # 数据目录
     # 插件配置
     "plugin_trigger_prefix": "$",  # 规范插件提供聊天相关指令的前缀，建议不要和管理员指令前缀"#"冲突
+    "plugin_lazy_init": True,  # 声明了触发指令的插件延迟到首次使用时再实例化
+    "plugin_init_workers": 4,  # 启动时并发实例化插件的线程数，1表示串行
     # 是否使用全局插件配置
     "use_global_plugin_config": False,
     "max_media_send_count": 3,  # 单次最大发送媒体资源的个数
@@ -202,6 +250,7 @@ class Config(dict):
             self[k] = v
         # user_datas: 用户数据，key为用户名，value为用户数据，也是dict
         self.user_datas = {}
+        self._snapshot = None
 
     def __getitem__(self, key):
         if key not in available_setting:
@@ -211,6 +260,7 @@ class Config(dict):
     def __setitem__(self, key, value):
         if key not in available_setting:
             raise Exception("key {} not in available_setting".format(key))
+        self._snapshot = None
         return super().__setitem__(key, value)
 
     def get(self, key, default=None):
@@ -221,6 +271,14 @@ class Config(dict):
         except Exception as e:
             raise e
 
+    def snapshot(self) -> "ConfigSnapshot":
+        """返回当前配置的不可变快照，配置被修改后下次调用时重新生成"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = ConfigSnapshot(self)
+            self._snapshot = snapshot
+        return snapshot
+
     # Make sure to return a dictionary to ensure atomic
     def get_user_data(self, user) -> dict:
         if self.user_datas.get(user) is None:
@@ -247,6 +305,31 @@ class Config(dict):
             logger.info("[Config] User datas error: {}".format(e))
 
 
+class ConfigSnapshot(object):
+    """
+    配置的不可变快照，消息处理热路径上使用，避免每次 conf().get 的校验和异常开销
+    配置项通过属性访问，未配置的项为 None，与 conf().get(key) 一致；
+    同时预先编译好前缀、关键词和白名单等触发条件(triggers)，修改配置或重新加载后会生成新的快照整体替换
+    """
+
+    def __init__(self, config: dict):
+        values = dict(config)
+        object.__setattr__(self, "_values", values)
+        object.__setattr__(self, "triggers", TriggerMatcher(values))
+
+    def __getattr__(self, key):
+        # 只有实例上不存在的属性才会走到这里
+        if key in available_setting:
+            return self._values.get(key)
+        raise AttributeError("key {} not in available_setting".format(key))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("ConfigSnapshot is immutable")
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+
 config = Config()
 
 
@@ -325,6 +408,10 @@ def conf():
     return config
 
 
+def conf_snapshot() -> ConfigSnapshot:
+    return config.snapshot()
+
+
 def get_appdata_dir():
     data_path = os.path.join(get_root(), conf().get("appdata_dir", ""))
     if not os.path.exists(data_path):
@@ -1,10 +1,7 @@
 import os
 import yaml
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional
 
-from agentmesh import AgentTeam, Agent, LLMModel
-from agentmesh.models import ClaudeModel
-from agentmesh.tools import ToolManager
 from config import conf
 
 import plugins
@@ -13,6 +10,9 @@ from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
 
+if TYPE_CHECKING:  # agentmesh 只在使用时导入
+    from agentmesh import AgentTeam, LLMModel
+
 
 @plugins.register(
     name="agent",
@@ -20,6 +20,8 @@ from common.log import logger
     version="0.1.0",
     author="Saboteur7",
     desire_priority=1,
+    events=[Event.ON_HANDLE_CONTEXT],
+    triggers=["agent "],
 )
 class AgentPlugin(Plugin):
     """Plugin for integrating AgentMesh framework."""
@@ -30,6 +32,9 @@ class AgentPlugin(Plugin):
         self.name = "agent"
         self.description = "Use AgentMesh framework to process tasks with multi-agent teams"
         self.config = self._load_config()
+        # agentmesh 导入较慢，在插件首次被触发实例化时才导入
+        from agentmesh.tools import ToolManager
+
         self.tool_manager = ToolManager()
         self.tool_manager.load_tools(config_dict=self.config.get("tools"))
         logger.info("[agent] inited")
@@ -71,8 +76,10 @@ class AgentPlugin(Plugin):
         return list(teams_config.keys())
 
 
-    def create_team_from_config(self, team_name: str) -> Optional[AgentTeam]:
+    def create_team_from_config(self, team_name: str) -> Optional["AgentTeam"]:
         """Create a team from configuration."""
+        from agentmesh import AgentTeam, Agent
+
         # Get teams configuration
         teams_config = self.config.get("teams", {})
 
@@ -253,7 +260,10 @@ class AgentPlugin(Plugin):
             e_context.action = EventAction.BREAK_PASS
         return
 
-    def create_llm_model(self, model_name) -> LLMModel:
+    def create_llm_model(self, model_name) -> "LLMModel":
+        from agentmesh import LLMModel
+        from agentmesh.models import ClaudeModel
+
         if conf().get("use_linkai"):
             api_base = "https://api.link-ai.tech/v1"
             api_key = conf().get("linkai_api_key")
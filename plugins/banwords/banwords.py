@@ -2,14 +2,32 @@
 
 import json
 import os
+import threading
+import time
+import weakref
 
 import plugins
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
+from config import conf, global_config
 from plugins import *
 
-from .lib.WordsSearch import WordsSearch
+from .lib.compact_search import CompactWordsSearch, OverlayWordsSearch
+
+
+def _watch_banwords(plugin_ref, interval):
+    """后台轮询词库文件，只持有插件的弱引用，插件被重新加载后旧线程自动退出"""
+    while True:
+        time.sleep(interval)
+        plugin = plugin_ref()
+        if plugin is None:
+            return
+        try:
+            plugin.check_reload()
+        except Exception as e:
+            logger.warning("[Banwords] reload banwords failed: {}".format(e))
+        del plugin
 
 
 @plugins.register(
@@ -35,25 +53,133 @@ class Banwords(Plugin):
                     with open(config_path, "w") as f:
                         json.dump(conf, f, indent=4)
 
-            self.searchr = WordsSearch()
             self.action = conf["action"]
-            banwords_path = os.path.join(curdir, "banwords.txt")
-            with open(banwords_path, "r", encoding="utf-8") as f:
-                words = []
-                for line in f:
-                    word = line.strip()
-                    if word:
-                        words.append(word)
-            self.searchr.SetKeywords(words)
+            self.banwords_path = os.path.join(curdir, "banwords.txt")
+            self.cache_path = os.path.join(curdir, "banwords.cache")
+            self._file_lock = threading.Lock()  # 串行化词库文件的修改
+            self._reload_lock = threading.Lock()  # 串行化重建
+            self._swap_lock = threading.Lock()  # 保护 searchr 的读-改-写，匹配时直接读取引用不加锁
+            self._file_stat = None
+            # 自动机按词库哈希缓存到磁盘，词库不变时直接mmap加载
+            self.searchr = OverlayWordsSearch(self._build()[0])
+            watch_interval = conf.get("watch_interval", 5)
+            if watch_interval and watch_interval > 0:
+                thread = threading.Thread(target=_watch_banwords, args=(weakref.ref(self), watch_interval), name="banwords_watcher", daemon=True)
+                thread.start()
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
             if conf.get("reply_filter", True):
                 self.handlers[Event.ON_DECORATE_REPLY] = self.on_decorate_reply
+                self.handlers[Event.ON_STREAM_CHUNK] = self.on_stream_chunk
                 self.reply_action = conf.get("reply_action", "ignore")
             logger.info("[Banwords] inited")
         except Exception as e:
             logger.warn("[Banwords] init failed, ignore or see https://github.com/zhayujie/chatgpt-on-wechat/tree/master/plugins/banwords .")
             raise e
 
+    def _file_signature(self):
+        st = os.stat(self.banwords_path)
+        return st.st_mtime_ns, st.st_size
+
+    def _read_words(self):
+        with open(self.banwords_path, "r", encoding="utf-8") as f:
+            return [word for word in (line.strip() for line in f) if word]
+
+    def _build(self):
+        """读取词库并构建(或从缓存加载)自动机，返回 (自动机, 是否命中缓存)"""
+        signature = self._file_signature()
+        words = self._read_words()
+        search, cached = CompactWordsSearch.load_or_build(words, self.cache_path)
+        self._file_stat = signature
+        logger.debug("[Banwords] {} words loaded, from cache: {}".format(len(words), cached))
+        return search, cached
+
+    def check_reload(self):
+        """词库文件有变化时重新构建"""
+        if self._file_signature() != self._file_stat:
+            self.reload_words()
+
+    def reload_words(self):
+        """
+        在调用线程中重建自动机，构建完成后替换引用，期间的消息继续使用旧自动机匹配
+        """
+        with self._reload_lock:
+            start = time.time()
+            with self._file_lock:  # 在读取词库之前记录当前的增量修改，这些修改已写入文件，新自动机包含它们
+                before = self.searchr
+            search, cached = self._build()
+            with self._swap_lock:
+                self.searchr = self.searchr.rebase(search, before)
+            logger.info("[Banwords] banwords reloaded, {} words, cost {:.2f}s, from cache: {}".format(len(search.keywords), time.time() - start, cached))
+
+    def add_words(self, words):
+        """新增敏感词并追加到词库文件，立即生效，不重建基础自动机"""
+        with self._file_lock:
+            with self._swap_lock:
+                words = [w for w in dict.fromkeys(words) if w not in self.searchr]
+                if not words:
+                    return words
+                self.searchr = self.searchr.add(words)
+            with open(self.banwords_path, "a+", encoding="utf-8") as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() > 0:
+                    f.seek(f.tell() - 1)
+                    if f.read(1) != "\n":
+                        f.write("\n")
+                f.write("\n".join(words) + "\n")
+            self._file_stat = self._file_signature()  # 文件的变化已生效，避免监控线程触发完整重建
+        return words
+
+    def remove_words(self, words):
+        """删除敏感词并从词库文件中移除，立即生效，不重建基础自动机"""
+        with self._file_lock:
+            with self._swap_lock:
+                words = [w for w in dict.fromkeys(words) if w in self.searchr]
+                if not words:
+                    return words
+                self.searchr = self.searchr.remove(words)
+            removed = set(words)
+            with open(self.banwords_path, "r", encoding="utf-8") as f:
+                lines = [line for line in f if line.strip() not in removed]
+            tmp_path = "{}.{}.tmp".format(self.banwords_path, os.getpid())
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(lines)
+            os.replace(tmp_path, self.banwords_path)
+            self._file_stat = self._file_signature()
+        return words
+
+    def _is_admin(self, e_context: EventContext) -> bool:
+        context = e_context["context"]
+        if context.get("isgroup"):
+            actual_user_id = context.kwargs.get("msg").actual_user_id
+            return bool(actual_user_id) and any(actual_user_id in admin_user for admin_user in global_config["admin_users"])
+        return context["receiver"] in global_config["admin_users"]
+
+    def _handle_command(self, e_context: EventContext, content):
+        """处理 $banwords add/del/reload 管理员指令，返回是否已处理"""
+        trigger_prefix = conf().get("plugin_trigger_prefix", "$")
+        command = trigger_prefix + "banwords"
+        if not content.startswith(command):
+            return False
+        args = content[len(command):].split()
+        if content[len(command):len(command) + 1] not in ("", " ") or not args:
+            return False
+        if not self._is_admin(e_context):
+            reply = Reply(ReplyType.ERROR, "需要管理员权限才能修改敏感词")
+        elif args[0] == "add" and len(args) > 1:
+            words = self.add_words(args[1:])
+            reply = Reply(ReplyType.INFO, "已添加{}个敏感词".format(len(words)))
+        elif args[0] in ("del", "remove") and len(args) > 1:
+            words = self.remove_words(args[1:])
+            reply = Reply(ReplyType.INFO, "已删除{}个敏感词".format(len(words)))
+        elif args[0] == "reload":
+            threading.Thread(target=self.reload_words, name="banwords_reload", daemon=True).start()
+            reply = Reply(ReplyType.INFO, "正在后台重新加载词库")
+        else:
+            reply = Reply(ReplyType.ERROR, self.get_help_text(verbose=True))
+        e_context["reply"] = reply
+        e_context.action = EventAction.BREAK_PASS
+        return True
+
     def on_handle_context(self, e_context: EventContext):
         if e_context["context"].type not in [
             ContextType.TEXT,
@@ -63,6 +189,8 @@ class Banwords(Plugin):
 
         content = e_context["context"].content
         logger.debug("[Banwords] on_handle_context. content: %s" % content)
+        if e_context["context"].type == ContextType.TEXT and self._handle_command(e_context, content):
+            return
         if self.action == "ignore":
             f = self.searchr.FindFirst(content)
             if f:
@@ -70,8 +198,9 @@ class Banwords(Plugin):
                 e_context.action = EventAction.BREAK_PASS
                 return
         elif self.action == "replace":
-            if self.searchr.ContainsAny(content):
-                reply = Reply(ReplyType.INFO, "发言中包含敏感词，请重试: \n" + self.searchr.Replace(content))
+            f, replaced = self.searchr.FindAndReplace(content)
+            if f:
+                reply = Reply(ReplyType.INFO, "发言中包含敏感词，请重试: \n" + replaced)
                 e_context["reply"] = reply
                 e_context.action = EventAction.BREAK_PASS
                 return
@@ -90,11 +219,38 @@ class Banwords(Plugin):
                 e_context.action = EventAction.BREAK_PASS
                 return
         elif self.reply_action == "replace":
-            if self.searchr.ContainsAny(content):
-                reply = Reply(ReplyType.INFO, "已替换回复中的敏感词: \n" + self.searchr.Replace(content))
+            f, replaced = self.searchr.FindAndReplace(content)
+            if f:
+                reply = Reply(ReplyType.INFO, "已替换回复中的敏感词: \n" + replaced)
                 e_context["reply"] = reply
                 e_context.action = EventAction.CONTINUE
                 return
 
-    def get_help_text(self, **kwargs):
-        return "过滤消息中的敏感词。"
+    def on_stream_chunk(self, e_context: EventContext):
+        """流式回复的每段文本与之前已发送的内容拼接后再匹配，跨段的敏感词也能发现"""
+        reply = e_context["reply"]
+        sent = e_context["content"]
+        content = sent + reply.content
+        if self.reply_action == "ignore":
+            f = self.searchr.FindFirst(content)
+            if f:
+                logger.info("[Banwords] %s in stream reply" % f["Keyword"])
+                e_context["reply"] = None  # 结束流式回复，敏感词及之后的内容不再发送
+                e_context.action = EventAction.BREAK_PASS
+                return
+        elif self.reply_action == "replace":
+            f, replaced = self.searchr.FindAndReplace(content)
+            if f:  # 替换前后长度不变，已发送部分之后的即为本段替换后的文本
+                reply.content = replaced[len(sent):]
+                return
+
+    def get_help_text(self, verbose=False, **kwargs):
+        help_text = "过滤消息中的敏感词。"
+        if not verbose:
+            return help_text
+        trigger_prefix = conf().get("plugin_trigger_prefix", "$")
+        help_text += "\n\n管理员指令：\n"
+        help_text += "{}banwords add 词1 词2: 添加敏感词\n".format(trigger_prefix)
+        help_text += "{}banwords del 词1 词2: 删除敏感词\n".format(trigger_prefix)
+        help_text += "{}banwords reload: 重新加载词库".format(trigger_prefix)
+        return help_text
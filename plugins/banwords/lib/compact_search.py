@@ -0,0 +1,389 @@
+# encoding:utf-8
+"""
+扁平数组存储的 Aho-Corasick 自动机，接口与 WordsSearch 兼容
+
+状态按广度优先编号，所有表都是 uint32 数组：
+    edge_start[s] ~ edge_start[s+1]  状态 s 的出边在 edge_chars/edge_targets 中的区间，按字符排序，二分查找
+    fail[s]                          失败指针
+    out_len[s]                       在状态 s 结束的最长关键词长度(含失败链)，0 表示没有
+    out_kw[s]                        在状态 s 结束的关键词序号，用于 FindFirst
+
+构建结果可以按词库内容的哈希缓存到磁盘，启动时通过 mmap 直接映射，不必每次重新构建
+
+OverlayWordsSearch 在构建好的自动机上叠加少量增删，修改词库时不必等待完整重建
+"""
+import hashlib
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from collections import deque
+
+_MAGIC = b"BWAC\x01\x00\x00\x00"
+_HEADER = struct.Struct("<8s32sQQQ")  # magic, 词库sha256, 状态数, 边数, 关键词字节数
+_NONE = 0xFFFFFFFF
+
+
+def _uint32_array(values=()):
+    for code in ("I", "L"):
+        if array(code).itemsize == 4:
+            return array(code, values)
+    raise RuntimeError("no 4-byte unsigned array type")
+
+
+def keywords_digest(keywords) -> bytes:
+    return hashlib.sha256("\n".join(keywords).encode("utf-8")).digest()
+
+
+class CompactWordsSearch(object):
+    def __init__(self):
+        self._keywords = []
+        self._edge_start = _uint32_array([0, 0])
+        self._edge_chars = _uint32_array()
+        self._edge_targets = _uint32_array()
+        self._fail = _uint32_array([0])
+        self._out_len = _uint32_array([0])
+        self._out_kw = _uint32_array([_NONE])
+        self._mmap = None
+        self._root = {}
+        self._keyword_set = None
+        self.digest = keywords_digest([])
+
+    def SetKeywords(self, keywords):
+        self._keywords = list(keywords)
+        self._keyword_set = None
+        self.digest = keywords_digest(self._keywords)
+        # 先用临时的字典树构建，再展开成数组
+        children = [{}]
+        own_kw = [_NONE]
+        for index, keyword in enumerate(self._keywords):
+            node = 0
+            for ch in keyword:
+                c = ord(ch)
+                nxt = children[node].get(c)
+                if nxt is None:
+                    nxt = len(children)
+                    children[node][c] = nxt
+                    children.append({})
+                    own_kw.append(_NONE)
+                node = nxt
+            if node and own_kw[node] == _NONE:
+                own_kw[node] = index
+
+        # 广度优先重新编号，保证父状态在子状态之前，便于计算失败指针
+        order = [0]
+        new_id = {0: 0}
+        queue = deque([0])
+        while queue:
+            node = queue.popleft()
+            for c in sorted(children[node]):
+                child = children[node][c]
+                new_id[child] = len(order)
+                order.append(child)
+                queue.append(child)
+
+        n = len(order)
+        edge_start = _uint32_array([0]) * (n + 1)
+        edge_chars = _uint32_array()
+        edge_targets = _uint32_array()
+        for sid, node in enumerate(order):
+            edge_start[sid] = len(edge_chars)
+            for c in sorted(children[node]):
+                edge_chars.append(c)
+                edge_targets.append(new_id[children[node][c]])
+        edge_start[n] = len(edge_chars)
+        self._edge_start, self._edge_chars, self._edge_targets = edge_start, edge_chars, edge_targets
+
+        fail = _uint32_array([0]) * n
+        out_len = _uint32_array([0]) * n
+        out_kw = _uint32_array([_NONE]) * n
+        self._fail = fail  # 下面计算失败指针时 _goto 需要用到已算好的部分
+        for sid, node in enumerate(order):
+            kw = own_kw[node]
+            if kw != _NONE:
+                out_kw[sid] = kw
+                out_len[sid] = len(self._keywords[kw])
+        for sid in range(n):  # 按广度优先顺序，失败状态一定已经处理过
+            for i in range(edge_start[sid], edge_start[sid + 1]):
+                child = edge_targets[i]
+                if sid == 0:
+                    fail[child] = 0
+                else:
+                    fail[child] = self._goto(fail[sid], edge_chars[i])
+                f = fail[child]
+                if out_kw[child] == _NONE:
+                    out_kw[child] = out_kw[f]
+                if out_len[f] > out_len[child]:
+                    out_len[child] = out_len[f]
+        self._out_len, self._out_kw = out_len, out_kw
+        self._mmap = None
+        self._build_root()
+
+    @property
+    def keywords(self):
+        return self._keywords
+
+    def keyword_set(self):
+        if self._keyword_set is None:
+            self._keyword_set = frozenset(self._keywords)
+        return self._keyword_set
+
+    def _build_root(self):
+        # 未命中时大部分字符都在根状态查找，根状态的出边额外放一份字典
+        lo, hi = self._edge_start[0], self._edge_start[1]
+        self._root = dict(zip(self._edge_chars[lo:hi], self._edge_targets[lo:hi]))
+
+    def _goto(self, state, c):
+        edge_start, edge_chars, edge_targets, fail = self._edge_start, self._edge_chars, self._edge_targets, self._fail
+        while True:
+            lo, hi = edge_start[state], edge_start[state + 1]
+            if lo < hi:
+                i = bisect_left(edge_chars, c, lo, hi)
+                if i < hi and edge_chars[i] == c:
+                    return edge_targets[i]
+            if state == 0:
+                return 0
+            state = fail[state]
+
+    def _match(self, index, state):
+        return self._match_keyword(index, self._out_kw[state])
+
+    def _match_keyword(self, index, kw):
+        keyword = self._keywords[kw]
+        return {"Keyword": keyword, "Success": True, "End": index, "Start": index + 1 - len(keyword), "Index": kw}
+
+    def _walk(self, text):
+        """逐字符推进自动机，产出 (位置, 状态)"""
+        root, edge_start, edge_chars, edge_targets, fail = self._root, self._edge_start, self._edge_chars, self._edge_targets, self._fail
+        state = 0
+        for index, ch in enumerate(text):
+            c = ord(ch)
+            while True:
+                if state == 0:
+                    state = root.get(c, 0)
+                    break
+                lo, hi = edge_start[state], edge_start[state + 1]
+                if lo < hi:
+                    i = bisect_left(edge_chars, c, lo, hi)
+                    if i < hi and edge_chars[i] == c:
+                        state = edge_targets[i]
+                        break
+                state = fail[state]
+            yield index, state
+
+    def _scan(self, text, replaceChar=None):
+        """
+        单次遍历：replaceChar 为 None 时命中第一个关键词即返回，否则继续遍历并替换所有关键词
+        返回 (第一个命中的位置和状态或None, 替换后的字符列表或None)，热路径上展开了 _walk 以减少函数调用
+        """
+        root, edge_start, edge_chars, edge_targets, fail, out_len = (
+            self._root, self._edge_start, self._edge_chars, self._edge_targets, self._fail, self._out_len)
+        state = 0
+        first = None
+        result = None
+        for index, ch in enumerate(text):
+            c = ord(ch)
+            while True:
+                if state == 0:
+                    state = root.get(c, 0)
+                    break
+                lo, hi = edge_start[state], edge_start[state + 1]
+                if lo < hi:
+                    i = bisect_left(edge_chars, c, lo, hi)
+                    if i < hi and edge_chars[i] == c:
+                        state = edge_targets[i]
+                        break
+                state = fail[state]
+            length = out_len[state]
+            if length:
+                if first is None:
+                    first = (index, state)
+                    if replaceChar is None:
+                        break
+                    result = list(text)
+                for j in range(index + 1 - length, index + 1):
+                    result[j] = replaceChar
+        return first, result
+
+    def FindFirst(self, text):
+        first, _ = self._scan(text)
+        return None if first is None else self._match(*first)
+
+    def FindAll(self, text):
+        fail, out_kw = self._fail, self._out_kw
+        results = []
+        for index, state in self._walk(text):
+            s = state
+            seen = set()
+            while s and out_kw[s] != _NONE:  # 沿失败链收集所有在此结束的关键词
+                kw = out_kw[s]
+                if kw not in seen:
+                    seen.add(kw)
+                    results.append(self._match_keyword(index, kw))
+                s = fail[s]
+        return results
+
+    def ContainsAny(self, text):
+        return self.FindFirst(text) is not None
+
+    def Replace(self, text, replaceChar="*"):
+        return self.FindAndReplace(text, replaceChar)[1]
+
+    def FindAndReplace(self, text, replaceChar="*"):
+        """
+        一次遍历同时完成查找和替换，返回 (第一个命中的关键词信息或None, 替换后的文本)
+        """
+        first, result = self._scan(text, replaceChar)
+        if first is None:
+            return None, text
+        return self._match(*first), "".join(result)
+
+    def save(self, path):
+        """写入缓存文件，先写临时文件再替换，避免其它进程读到不完整的文件"""
+        keywords = "\n".join(self._keywords).encode("utf-8")
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, self.digest, len(self._fail), len(self._edge_chars), len(keywords)))
+            for table in (self._edge_start, self._edge_chars, self._edge_targets, self._fail, self._out_len, self._out_kw):
+                table.tofile(f)
+            f.write(keywords)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, digest=None):
+        """
+        mmap 映射缓存文件，digest 不一致或文件损坏时返回 None
+        """
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, file_digest, n_states, n_edges, kw_bytes = _HEADER.unpack_from(mm, 0)
+            if magic != _MAGIC or (digest is not None and file_digest != digest):
+                mm.close()
+                return None
+            expected = _HEADER.size + 4 * ((n_states + 1) + 2 * n_edges + 3 * n_states) + kw_bytes
+            if len(mm) != expected:
+                mm.close()
+                return None
+            view = memoryview(mm)
+            offset = _HEADER.size
+            tables = []
+            for count in (n_states + 1, n_edges, n_edges, n_states, n_states, n_states):
+                tables.append(view[offset:offset + 4 * count].cast("I"))
+                offset += 4 * count
+            keywords = bytes(view[offset:offset + kw_bytes]).decode("utf-8")
+        except Exception:
+            mm.close()
+            return None
+        search = cls()
+        search._edge_start, search._edge_chars, search._edge_targets, search._fail, search._out_len, search._out_kw = tables
+        search._keywords = keywords.split("\n") if kw_bytes else []
+        search.digest = file_digest
+        search._mmap = mm
+        search._build_root()
+        return search
+
+    @classmethod
+    def load_or_build(cls, keywords, cache_path):
+        """
+        按词库哈希读取缓存，未命中时构建并写入缓存
+        """
+        digest = keywords_digest(keywords)
+        if os.path.exists(cache_path):
+            search = cls.load(cache_path, digest)
+            if search is not None:
+                return search, True
+        search = cls()
+        search.SetKeywords(keywords)
+        try:
+            search.save(cache_path)
+        except OSError:
+            pass
+        return search, False
+
+
+def _first_match(matches):
+    """多个命中中取结束位置最早的，同一位置取最长的，与自动机单次遍历的结果一致"""
+    return min(matches, key=lambda m: (m["End"], m["Start"])) if matches else None
+
+
+class OverlayWordsSearch(object):
+    """
+    基础自动机 + 增量修改，接口与 CompactWordsSearch 兼容
+
+    新增的词单独构建一个小自动机，删除的词在命中结果中过滤掉。对象不可变，
+    add/remove/rebase 都返回新对象，调用方替换引用即可原子生效，正在匹配的请求继续使用旧对象
+    """
+
+    def __init__(self, base, added=(), removed=()):
+        self.base = base
+        base_words = base.keyword_set()
+        self.added = frozenset(w for w in added if w and w not in base_words)
+        self.removed = frozenset(w for w in removed if w in base_words)
+        self._delta = None
+        if self.added:
+            self._delta = CompactWordsSearch()
+            self._delta.SetKeywords(sorted(self.added))
+
+    @property
+    def dirty(self):
+        """是否有尚未合并进基础自动机的修改"""
+        return bool(self.added or self.removed)
+
+    def __contains__(self, word):
+        return word in self.added or (word in self.base.keyword_set() and word not in self.removed)
+
+    def add(self, words):
+        words = set(words)
+        return OverlayWordsSearch(self.base, self.added | words, self.removed - words)
+
+    def remove(self, words):
+        words = set(words)
+        return OverlayWordsSearch(self.base, self.added - words, self.removed | words)
+
+    def rebase(self, base, since=None):
+        """
+        换用从词库文件新构建的基础自动机，文件是唯一的依据，之前的增量修改全部丢弃；
+        since 为开始读取文件前的对象时，只保留在那之后(构建期间)发生的修改，叠加在新自动机上
+        """
+        if since is None:
+            return OverlayWordsSearch(base)
+        return OverlayWordsSearch(base, self.added - since.added, self.removed - since.removed)
+
+    def FindAll(self, text):
+        if self.removed:
+            results = [m for m in self.base.FindAll(text) if m["Keyword"] not in self.removed]
+        else:
+            results = self.base.FindAll(text)
+        if self._delta is not None:
+            results.extend(self._delta.FindAll(text))
+        return results
+
+    def FindFirst(self, text):
+        if self.removed:
+            return _first_match(self.FindAll(text))
+        first = self.base.FindFirst(text)
+        if self._delta is not None:
+            delta = self._delta.FindFirst(text)
+            if delta is not None:
+                first = _first_match([first, delta] if first is not None else [delta])
+        return first
+
+    def ContainsAny(self, text):
+        return self.FindFirst(text) is not None
+
+    def Replace(self, text, replaceChar="*"):
+        return self.FindAndReplace(text, replaceChar)[1]
+
+    def FindAndReplace(self, text, replaceChar="*"):
+        if not self.dirty:
+            return self.base.FindAndReplace(text, replaceChar)
+        matches = self.FindAll(text)
+        if not matches:
+            return None, text
+        result = list(text)
+        for m in matches:
+            for j in range(m["Start"], m["End"] + 1):
+                result[j] = replaceChar
+        return _first_match(matches), "".join(result)
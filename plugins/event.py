@@ -26,6 +26,12 @@ class Event(Enum):
 
     # AFTER_SEND_REPLY = 5    # 发送回复后
 
+    ON_STREAM_CHUNK = 6  # 流式回复的一段文本发送前
+    """
+    e_context = {  "channel": 消息channel, "context" : 本次消息的context, "reply" : 本段文本的回复(ReplyType.TEXT), "content" : 之前已发送的全部文本 }
+    reply 置为 None 时结束本次流式回复，之后的文本不再发送
+    """
+
 
 class EventAction(Enum):
     CONTINUE = 1  # 事件未结束，继续交给下个插件处理，如果没有下个插件，则交付给默认的事件处理逻辑
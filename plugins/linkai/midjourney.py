@@ -1,7 +1,8 @@
 from enum import Enum
 from config import conf
 from common.log import logger
-import requests
+from common import http_client
+from common.token_bucket import KeyedTokenBucket
 import threading
 import time
 from bridge.reply import Reply, ReplyType
@@ -77,6 +78,9 @@ class MJBot:
         self.temp_dict = {}
         self.tasks_lock = threading.Lock()
         self.event_loop = asyncio.new_event_loop()
+        # 每个用户每分钟可提交的任务数，未配置时只限制同时进行的任务数
+        rate_limit = config.get("rate_limit_per_user") if config else None
+        self.user_limiter = KeyedTokenBucket(rate_limit, burst=config.get("rate_limit_burst")) if rate_limit else None
 
     def judge_mj_task_type(self, e_context: EventContext):
         """
@@ -199,7 +203,7 @@ class MJBot:
         body = {"prompt": prompt, "mode": mode, "auto_translate": self.config.get("auto_translate")}
         if not self.config.get("img_proxy"):
             body["img_proxy"] = False
-        res = requests.post(url=self.base_url + "/generate", json=body, headers=self.headers, timeout=(5, 40))
+        res = http_client.post(url=self.base_url + "/generate", json=body, headers=self.headers, timeout=(5, 40))
         if res.status_code == 200:
             res = res.json()
             logger.debug(f"[MJ] image generate, res={res}")
@@ -240,7 +244,7 @@ class MJBot:
             body["index"] = index
         if not self.config.get("img_proxy"):
             body["img_proxy"] = False
-        res = requests.post(url=self.base_url + "/operate", json=body, headers=self.headers, timeout=(5, 40))
+        res = http_client.post(url=self.base_url + "/operate", json=body, headers=self.headers, timeout=(5, 40))
         logger.debug(res)
         if res.status_code == 200:
             res = res.json()
@@ -274,7 +278,7 @@ class MJBot:
             time.sleep(10)
             url = f"{self.base_url}/tasks/{task.id}"
             try:
-                res = requests.get(url, headers=self.headers, timeout=8)
+                res = http_client.get(url, headers=self.headers, timeout=8)
                 if res.status_code == 200:
                     res_json = res.json()
                     logger.debug(f"[MJ] task check res sync, task_id={task.id}, status={res.status_code}, "
@@ -358,6 +362,11 @@ class MJBot:
             e_context["reply"] = reply
             e_context.action = EventAction.BREAK_PASS
             return False
+        if self.user_limiter and not self.user_limiter.try_acquire(user_id):
+            reply = Reply(ReplyType.INFO, "您的Midjourney作图请求过于频繁，请稍后再试")
+            e_context["reply"] = reply
+            e_context.action = EventAction.BREAK_PASS
+            return False
         return True
 
     def _fetch_mode(self, prompt) -> str:
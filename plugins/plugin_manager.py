@@ -5,6 +5,9 @@ import importlib.util
 import json
 import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from common.log import logger
 from common.singleton import singleton
@@ -19,10 +22,15 @@ class PluginManager:
     def __init__(self):
         self.plugins = SortedDict(lambda k, v: v.priority, reverse=True)
         self.listening_plugins = {}
+        self.dispatch_table = {}  # event -> ((name, handler), ...)，插件变化时整体替换
         self.instances = {}
         self.pconf = {}
         self.current_plugin_path = None
         self.loaded = {}
+        self.lazy_plugins = set()  # 声明了触发条件、尚未实例化的插件，首次命中时再实例化
+        self.import_times = {}  # 插件目录 -> 导入耗时(秒)
+        self.init_times = {}  # 插件名 -> 实例化耗时(秒)
+        self._lazy_lock = threading.Lock()
 
     def register(self, name: str, desire_priority: int = 0, **kwargs):
         def wrapper(plugincls):
@@ -35,6 +43,9 @@ class PluginManager:
             plugincls.namecn = kwargs.get("namecn") if kwargs.get("namecn") != None else name
             plugincls.hidden = kwargs.get("hidden") if kwargs.get("hidden") != None else False
             plugincls.enabled = True
+            # 插件监听的事件和触发指令(不含plugin_trigger_prefix)，两者都声明时插件延迟到首次命中指令时才实例化
+            plugincls.events = tuple(kwargs.get("events") or ())
+            plugincls.triggers = tuple(kwargs.get("triggers") or ())
             if self.current_plugin_path == None:
                 raise Exception("Plugin path not set")
             self.plugins[name.upper()] = plugincls
@@ -97,6 +108,7 @@ class PluginManager:
                     # 导入插件
                     import_path = "plugins.{}".format(plugin_name)
                     try:
+                        start = time.perf_counter()
                         self.current_plugin_path = plugin_path
                         if plugin_path in self.loaded:
                             if plugin_name.upper() != 'GODCMD':
@@ -109,6 +121,7 @@ class PluginManager:
                         else:
                             self.loaded[plugin_path] = importlib.import_module(import_path)
                         self.current_plugin_path = None
+                        self.import_times[plugin_path] = time.perf_counter() - start
                     except Exception as e:
                         logger.warn("Failed to import plugin %s: %s" % (plugin_name, e))
                         continue
@@ -128,7 +141,7 @@ class PluginManager:
             else:
                 self.plugins[name].enabled = pconf["plugins"][rawname]["enabled"]
                 self.plugins[name].priority = pconf["plugins"][rawname]["priority"]
-                self.plugins._update_heap(name)  # 更新下plugins中的顺序
+                self.plugins.update_order(name)  # 更新下plugins中的顺序
         if modified:
             self.save_config()
         return new_plugins
@@ -136,41 +149,171 @@ class PluginManager:
     def refresh_order(self):
         for event in self.listening_plugins.keys():
             self.listening_plugins[event].sort(key=lambda name: self.plugins[name].priority, reverse=True)
+        self.refresh_dispatch_table()
+
+    def refresh_dispatch_table(self):
+        """
+        按优先级为每个事件预先生成已开启插件的处理函数列表，emit_event 直接遍历，插件变化时重新生成
+        """
+        dispatch_table = {}
+        for event, names in self.listening_plugins.items():
+            handlers = []
+            for name in dict.fromkeys(names):
+                if name not in self.plugins or not self.plugins[name].enabled:
+                    continue
+                instance = self.instances.get(name)
+                if instance is None:
+                    if name in self.lazy_plugins and event in self.plugins[name].events:
+                        handlers.append((name, self._lazy_handler(name, event)))
+                    continue
+                handler = instance.handlers.get(event)
+                if handler is not None:
+                    handlers.append((name, handler))
+            dispatch_table[event] = tuple(handlers)
+        self.dispatch_table = dispatch_table
+
+    def _is_lazy(self, plugincls):
+        return bool(plugincls.events and plugincls.triggers) and conf().get("plugin_lazy_init", True)
+
+    def _init_plugins(self, names):
+        """
+        实例化插件，返回与 names 顺序一致的 [(name, instance, error)]
+        插件之间的初始化互不依赖，数量较多时放到线程池中并发执行
+        """
+
+        def init(name):
+            start = time.perf_counter()
+            try:
+                return name, self.plugins[name](), None
+            except Exception as e:
+                return name, None, e
+            finally:
+                self.init_times[name] = time.perf_counter() - start
+
+        workers = conf().get("plugin_init_workers", 4)
+        if workers > 1 and len(names) > 1:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="plugin_init") as executor:
+                return list(executor.map(init, names))
+        return [init(name) for name in names]
+
+    def _register_instance(self, name, instance):
+        if name in self.instances:
+            self.instances[name].handlers.clear()
+        self.instances[name] = instance
+        for event in instance.handlers:
+            if event not in self.listening_plugins:
+                self.listening_plugins[event] = []
+            if name not in self.listening_plugins[event]:
+                self.listening_plugins[event].append(name)
 
     def activate_plugins(self):  # 生成新开启的插件实例
         failed_plugins = []
+        names = []
         for name, plugincls in self.plugins.items():
             if plugincls.enabled:
                 if 'GODCMD' in self.instances and name == 'GODCMD':
                     continue
-                # if name not in self.instances:
-                try:
-                    instance = plugincls()
-                except Exception as e:
-                    logger.warn("Failed to init %s, diabled. %s" % (name, e))
-                    self.disable_plugin(name)
-                    failed_plugins.append(name)
+                if self._is_lazy(plugincls):
+                    # 只登记监听的事件，首次命中触发指令时再实例化
+                    if name in self.instances:
+                        self.instances.pop(name).handlers.clear()
+                    self.lazy_plugins.add(name)
+                    for event in plugincls.events:
+                        if event not in self.listening_plugins:
+                            self.listening_plugins[event] = []
+                        if name not in self.listening_plugins[event]:
+                            self.listening_plugins[event].append(name)
                     continue
-                if name in self.instances:
-                    self.instances[name].handlers.clear()
-                self.instances[name] = instance
-                for event in instance.handlers:
-                    if event not in self.listening_plugins:
-                        self.listening_plugins[event] = []
-                    self.listening_plugins[event].append(name)
+                names.append(name)
+        # 按优先级顺序登记，保证结果与串行初始化一致
+        for name, instance, error in self._init_plugins(names):
+            if error is not None:
+                logger.warn("Failed to init %s, diabled. %s" % (name, error))
+                self.disable_plugin(name)
+                failed_plugins.append(name)
+                continue
+            self._register_instance(name, instance)
         self.refresh_order()
         return failed_plugins
 
+    def get_instance(self, name: str):
+        """
+        获取插件实例，延迟加载的插件在此时实例化，插件未开启或初始化失败时返回None
+        """
+        name = name.upper()
+        instance = self.instances.get(name)
+        if instance is not None or name not in self.lazy_plugins:
+            return instance
+        with self._lazy_lock:
+            instance = self.instances.get(name)
+            if instance is not None or name not in self.lazy_plugins:
+                return instance
+            self.lazy_plugins.discard(name)
+            [(_, instance, error)] = self._init_plugins([name])
+            if error is not None:
+                logger.warn("Failed to init %s, diabled. %s" % (name, error))
+                self.disable_plugin(name)
+                return None
+            self._register_instance(name, instance)
+            self.refresh_order()
+            logger.info("Plugin %s lazily inited, cost %.3fs" % (name, self.init_times[name]))
+            return instance
+
+    def _lazy_handler(self, name, event):
+        """延迟加载插件的占位处理函数，消息命中插件声明的触发指令时才实例化插件并转交"""
+        triggers = self.plugins[name].triggers
+
+        def handler(e_context: EventContext, *args, **kwargs):
+            context = e_context.econtext.get("context")
+            content = getattr(context, "content", None)
+            if not isinstance(content, str):
+                return
+            trigger_prefix = conf().get("plugin_trigger_prefix", "$")
+            if not content.startswith(trigger_prefix):
+                return
+            command = content[len(trigger_prefix):]
+            if not any(command.startswith(trigger) for trigger in triggers):
+                return
+            instance = self.get_instance(name)
+            if instance is None:
+                return
+            real_handler = instance.handlers.get(event)
+            if real_handler is not None:
+                return real_handler(e_context, *args, **kwargs)
+
+        return handler
+
+    def startup_profile(self):
+        """
+        返回 [(插件名, 导入耗时, 实例化耗时或None)]，按总耗时从高到低排序，实例化耗时为None表示尚未实例化
+        """
+        profile = []
+        for name, plugincls in self.plugins.items():
+            import_time = self.import_times.get(plugincls.path, 0.0)
+            profile.append((name, import_time, self.init_times.get(name)))
+        profile.sort(key=lambda item: item[1] + (item[2] or 0), reverse=True)
+        return profile
+
+    def _log_startup_profile(self):
+        lines = []
+        for name, import_time, init_time in self.startup_profile():
+            if init_time is None:
+                init_desc = "lazy" if name in self.lazy_plugins else "-"
+            else:
+                init_desc = "%.3fs" % init_time
+            lines.append("  %s: import %.3fs, init %s" % (name, import_time, init_desc))
+        logger.info("Plugins startup profile:\n" + "\n".join(lines))
+
     def reload_plugin(self, name: str):
         name = name.upper()
         remove_plugin_config(name)
-        if name in self.instances:
+        if name in self.instances or name in self.lazy_plugins:
             for event in self.listening_plugins:
                 if name in self.listening_plugins[event]:
                     self.listening_plugins[event].remove(name)
             if name in self.instances:
-                self.instances[name].handlers.clear()
-            del self.instances[name]
+                self.instances.pop(name).handlers.clear()
+            self.lazy_plugins.discard(name)
             self.activate_plugins()
             return True
         return False
@@ -186,17 +329,17 @@ class PluginManager:
             if name.upper() not in self.plugins:
                 logger.error("Plugin %s not found, but found in plugins.json" % name)
         self.activate_plugins()
+        self._log_startup_profile()
 
     def emit_event(self, e_context: EventContext, *args, **kwargs):
-        if e_context.event in self.listening_plugins:
-            for name in self.listening_plugins[e_context.event]:
-                if self.plugins[name].enabled and e_context.action == EventAction.CONTINUE:
-                    logger.debug("Plugin %s triggered by event %s" % (name, e_context.event))
-                    instance = self.instances[name]
-                    instance.handlers[e_context.event](e_context, *args, **kwargs)
-                    if e_context.is_break():
-                        e_context["breaked_by"] = name
-                        logger.debug("Plugin %s breaked event %s" % (name, e_context.event))
+        for name, handler in self.dispatch_table.get(e_context.event, ()):
+            if e_context.action != EventAction.CONTINUE:
+                break
+            logger.debug("Plugin %s triggered by event %s" % (name, e_context.event))
+            handler(e_context, *args, **kwargs)
+            if e_context.is_break():
+                e_context["breaked_by"] = name
+                logger.debug("Plugin %s breaked event %s" % (name, e_context.event))
         return e_context
 
     def set_plugin_priority(self, name: str, priority: int):
@@ -206,10 +349,10 @@ class PluginManager:
         if self.plugins[name].priority == priority:
             return True
         self.plugins[name].priority = priority
-        self.plugins._update_heap(name)
+        self.plugins.update_order(name)
         rawname = self.plugins[name].name
         self.pconf["plugins"][rawname]["priority"] = priority
-        self.pconf["plugins"]._update_heap(rawname)
+        self.pconf["plugins"].update_order(rawname)
         self.save_config()
         self.refresh_order()
         return True
@@ -238,6 +381,7 @@ class PluginManager:
             rawname = self.plugins[name].name
             self.pconf["plugins"][rawname]["enabled"] = False
             self.save_config()
+            self.refresh_dispatch_table()
             return True
         return True
 
@@ -336,9 +480,11 @@ class PluginManager:
                 if name in self.listening_plugins[event]:
                     self.listening_plugins[event].remove(name)
             del self.plugins[name]
+            self.lazy_plugins.discard(name)
             del self.pconf["plugins"][rawname]
             self.loaded[dirname] = None
             self.save_config()
+            self.refresh_dispatch_table()
             return True, "卸载插件成功"
         except Exception as e:
             logger.error("Failed to uninstall plugin, {}".format(e))
@@ -1,6 +1,4 @@
-from chatgpt_tool_hub.apps import AppFactory
-from chatgpt_tool_hub.apps.app import App
-from chatgpt_tool_hub.tools.tool_register import main_tool_register
+from typing import TYPE_CHECKING
 
 import plugins
 from bridge.bridge import Bridge
@@ -10,6 +8,9 @@ from common import const
 from config import conf, get_appdata_dir
 from plugins import *
 
+if TYPE_CHECKING:  # chatgpt_tool_hub 只在使用时导入
+    from chatgpt_tool_hub.apps import App
+
 
 @plugins.register(
     name="tool",
@@ -17,6 +18,8 @@ from plugins import *
     version="0.5",
     author="goldfishh",
     desire_priority=0,
+    events=[Event.ON_HANDLE_CONTEXT],
+    triggers=["tool"],
 )
 class Tool(Plugin):
     def __init__(self):
@@ -28,7 +31,6 @@ class Tool(Plugin):
             raise Exception("config.json not found")
         logger.info("[tool] inited")
 
-
     def get_help_text(self, verbose=False, **kwargs):
         help_text = "这是一个能让chatgpt联网，搜索，数字运算的插件，将赋予强大且丰富的扩展能力。"
         trigger_prefix = conf().get("plugin_trigger_prefix", "$")
@@ -39,6 +41,8 @@ class Tool(Plugin):
         help_text += f"{trigger_prefix}tool 工具名 " + "命令: 根据给出的{命令}使用指定工具尽力为你得到结果。\n"
         help_text += f"{trigger_prefix}tool reset: 重置工具。\n\n"
 
+        from chatgpt_tool_hub.tools.tool_register import main_tool_register
+
         help_text += f"已加载工具列表: \n"
         for idx, tool in enumerate(main_tool_register.get_registered_tool_names()):
             if idx != 0:
@@ -93,7 +97,8 @@ class Tool(Plugin):
                     e_context.action = EventAction.BREAK
                     return
                 query = content_list[1].strip()
-                
+                from chatgpt_tool_hub.tools.tool_register import main_tool_register
+
                 use_one_tool = False
                 for tool_name in main_tool_register.get_registered_tool_names():
                     if query.startswith(tool_name):
@@ -228,6 +233,8 @@ class Tool(Plugin):
         }
 
     def _filter_tool_list(self, tool_list: list):
+        from chatgpt_tool_hub.tools.tool_register import main_tool_register
+
         valid_list = []
         for tool in tool_list:
             if tool in main_tool_register.get_registered_tool_names():
@@ -236,7 +243,10 @@ class Tool(Plugin):
                 logger.warning("[tool] filter invalid tool: " + repr(tool))
         return valid_list
 
-    def _reset_app(self) -> App:
+    def _reset_app(self) -> "App":
+        # chatgpt_tool_hub 导入较慢，在插件首次被触发实例化时才导入
+        from chatgpt_tool_hub.apps import AppFactory
+
         self.tool_config = self._read_json()
         self.app_kwargs = self._build_tool_kwargs(self.tool_config.get("kwargs", {}))
 
@@ -0,0 +1,58 @@
+"""
+ChatChannel 调度延迟基准：消息从 produce 入队到 _handle 开始处理的耗时
+
+50 个活跃会话共收到 N 条消息，另有 10000 个会话各占用唯一的并发名额并有消息在排队，
+用于观察调度耗时是否随会话总数增长。对比旧实现时在对应提交上运行同一脚本。
+
+用法: python scripts/bench_dispatch.py [N]
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bridge.context import Context, ContextType
+from channel.chat_channel import ChatChannel, Dequeue
+
+IDLE_SESSIONS = 10000
+ACTIVE_SESSIONS = 50
+
+
+def main(n):
+    latencies = []
+    finished = threading.Event()
+
+    class BenchChannel(ChatChannel):
+        def _handle(self, context):
+            latencies.append(time.perf_counter() - context["t0"])
+            if len(latencies) >= n:
+                finished.set()
+
+    channel = BenchChannel()
+    with channel.lock:
+        for i in range(IDLE_SESSIONS):
+            session_id = "idle{}".format(i)
+            semaphore = threading.BoundedSemaphore(1)
+            semaphore.acquire()
+            queue = Dequeue()
+            queue.put(Context(ContextType.TEXT, "hi", {"session_id": session_id}))
+            channel.sessions[session_id] = [queue, semaphore, "user:" + session_id, 1]
+    for i in range(n):
+        context = Context(ContextType.TEXT, "hi", {"session_id": "s{}".format(i % ACTIVE_SESSIONS), "receiver": "s{}".format(i % ACTIVE_SESSIONS)})
+        context["t0"] = time.perf_counter()
+        channel.produce(context)
+        time.sleep(0.001)
+    finished.wait(60)
+    latencies.sort()
+    print(
+        "messages={} p50={:.2f}ms p99={:.2f}ms max={:.2f}ms".format(
+            len(latencies), latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000, latencies[-1] * 1000
+        )
+    )
+    os._exit(0)  # 消费者线程不会自行退出
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,63 @@
+"""
+ExpiredDict 基准：写入大量消息 id(与 channel 消息去重的用法相同)，测量写入/查询耗时以及过期前后占用的内存
+
+过期时间为 1 小时，脚本替换 expired_dict 模块使用的时钟后直接跳到过期之后，再调用一次 expire()
+(与后台清理线程的行为相同)，不需要真的等待。
+
+用法: python scripts/bench_expired_dict.py [条目数]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common import expired_dict
+
+TTL = 3600
+
+
+class _Clock(object):
+    now = 0.0
+
+    @classmethod
+    def monotonic(cls):
+        return cls.now
+
+    sleep = staticmethod(time.sleep)
+
+
+def fill(n):
+    d = expired_dict.ExpiredDict(TTL, sweep=False)
+    for i in range(n):
+        d["msg{}".format(i)] = True
+    return d
+
+
+def main(n):
+    expired_dict.time = _Clock
+    start = time.perf_counter()
+    d = fill(n)
+    insert_cost = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(n):
+        "msg{}".format(i) in d
+    lookup_cost = time.perf_counter() - start
+    del d
+
+    tracemalloc.start()  # 内存单独测量，tracemalloc 会明显拖慢写入
+    d = fill(n)
+    before = tracemalloc.get_traced_memory()[0]
+    _Clock.now += TTL + 1
+    d.expire()
+    after = tracemalloc.get_traced_memory()[0]
+    print(
+        "entries={} insert {:.2f}s, lookup {:.2f}s, memory {:.1f}MB -> {:.1f}MB after expiry, len={}".format(
+            n, insert_cost, lookup_cost, before / 1e6, after / 1e6, len(d)
+        )
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
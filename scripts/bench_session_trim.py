@@ -0,0 +1,52 @@
+"""
+ChatGPTSession 裁剪历史记录的基准：200 轮对话裁剪到总 token 数的 10%
+
+new: 当前实现，按消息缓存 token 数，裁剪时只减去被删除消息的 token 数
+old: 模拟旧实现，每删除一条消息后重新计算全部消息的 token 数
+
+用法: python scripts/bench_session_trim.py [轮数]
+"""
+import os
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bot.chatgpt.chat_gpt_session import ChatGPTSession, num_tokens_from_messages
+
+
+def build_session(turns):
+    session = ChatGPTSession("bench", "system prompt " * 20, "gpt-3.5-turbo")
+    for i in range(turns):
+        session.add_query("question {} ".format(i) * 10)
+        session.add_reply("answer {} ".format(i) * 20)
+    return session
+
+
+def full_recount(session):
+    def calc_tokens(self):
+        return num_tokens_from_messages(self.messages, self.model)
+
+    session.calc_tokens = types.MethodType(calc_tokens, session)
+    session._pop_message = session.messages.pop
+
+
+def run(turns, old):
+    session = build_session(turns)
+    total = num_tokens_from_messages(session.messages, session.model)
+    if old:
+        full_recount(session)
+    start = time.perf_counter()
+    remaining = session.discard_exceeding(total // 10)
+    return time.perf_counter() - start, remaining, len(session.messages)
+
+
+def main(turns):
+    for name, old in (("old", True), ("new", False)):
+        cost, remaining, count = run(turns, old)
+        print("{}: {:.1f}ms, remaining tokens={}, messages={}".format(name, cost * 1000, remaining, count))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,95 @@
+"""
+触发词匹配基准：比较 PrefixMatcher/KeywordMatcher 与逐个比较的 check_prefix/check_contain
+
+随机生成中英文混合的前缀、关键词和消息，先校验两种实现结果一致，再测量每条消息的平均耗时；
+另外校验 strip_mentions 与按昵称长度降序组成的正则的替换结果一致，包括一个昵称是另一个前缀的情况
+
+用法: python scripts/bench_trigger_matcher.py
+"""
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common.trigger_matcher import MENTION_SEPARATORS, KeywordMatcher, PrefixMatcher, strip_mentions
+
+ALPHABET = "abcdefghijklmnopqrstuvwxyz群聊机器人你好今天天气怎么样"
+SIZES = (5, 16, 32, 64, 200, 1000)
+MESSAGES = 300
+ROUNDS = 20
+
+
+def check_prefix(content, prefix_list):
+    for prefix in prefix_list:
+        if content.startswith(prefix):
+            return prefix
+    return None
+
+
+def check_contain(content, keyword_list):
+    for ky in keyword_list:
+        if content.find(ky) != -1:
+            return True
+    return None
+
+
+def random_text(low, high):
+    return "".join(random.choice(ALPHABET) for _ in range(random.randint(low, high)))
+
+
+def per_message_us(func, texts):
+    return timeit.timeit(lambda: [func(t) for t in texts], number=ROUNDS) / (ROUNDS * len(texts)) * 1e6
+
+
+def strip_mentions_regex(content, names):
+    names = sorted(names, key=len, reverse=True)  # 正则分支按顺序尝试，长的昵称在前
+    pattern = "@({})[{}]".format("|".join(re.escape(name) for name in names), MENTION_SEPARATORS)
+    return re.sub(pattern, "", content)
+
+
+def check_mentions():
+    cases = [
+        ("@bot helper\u2005hi", {"bot", "bot helper"}, "hi"),
+        ("@bot\u2005hi", {"bot", "bot helper"}, "hi"),
+        ("@bot helper hi", {"bot", "bot helper"}, "hi"),
+        ("@小助手 问题 @小助手二号\u2005", {"小助手", "小助手二号"}, "问题 "),
+    ]
+    for content, names, expected in cases:
+        result = strip_mentions(content, frozenset(names))
+        assert result == expected, (content, result)
+        assert result == strip_mentions_regex(content, names), content
+    pool = ["bot", "bot helper", "bot helper 2", "小", "小助手", "a b", "a"]
+    for _ in range(20000):
+        names = frozenset(random.sample(pool, random.randint(1, len(pool))))
+        content = "".join(random.choice(["@", " ", "\u2005", "bot", " helper", "小助手", "a", "b", "2", "hi"]) for _ in range(random.randint(1, 12)))
+        assert strip_mentions(content, names) == strip_mentions_regex(content, names), (content, names)
+    print("strip_mentions: {} overlap cases and 20000 random messages match the regex".format(len(cases)))
+
+
+def main():
+    random.seed(1)
+    check_mentions()
+    for n in SIZES:
+        prefixes = [random_text(1, 6) for _ in range(n)]
+        keywords = [random_text(3, 8) for _ in range(n)]
+        prefix_matcher, keyword_matcher = PrefixMatcher(prefixes), KeywordMatcher(keywords)
+        texts = [random_text(10, 80) for _ in range(MESSAGES)]
+        for text in texts:
+            assert prefix_matcher.match(text) == check_prefix(text, prefixes), text
+            assert keyword_matcher.contains(text) == check_contain(text, keywords), text
+        print(
+            "n={:<5} prefix {:.2f}us -> {:.2f}us  keyword {:.2f}us -> {:.2f}us".format(
+                n,
+                per_message_us(lambda t: check_prefix(t, prefixes), texts),
+                per_message_us(prefix_matcher.match, texts),
+                per_message_us(lambda t: check_contain(t, keywords), texts),
+                per_message_us(keyword_matcher.contains, texts),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+检查 session_rate_limit / group_rate_limit 的突发行为：新会话和空闲很久的会话都应允许连续发送与限额相当的消息，
+超出后才被限流，之后按速率恢复
+
+脚本替换令牌桶和 ExpiredDict 使用的时钟来模拟空闲，不需要真的等待；检查失败时抛出 AssertionError
+
+用法: python scripts/check_session_quota.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bridge.context import Context, ContextType
+from channel.chat_channel import ChatChannel
+from common import expired_dict, token_bucket
+from config import conf
+
+LIMIT = 10  # 每分钟消息数
+
+
+class _Clock(object):
+    now = 1000.0
+
+    @classmethod
+    def monotonic(cls):
+        return cls.now
+
+    sleep = staticmethod(time.sleep)
+
+
+def burst(channel, session_id, isgroup=False, count=LIMIT + 2):
+    context = Context(ContextType.TEXT, "hi", {"session_id": session_id, "receiver": session_id, "isgroup": isgroup})
+    flow = channel._flow_of(context)[0]
+    return [channel._check_quota(context, flow) for _ in range(count)]
+
+
+def expect(results, allowed, label):
+    assert results == [True] * allowed + [False] * (len(results) - allowed), "{}: {}".format(label, results)
+    print("ok  {}: {}/{} allowed".format(label, allowed, len(results)))
+
+
+def main():
+    token_bucket.time = _Clock
+    expired_dict.time = _Clock
+    conf()["session_rate_limit"] = LIMIT
+    conf()["group_rate_limit"] = 0
+    channel = ChatChannel()
+
+    expect(burst(channel, "new"), LIMIT, "new session")
+    _Clock.now += 60.0 / LIMIT * 3  # 按速率恢复3条
+    expect(burst(channel, "new", count=5), 3, "refill after 18s")
+    for idle in (60, 130, 3600):  # 超过 2*容量/速率(120s) 后令牌桶会被回收
+        _Clock.now += idle
+        expect(burst(channel, "new"), LIMIT, "idle {}s".format(idle))
+
+    conf()["session_rate_limit"] = 0
+    conf()["group_rate_limit"] = LIMIT
+    expect(burst(channel, "group", isgroup=True), LIMIT, "new group")
+    _Clock.now += 3600
+    expect(burst(channel, "group", isgroup=True), LIMIT, "group idle 3600s")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,7 @@ import json
 import os
 import time
 import threading
-import requests
+from common import http_client
 
 from aip import AipSpeech
 
@@ -64,7 +64,7 @@ class BaiduVoice(Voice):
                 "client_id":     self.api_key,
                 "client_secret": self.secret_key,
             }
-            resp = requests.post(url, params=params).json()
+            resp = http_client.post(url, params=params).json()
             token = resp.get("access_token")
             expires_in = resp.get("expires_in", 2592000)
             if token:
@@ -106,7 +106,7 @@ class BaiduVoice(Voice):
             "enable_subtitle": 0,
         }
         headers = {"Content-Type": "application/json"}
-        create_resp = requests.post(create_url, headers=headers, json=payload).json()
+        create_resp = http_client.post(create_url, headers=headers, json=payload).json()
         task_id = create_resp.get("task_id")
         if not task_id:
             logger.error("[Baidu] 长文本合成创建任务失败: %s", create_resp)
@@ -117,7 +117,7 @@ class BaiduVoice(Voice):
         query_url = f"https://aip.baidubce.com/rpc/2.0/tts/v1/query?access_token={token}"
         for _ in range(100):
             time.sleep(3)
-            resp = requests.post(query_url, headers=headers, json={"task_ids":[task_id]})
+            resp = http_client.post(query_url, headers=headers, json={"task_ids":[task_id]})
             result = resp.json()
             infos = result.get("tasks_info") or result.get("tasks") or []
             if not infos:
@@ -137,7 +137,7 @@ class BaiduVoice(Voice):
             return Reply(ReplyType.ERROR, "长文本合成超时，请稍后重试")
 
         # 下载并保存音频
-        audio_data = requests.get(audio_url).content
+        audio_data = http_client.get(audio_url).content
         fn = TmpDir().path() + f"reply-long-{int(time.time())}-{hash(text)&0x7FFFFFFF}.mp3"
         with open(fn, "wb") as f:
             f.write(audio_data)
@@ -4,7 +4,7 @@ import datetime
 import os
 import random
 
-import requests
+from common import http_client
 
 from bridge.reply import Reply, ReplyType
 from common.log import logger
@@ -68,14 +68,14 @@ class DashScopeVoice(Voice):
 
         try:
             timeout = conf().get("request_timeout", 180)
-            resp = requests.post(url, headers=headers, json=payload, timeout=timeout)
+            resp = http_client.post(url, headers=headers, json=payload, timeout=timeout)
             data = resp.json()
             audio_url = (((data.get("output") or {}).get("audio") or {}).get("url")) if isinstance(data, dict) else None
             if not audio_url:
                 logger.error(f"[DashScopeVoice] textToVoice failed, status={resp.status_code}, resp={data}")
                 return Reply(ReplyType.ERROR, "语音合成失败")
 
-            audio_resp = requests.get(audio_url, timeout=timeout)
+            audio_resp = http_client.get(audio_url, timeout=timeout)
             if audio_resp.status_code >= 400:
                 logger.error(f"[DashScopeVoice] download audio failed, status={audio_resp.status_code}, url={audio_url}")
                 return Reply(ReplyType.ERROR, "语音合成失败")